@@ -1,39 +1,155 @@
-# import os
+import os
+import math
+import time
+import click
 import duckdb
 import logging
+import numpy as np
+import pyarrow as pa
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Deque, Dict, Generator, Iterable, List, Optional, Tuple
 from normality import latinize_text
 
-# from rapidfuzz.distance import Levenshtein
+from rapidfuzz import fuzz
+from rapidfuzz.distance import JaroWinkler, Levenshtein
+from rapidfuzz.process import cpdist
 from fingerprints import fingerprint
 from fingerprints import clean_entity_prefix
 from rigour.names.tokenize import tokenize_name
-# from rigour.names.compare import align_name_parts
-# from rigour.text.distance import levenshtein_similarity
 
-STATEMENTS_PATH = Path("/Users/pudo/Data/statements.csv")
-RESOLVER_PATH = Path("/Users/pudo/Code/operations/etl/data/resolve.ijson")
-con = duckdb.connect("work.duckdb")
+from pipeline import Stage, run_pipeline
+
+con: duckdb.DuckDBPyConnection
 log = logging.getLogger("duck_gen")
 
-score_count = 0
-fp_count = 0
+# Statements which contribute a name to the names table:
+NAME_STATEMENTS = (
+    "prop_type = 'name' AND prop <> 'weakAlias' AND "
+    "schema IN ('Company', 'Organization', 'Person', 'PublicBody')"
+)
+# Columns of the statements export which are used to build the names table:
+STATEMENT_COLUMNS = "entity_id, canonical_id, schema, prop, prop_type, value, lang, dataset"
+# Restricts a query to the entities touched since the previous run:
+CHANGED = "IN (SELECT entity_id FROM changed_entities)"
+# Rough writing system of a name, used to stratify samples of names:
+NAME_SCRIPT = r"""CASE
+    WHEN regexp_matches(name, '\p{Latin}') THEN 'Latn'
+    WHEN regexp_matches(name, '\p{Cyrillic}') THEN 'Cyrl'
+    WHEN regexp_matches(name, '\p{Arabic}') THEN 'Arab'
+    WHEN regexp_matches(name, '\p{Han}') THEN 'Hani'
+    WHEN regexp_matches(name, '\p{Hangul}') THEN 'Hang'
+    WHEN regexp_matches(name, '[\p{Hiragana}\p{Katakana}]') THEN 'Jpan'
+    WHEN regexp_matches(name, '\p{Greek}') THEN 'Grek'
+    WHEN regexp_matches(name, '\p{Hebrew}') THEN 'Hebr'
+    WHEN regexp_matches(name, '\p{Georgian}') THEN 'Geor'
+    WHEN regexp_matches(name, '\p{Armenian}') THEN 'Armn'
+    ELSE 'Zyyy' END"""
+# Upper bound for the number of positive pairs generated for one entity:
+MAX_PAIRS_PER_ENTITY = 100
+# Number of negative pairs sampled from names which share a token:
+NEGATIVE_SAMPLE_SIZE = 500_000
+# Number of following names in a token block each name is paired with:
+BLOCK_WINDOW = 3
+# Shorter tokens are too unspecific to block names on:
+MIN_BLOCK_TOKEN = 3
+# Strata to balance the sampled negatives over, and how they are derived:
+NEGATIVE_STRATA_COLUMNS = {
+    "category": "left_category",
+    "script": "LEAST(left_script, right_script), GREATEST(left_script, right_script)",
+    "length": "LEAST(GREATEST(length(left_norm), length(right_norm)) // 10, 4)",
+    "score": "LEAST(floor(similarity * 5), 4)",
+}
+NEGATIVE_STRATA = tuple(NEGATIVE_STRATA_COLUMNS.keys())
+
+# Number of resolver edges fetched from DuckDB at a time:
+EDGE_BATCH_SIZE = 100_000
+# Number of distinct names handed to a worker process at a time:
+NORM_BATCH_SIZE = 50_000
+# Number of pairs handed to a worker process for scoring at a time:
+SCORE_BATCH_SIZE = 100_000
+# Rows per row group in the Parquet export:
+EXPORT_ROW_GROUP_SIZE = 100_000
+# Bump this when `normalize_name` or `fingerprint_name` change, so that stale
+# entries in the normalization cache are no longer used:
+NORM_VERSION = 1
+# Key of a name in the normalization cache:
+NORM_KEY = f"md5(concat_ws('|', '{NORM_VERSION}', category, name))"
+
+
+def table_exists(name: str) -> bool:
+    """Check if a table exists in the work database."""
+    res = con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?;",
+        [name],
+    ).fetchone()
+    return res is not None and res[0] > 0
+
+
+def drop_relation(name: str):
+    """Drop a table or view from the work database, if it exists."""
+    res = con.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_name = ?;",
+        [name],
+    ).fetchone()
+    if res is not None:
+        kind = "VIEW" if res[0] == "VIEW" else "TABLE"
+        con.execute(f"DROP {kind} {name};")
 
 
-def load_statements():
-    """Load the statements from the CSV file into the DuckDB."""
-    log.info("Loading statements...")
-    con.execute("DROP TABLE IF EXISTS statements;")
+def load_statements(path: Path, materialize: bool = True):
+    """Load the name statements from the CSV file into the DuckDB. Only the
+    columns and rows needed to build the names table are kept. If `materialize`
+    is off, `statements` becomes a view on the CSV file instead, so that it is
+    streamed straight into the names table without being held in the database."""
+    log.info("Loading statements: %s...", path.as_posix())
+    drop_relation("statements")
+    source = path.resolve().as_posix().replace("'", "''")
+    kind = "TABLE" if materialize else "VIEW"
+    con.execute(f"""
+        CREATE {kind} statements AS
+        SELECT {STATEMENT_COLUMNS} FROM read_csv('{source}', header=true, all_varchar=true)
+        WHERE {NAME_STATEMENTS};
+    """)
+
+
+def update_entity_digests():
+    """Fingerprint the name statements of each canonical entity and determine
+    which entities have changed (been added, modified or removed) since the
+    previous run. The `last_seen` column is left out because it is bumped on
+    every export."""
+    log.info("Computing entity digests...")
     con.execute(
-        "CREATE TABLE statements AS SELECT * FROM read_csv(?, header=true);",
-        [STATEMENTS_PATH.as_posix()],
+        "CREATE TABLE IF NOT EXISTS entity_digests (entity_id VARCHAR, digest VARCHAR);"
     )
+    con.execute("""
+        CREATE OR REPLACE TABLE current_digests AS
+        SELECT canonical_id AS entity_id,
+               md5(string_agg(concat_ws('|', dataset, schema, prop, value, lang), chr(10)
+                              ORDER BY dataset, schema, prop, value, lang)) AS digest
+        FROM name_statements
+        GROUP BY canonical_id;
+    """)
+    con.execute("""
+        CREATE OR REPLACE TABLE changed_entities AS
+        SELECT COALESCE(cd.entity_id, ed.entity_id) AS entity_id
+        FROM current_digests cd FULL OUTER JOIN entity_digests ed ON cd.entity_id = ed.entity_id
+        WHERE cd.digest IS DISTINCT FROM ed.digest;
+    """)
+    res = con.execute("SELECT COUNT(*) FROM changed_entities;").fetchone()
+    log.info("Changed entities: %s", res[0] if res else 0)
+
+
+def commit_entity_digests():
+    """Store the current entity digests as the baseline for the next run."""
+    con.execute("CREATE OR REPLACE TABLE entity_digests AS SELECT * FROM current_digests;")
 
 
-def load_resolver():
+def load_resolver(path: Path):
     """Load the resolver data into the DuckDB."""
-    log.info("Loading resolver data...")
+    log.info("Loading resolver data: %s...", path.as_posix())
     con.execute("DROP TABLE IF EXISTS resolver;")
     con.execute(
         "CREATE TABLE resolver AS "
@@ -43,41 +159,128 @@ def load_resolver():
         "json->>2 AS judgement, "
         'json->>4 AS "user" '
         "FROM read_json(?, format = 'newline_delimited');",
-        [RESOLVER_PATH.as_posix()],
+        [path.as_posix()],
     )
-    for _ in range(15):
-        con.execute(
-            "UPDATE resolver rx SET left_id = ry.left_id FROM resolver ry "
-            "WHERE rx.left_id = ry.right_id AND ry.judgement = 'positive' AND rx.judgement <> 'positive';"
-        )
-        con.execute(
-            "UPDATE resolver rx SET right_id = ry.left_id FROM resolver ry "
-            "WHERE rx.right_id = ry.right_id AND ry.judgement = 'positive' AND rx.judgement <> 'positive';"
+
+
+class Clusters:
+    """Union-find over entity IDs, used to compute the connected components of
+    the positive resolver judgements. The root of each cluster is kept to be
+    its canonical ID."""
+
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+
+    @staticmethod
+    def rank(entity_id: str) -> Tuple[bool, str]:
+        """Prefer resolver-assigned (NK-) IDs as canonical, then the highest ID."""
+        return (entity_id.startswith("NK-"), entity_id)
+
+    def find(self, node: str) -> str:
+        parent = self.parent
+        while parent[node] != node:
+            # Path halving:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, left: str, right: str):
+        self.parent.setdefault(left, left)
+        self.parent.setdefault(right, right)
+        left, right = self.find(left), self.find(right)
+        if left == right:
+            return
+        if self.rank(left) < self.rank(right):
+            left, right = right, left
+        self.parent[right] = left
+
+    def to_table(self) -> pa.Table:
+        """Map every entity ID that was part of a judgement to its canonical ID."""
+        entity_ids = list(self.parent.keys())
+        canonical_ids = [self.find(e) for e in entity_ids]
+        # Typed explicitly, since the columns are empty without positive judgements:
+        return pa.table(
+            {"entity_id": entity_ids, "canonical_id": canonical_ids},
+            schema=pa.schema({"entity_id": pa.string(), "canonical_id": pa.string()}),
         )
 
 
-def make_names_table():
-    """Create a table of unique names from the statements."""
+def canonicalize_resolver():
+    """Assign a canonical ID to each cluster of positively judged entities and
+    write the mapping to `resolver_canonical`. The remaining (negative and
+    unsure) judgements are stored in `judgements`, referring to canonical IDs."""
+    log.info("Canonicalizing resolver data...")
+    clusters = Clusters()
+    edges = con.execute(
+        """
+        SELECT left_id, right_id FROM resolver
+        WHERE judgement = 'positive'
+            AND left_id IS NOT NULL AND right_id IS NOT NULL;
+        """
+    ).fetch_record_batch(EDGE_BATCH_SIZE)
+    for batch in edges:
+        lefts = batch.column("left_id").to_pylist()
+        rights = batch.column("right_id").to_pylist()
+        for left, right in zip(lefts, rights):
+            clusters.union(left, right)
+    mapping = clusters.to_table()
+    con.execute("CREATE OR REPLACE TABLE resolver_canonical AS SELECT * FROM mapping;")
+    con.execute("""
+        CREATE OR REPLACE TABLE judgements AS
+        SELECT COALESCE(cl.canonical_id, r.left_id) AS left_id,
+               COALESCE(cr.canonical_id, r.right_id) AS right_id,
+               r.judgement, r."user"
+        FROM resolver r
+            LEFT JOIN resolver_canonical cl ON cl.entity_id = r.left_id
+            LEFT JOIN resolver_canonical cr ON cr.entity_id = r.right_id
+        WHERE r.judgement <> 'positive';
+    """)
+    res = con.execute(
+        "SELECT COUNT(DISTINCT canonical_id) FROM resolver_canonical;"
+    ).fetchone()
+    log.info("Resolved %s entities into %s clusters.", mapping.num_rows, res[0] if res else 0)
+
+
+def make_name_statements():
+    """Define the name statements, with each entity attributed to its canonical
+    ID from the resolver data (falling back to the one in the export)."""
+    con.execute(f"""
+        CREATE OR REPLACE VIEW name_statements AS
+        SELECT s.* EXCLUDE (canonical_id),
+               COALESCE(rc.canonical_id, s.canonical_id) AS canonical_id
+        FROM statements s LEFT JOIN resolver_canonical rc ON rc.entity_id = s.entity_id
+        WHERE {NAME_STATEMENTS};
+    """)
+
+
+def make_names_table(incremental: bool = False):
+    """Create a table of unique names from the statements. In incremental mode,
+    only the names of changed entities are replaced."""
     log.info("Creating names table...")
-    con.execute("DROP TABLE IF EXISTS names;")
+    scope = "TRUE"
+    if incremental:
+        scope = f"canonical_id {CHANGED}"
+        con.execute(f"DELETE FROM names WHERE entity_id {CHANGED};")
+    else:
+        con.execute("DROP TABLE IF EXISTS names;")
+        con.execute(
+            "CREATE TABLE names (entity_id VARCHAR, schema VARCHAR, name VARCHAR, "
+            "lang VARCHAR, dataset VARCHAR, category VARCHAR, norm VARCHAR, fp VARCHAR);"
+        )
     con.execute(
-        "CREATE TABLE names AS "
-        "SELECT canonical_id AS entity_id, schema, value AS name, lang, dataset "
-        "FROM statements "
-        "WHERE prop_type = 'name' AND prop <> 'weakAlias' AND "
-        " schema IN ('Company', 'Organization', 'Person', 'PublicBody');"
-    )
-    con.execute("ALTER TABLE names ADD COLUMN category VARCHAR;")
-    con.execute("UPDATE names SET category = IF(schema = 'Person', 'PER', 'ORG');")
-    con.execute("ALTER TABLE names ADD COLUMN norm VARCHAR;")
-    con.execute("ALTER TABLE names ADD COLUMN fp VARCHAR;")
+        "INSERT INTO names "
+        "SELECT canonical_id AS entity_id, schema, value AS name, lang, dataset, "
+        "IF(schema = 'Person', 'PER', 'ORG') AS category, NULL AS norm, NULL AS fp "
+        f"FROM name_statements WHERE {scope};"
+    )
     # Remove duplicate names:
+    scope = f"entity_id {CHANGED}" if incremental else "TRUE"
     con.execute(
         "WITH ranked_names AS ( "
         "SELECT ROWID, ROW_NUMBER() OVER ( "
         "PARTITION BY name, entity_id "
         "ORDER BY lang DESC, ROWID "
-        ") AS rn FROM names) "
+        f") AS rn FROM names WHERE {scope}) "
         "DELETE FROM names "
         "WHERE ROWID IN (SELECT ROWID FROM ranked_names WHERE rn > 1);"
     )
@@ -98,151 +301,806 @@ def normalize_name(name: str, category: str) -> Optional[str]:
     tokens = tokenize_name(name)
     if len(tokens) == 0:
         return None
-    latins = (latinize_text(t) for t in tokens)
+    latins = (latinize_token(t) for t in tokens)
     norm = " ".join((p for p in latins if p is not None))
     # print(name, "->", norm)
     return norm
 
 
+@lru_cache(maxsize=500_000)
+def latinize_token(token: str) -> Optional[str]:
+    """Latinize a single name part. Name parts repeat a lot more than full
+    names do, so this is memoized."""
+    return latinize_text(token)
+
+
 def fingerprint_name(name: str, category: str) -> Optional[str]:
     """Fingerprint a name for comparison."""
-    global fp_count
-    fp_count = fp_count + 1
-    if fp_count > 0 and fp_count % 100_000 == 0:
-        log.info("Fingerprinted %s names...", fp_count)
     return fingerprint(name)
 
 
-# def ref_score(left: str, right: str) -> float:
-#     global score_count
-#     if left is None or right is None:
-#         return 0.0
-#     left = left.lower()
-#     right = right.lower()
-#     # base_distance = Levenshtein.distance(left, right)
-#     # base_score = 1.0 - (base_distance / max(len(left), len(right)))
-
-#     left_fp = fingerprint(left, keep_order=True)
-#     right_fp = fingerprint(right, keep_order=True)
-#     aligned = align_name_parts(left_fp.split(" "), right_fp.split(" "))
-#     left_aligned = " ".join([a[0] for a in aligned if a[0] is not None])
-#     right_aligned = " ".join([a[1] for a in aligned if a[1] is not None])
-#     # print("XXXX", left, right, left_aligned, right_aligned)
-#     al_distance = Levenshtein.distance(left_aligned, right_aligned)
-#     al_score = 1.0 - (al_distance / max(len(left_aligned), len(right_aligned)))
-#     score_count = score_count + 1
-#     if score_count > 0 and score_count % 100_000 == 0:
-#         log.info("Scored %s pairs...", score_count)
-#     # return max(al_score, base_score)
-#     return al_score
-
-
-def generate_name_norms():
-    """Generate a normalized version of the names."""
+def map_batches(
+    func: Callable[[pa.RecordBatch], pa.RecordBatch],
+    batches: Iterable[pa.RecordBatch],
+    workers: Optional[int] = None,
+) -> Generator[pa.RecordBatch, None, None]:
+    """Apply `func` to each batch in a pool of worker processes, yielding the
+    results in order. Only a few batches are kept in flight, so the input can
+    be streamed."""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: Deque[Future[pa.RecordBatch]] = deque()
+        for batch in batches:
+            pending.append(pool.submit(func, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def normalize_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Compute the normalized form and fingerprint for a batch of distinct
+    (key, name, category) rows. Runs inside a worker process."""
+    names = batch.column("name").to_pylist()
+    categories = batch.column("category").to_pylist()
+    norms = [normalize_name(n, c) for n, c in zip(names, categories)]
+    fps = [fingerprint_name(n, c) for n, c in zip(names, categories)]
+    return pa.record_batch(
+        [
+            batch.column("key"),
+            pa.array(norms, type=pa.string()),
+            pa.array(fps, type=pa.string()),
+        ],
+        names=["key", "norm", "fp"],
+    )
+
+
+def generate_name_norms(incremental: bool = False, workers: Optional[int] = None):
+    """Generate a normalized version of the names. Names are looked up in the
+    normalization cache first; each distinct name that has never been seen is
+    processed once, in batches spread over a pool of worker processes. The
+    cache is then extended and joined back onto the names table."""
     log.info("Generate normalized names...")
-    # con.execute("ALTER TABLE names DROP COLUMN norm IF EXISTS;")
-    con.execute("UPDATE names SET norm = normalize_name(name, category);")
-    # con.execute("ALTER TABLE names ADD COLUMN fp VARCHAR;")
-    con.execute("UPDATE names SET fp = fingerprint_name(name, category);")
+    scope = f"entity_id {CHANGED}" if incremental else "TRUE"
+    started = time.time()
+    res = con.execute(
+        f"SELECT COUNT(DISTINCT (name, category)) FROM names WHERE {scope};"
+    ).fetchone()
+    total = res[0] if res else 0
+    # Materialize the input, the connection can't stream and insert at once:
+    missing = con.execute(f"""
+        SELECT DISTINCT {NORM_KEY} AS key, name, category FROM names
+        WHERE {scope} AND {NORM_KEY} NOT IN (SELECT key FROM norm_cache.name_norms);
+    """).fetch_arrow_table()
+    log.info("Names: %s distinct, %s not in cache.", total, missing.num_rows)
+    done = 0
+    batches = missing.to_batches(max_chunksize=NORM_BATCH_SIZE)
+    for norm_batch in map_batches(normalize_batch, batches, workers=workers):
+        # Another run may have cached some of the names in the meantime:
+        con.execute(
+            "INSERT OR IGNORE INTO norm_cache.name_norms "
+            f"SELECT key, norm, fp, {NORM_VERSION} AS version FROM norm_batch;"
+        )
+        done += norm_batch.num_rows
+        log.info("Normalized %s/%s names...", done, missing.num_rows)
+    normalized = time.time()
+    # Only the rows in scope are updated, so that an incremental run does not
+    # rewrite the names of entities which have not changed:
+    con.execute(f"""
+        UPDATE names SET norm = nc.norm, fp = nc.fp
+        FROM norm_cache.name_norms nc
+        WHERE nc.key = md5(concat_ws('|', '{NORM_VERSION}', names.category, names.name))
+            AND {scope};
+    """)
+    finished = time.time()
+    res = con.execute(f"SELECT COUNT(*) FROM names WHERE {scope};").fetchone()
+    rate = missing.num_rows / max(normalized - started, 1e-9)
+    log.info(
+        "Normalized %s new names in %.1fs (%.0f names/s), updated %s rows in %.1fs.",
+        missing.num_rows,
+        normalized - started,
+        rate,
+        res[0] if res else 0,
+        finished - normalized,
+    )
+
+
+def compute_pairs(incremental: bool = False, max_pairs: int = MAX_PAIRS_PER_ENTITY):
+    """Generate positive pairs from the names of each entity. Entities with
+    hundreds of aliases would produce a quadratic number of pairs, so both the
+    names and the pairs of each entity are sampled: names with a distinct
+    normalized form come first, and the sample is spread evenly over the
+    language/script combinations present."""
+    log.info("Computing positive pairs (max. %s per entity)...", max_pairs)
+    scope = "TRUE"
+    if incremental:
+        scope = f"entity_id {CHANGED}"
+        con.execute(f"DELETE FROM pairs WHERE match AND left_id {CHANGED};")
+    else:
+        con.execute("DROP TABLE IF EXISTS pairs;")
+        con.execute("""
+            CREATE TABLE pairs (
+                left_name VARCHAR, left_norm VARCHAR, left_fp VARCHAR, left_lang VARCHAR, left_category VARCHAR,
+                right_name VARCHAR, right_norm VARCHAR, right_fp VARCHAR, right_lang VARCHAR, right_category VARCHAR,
+                match BOOLEAN, dist_norm INTEGER, dist_fp INTEGER, score FLOAT, source VARCHAR,
+                left_id VARCHAR, right_id VARCHAR,
+                sim_jaro_winkler FLOAT, sim_token_set FLOAT, sim_aligned FLOAT
+            );
+        """)
+    # Keep enough names that the pair sample can still pick across strata:
+    max_names = math.ceil(1.5 * math.sqrt(2 * max_pairs)) + 1
+    # Distances and scores are left empty so that `compute_scores` can tell
+    # which pairs have been added since the previous run.
+    con.execute(f"""
+        INSERT INTO pairs BY NAME
+        WITH ranked_names AS (
+            SELECT *, {NAME_SCRIPT} AS script, COALESCE(lang, '') AS stratum_lang,
+                hash(entity_id, name, lang) AS shuffle,
+                ROW_NUMBER() OVER (PARTITION BY entity_id, norm ORDER BY hash(entity_id, name, lang)) AS norm_rank
+            FROM names WHERE {scope}
+        ), stratified_names AS (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY entity_id, script, stratum_lang ORDER BY norm_rank, shuffle
+            ) AS stratum_rank
+            FROM ranked_names
+        ), sampled_names AS (
+            SELECT * FROM stratified_names
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY entity_id ORDER BY norm_rank, stratum_rank, shuffle
+            ) <= {max_names}
+        ), candidates AS (
+            SELECT nl.name AS left_name, nl.norm as left_norm, nl.fp AS left_fp, nl.lang AS left_lang, nl.category AS left_category,
+                nr.name AS right_name, nr.norm as right_norm, nr.fp AS right_fp, nr.lang AS right_lang, nr.category AS right_category,
+                nl.entity_id AS entity_id, hash(nl.name, nr.name) AS shuffle,
+                ROW_NUMBER() OVER (
+                    PARTITION BY nl.entity_id, LEAST(nl.norm, nr.norm), GREATEST(nl.norm, nr.norm)
+                    ORDER BY hash(nl.name, nr.name)
+                ) AS norm_pair_rank,
+                ROW_NUMBER() OVER (
+                    PARTITION BY nl.entity_id,
+                        LEAST(nl.script, nr.script), GREATEST(nl.script, nr.script),
+                        LEAST(nl.stratum_lang, nr.stratum_lang), GREATEST(nl.stratum_lang, nr.stratum_lang)
+                    ORDER BY nl.norm IS DISTINCT FROM nr.norm DESC, hash(nl.name, nr.name)
+                ) AS stratum_rank
+            FROM sampled_names nl JOIN sampled_names nr
+                ON nl.entity_id = nr.entity_id AND LOWER(nl.name) > LOWER(nr.name)
+        )
+        SELECT left_name, left_norm, left_fp, left_lang, left_category,
+               right_name, right_norm, right_fp, right_lang, right_category,
+               true AS match, NULL AS dist_norm, NULL AS dist_fp, NULL AS score, entity_id AS source,
+               entity_id AS left_id, entity_id AS right_id
+        FROM candidates
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY entity_id ORDER BY norm_pair_rank, stratum_rank, shuffle
+        ) <= {max_pairs};
+    """)
 
 
-def compute_pairs():
-    log.info("Computing positive pairs...")
-    con.execute("DROP TABLE IF EXISTS pairs;")
+def make_entity_norms():
+    """Collect the normalized names of each entity, so that pairs of entities
+    sharing a name can be ruled out as negatives without joining the names."""
     con.execute("""
-        CREATE TABLE pairs AS
-        SELECT nl.name AS left_name, nl.norm as left_norm, nl.fp AS left_fp, nl.lang AS left_lang, nl.category AS left_category,
-               nr.name AS right_name, nr.norm as right_norm, nr.fp AS right_fp, nr.lang AS right_lang, nr.category AS right_category,
-               true AS match, 0 AS dist_norm, 0 AS dist_fp, 0.0 AS score, nr.entity_id AS source
-        FROM names nl, names nr
-        WHERE nl.entity_id = nr.entity_id AND LOWER(nl.name) > LOWER(nr.name);
+        CREATE OR REPLACE TEMP TABLE entity_norms AS
+        SELECT entity_id, list(DISTINCT norm) AS norms
+        FROM names WHERE norm IS NOT NULL GROUP BY entity_id;
     """)
-    # NB: Can filter on nl.norm <> nr.norm here.
 
 
-def compute_non_pairs():
-    log.info("Computing negatives pairs...")
+def compute_non_pairs(incremental: bool = False):
+    """Generate negative pairs from the resolver's negative and unsure
+    judgements, leaving out entities which share a normalized name."""
+    log.info("Computing negative pairs from judgements...")
+    make_entity_norms()
     con.execute("DROP TABLE IF EXISTS non_pairs;")
-    # Create a table of non-pairs from the resolver data:
     con.execute("""
-        CREATE TABLE non_pairs AS 
-        SELECT GREATEST(left_id, right_id) AS max_id, LEAST(left_id, right_id) AS min_id, judgement AS source 
-        FROM resolver WHERE judgement IN ('unsure', 'negative');
+        CREATE TABLE non_pairs AS
+        SELECT DISTINCT GREATEST(j.left_id, j.right_id) AS max_id, LEAST(j.left_id, j.right_id) AS min_id, j.judgement AS source
+        FROM judgements j
+        LEFT JOIN entity_norms el ON el.entity_id = j.left_id
+        LEFT JOIN entity_norms er ON er.entity_id = j.right_id
+        WHERE j.judgement IN ('unsure', 'negative')
+            AND NOT list_has_any(COALESCE(el.norms, []), COALESCE(er.norms, []));
+    """)
+    # Drop judged pairs which involve a changed entity or are no longer wanted:
+    cleanup = "TRUE"
+    if incremental:
+        cleanup = f"""p.left_id {CHANGED} OR p.right_id {CHANGED} OR NOT EXISTS (
+            SELECT 1 FROM non_pairs np WHERE np.max_id = p.left_id AND np.min_id = p.right_id
+        )"""
+    con.execute(f"""
+        DELETE FROM pairs p WHERE NOT p.match AND p.source IN ('unsure', 'negative') AND ({cleanup});
     """)
-    # Pick some wikidata comparisons by random:
-    con.execute(
-        "INSERT INTO non_pairs "
-        "WITH entities AS (SELECT DISTINCT entity_id AS id FROM names WHERE STARTS_WITH(id, 'Q') USING SAMPLE 1000 ROWS) "
-        "SELECT r.id AS max_id, l.id AS min_id, CONCAT(r.id, '<>', l.id) AS source FROM entities r, entities l WHERE r.id > l.id;"
-    )
-    # Remove pairs where a matching name exists:
-    con.execute(
-        "DELETE FROM non_pairs np "
-        "USING names nma, names nmi "
-        "WHERE nma.norm = nmi.norm AND np.max_id = nma.entity_id AND np.min_id = nmi.entity_id;"
-    )
     # Make actual name pairs:
     con.execute("""
-        INSERT INTO pairs 
+        INSERT INTO pairs BY NAME
         SELECT nma.name AS left_name, nma.norm AS left_norm, nma.fp AS left_fp, nma.lang AS left_lang, nma.category AS left_category, 
-        nmi.name AS right_name, nmi.norm AS right_norm, nmi.fp AS right_fp, nmi.lang AS right_lang, nmi.category AS right_category, 
-        false AS match, 0 AS dist_norm, 0 AS dist_fp, 0.0 AS score, np.source AS source
+        nmi.name AS right_name, nmi.norm AS right_norm, nmi.fp AS right_fp, nmi.lang AS right_lang, nmi.category AS right_category,
+        false AS match, NULL AS dist_norm, NULL AS dist_fp, NULL AS score, np.source AS source,
+        np.max_id AS left_id, np.min_id AS right_id
         FROM non_pairs np 
         JOIN names nma ON np.max_id = nma.entity_id 
-        JOIN names nmi ON np.min_id = nmi.entity_id;
+        JOIN names nmi ON np.min_id = nmi.entity_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM pairs p WHERE NOT p.match AND p.source IN ('unsure', 'negative')
+            AND p.left_id = np.max_id AND p.right_id = np.min_id
+        );
+    """)
+
+
+def sample_non_pairs(
+    incremental: bool = False,
+    count: int = NEGATIVE_SAMPLE_SIZE,
+    strata: Iterable[str] = NEGATIVE_STRATA,
+    window: int = BLOCK_WINDOW,
+):
+    """Sample negative pairs from names of different entities which share a
+    token. Within the block of each token, names are shuffled and every name
+    is paired with the next `window` names, so the number of candidates grows
+    linearly with the number of names. The candidates are then sampled evenly
+    across the given strata (see `NEGATIVE_STRATA_COLUMNS`), which makes sure
+    that hard negatives from the upper score bands are well represented.
+    params:
+        count: int
+            The number of negative pairs to sample. Incremental runs drop the
+            negatives of changed entities and top the sample back up to it.
+        strata: Iterable[str]
+            The names of the strata to balance the sample over.
+        window: int
+            The number of following names in a block each name is paired with.
+    """
+    strata = list(strata)
+    for stratum in strata:
+        if stratum not in NEGATIVE_STRATA_COLUMNS:
+            raise ValueError(f"Unknown negative stratum: {stratum}")
+    partition = ", ".join(NEGATIVE_STRATA_COLUMNS[s] for s in strata) or "NULL"
+    make_entity_norms()
+    scope = "TRUE"
+    if incremental:
+        scope = f"(c.max_id {CHANGED} OR c.min_id {CHANGED})"
+        con.execute(f"""
+            DELETE FROM pairs p WHERE NOT p.match AND p.source LIKE 'block:%'
+            AND (p.left_id {CHANGED} OR p.right_id {CHANGED});
+        """)
+        # Top the sample back up to its full size from pairs of the changed entities:
+        res = con.execute("SELECT COUNT(*) FROM pairs WHERE NOT match AND source LIKE 'block:%';").fetchone()
+        count = max(count - (res[0] if res else 0), 0)
+    else:
+        con.execute("DELETE FROM pairs WHERE NOT match AND source LIKE 'block:%';")
+    log.info("Sampling %s negative pairs by %s...", count, ", ".join(strata) or "-")
+
+    # Number the names in a fixed order, so that the sample is reproducible:
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE block_names AS
+        SELECT ROW_NUMBER() OVER (ORDER BY entity_id, name, lang, dataset, schema) AS name_id, entity_id, name, norm, fp, lang, category, {NAME_SCRIPT} AS script
+        FROM names WHERE norm IS NOT NULL;
     """)
+    neighbours = ", ".join(f"LEAD(nb, {i}) OVER w" for i in range(1, window + 1))
+    con.execute(f"""
+        INSERT INTO pairs BY NAME
+        WITH tokens AS (
+            SELECT token, struct_pack(name_id := name_id, entity_id := entity_id) AS nb
+            FROM (SELECT name_id, entity_id, unnest(string_split(norm, ' ')) AS token FROM block_names)
+            WHERE length(token) >= {MIN_BLOCK_TOKEN}
+        ), blocks AS (
+            SELECT token, nb, [{neighbours}] AS others
+            FROM tokens WINDOW w AS (PARTITION BY token ORDER BY hash(token, nb.name_id))
+        ), neighbours AS (
+            SELECT token, nb, unnest(others) AS other FROM blocks
+        ), candidates AS (
+            SELECT token,
+                GREATEST(nb.entity_id, other.entity_id) AS max_id,
+                LEAST(nb.entity_id, other.entity_id) AS min_id,
+                IF(nb.entity_id > other.entity_id, nb.name_id, other.name_id) AS max_name_id,
+                IF(nb.entity_id > other.entity_id, other.name_id, nb.name_id) AS min_name_id
+            FROM neighbours
+            WHERE other IS NOT NULL AND nb.entity_id <> other.entity_id
+        ), entity_pairs AS (
+            -- One name pair per entity pair, and none for entities sharing a name:
+            SELECT c.*, hash(c.max_name_id, c.min_name_id) AS shuffle
+            FROM candidates c
+            JOIN entity_norms el ON el.entity_id = c.max_id
+            JOIN entity_norms er ON er.entity_id = c.min_id
+            WHERE {scope} AND NOT list_has_any(el.norms, er.norms)
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY c.max_id, c.min_id ORDER BY hash(c.max_name_id, c.min_name_id)) = 1
+        ), scored AS (
+            SELECT ep.token, ep.shuffle, ep.max_id, ep.min_id,
+                nl.name AS left_name, nl.norm AS left_norm, nl.fp AS left_fp, nl.lang AS left_lang, nl.category AS left_category, nl.script AS left_script,
+                nr.name AS right_name, nr.norm AS right_norm, nr.fp AS right_fp, nr.lang AS right_lang, nr.category AS right_category, nr.script AS right_script,
+                jaro_winkler_similarity(nl.norm, nr.norm) AS similarity
+            FROM entity_pairs ep
+            JOIN block_names nl ON nl.name_id = ep.max_name_id
+            JOIN block_names nr ON nr.name_id = ep.min_name_id
+            WHERE nl.category = nr.category
+        ), stratified AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY shuffle) AS stratum_rank
+            FROM scored
+        )
+        SELECT left_name, left_norm, left_fp, left_lang, left_category,
+            right_name, right_norm, right_fp, right_lang, right_category,
+            false AS match, NULL AS dist_norm, NULL AS dist_fp, NULL AS score, CONCAT('block:', token) AS source,
+            max_id AS left_id, min_id AS right_id
+        FROM stratified
+        ORDER BY stratum_rank, shuffle
+        LIMIT {count};
+    """)
+    con.execute("DROP TABLE block_names;")
+
+
+def align_name_parts(left: str, right: str) -> Tuple[str, str]:
+    """Re-order the parts of two names so that the most similar parts of each
+    line up, with unmatched parts at the end."""
+    left_parts = left.split(" ")
+    right_parts = right.split(" ")
+    candidates = sorted(
+        (
+            (Levenshtein.normalized_similarity(lp, rp), li, ri)
+            for li, lp in enumerate(left_parts)
+            for ri, rp in enumerate(right_parts)
+        ),
+        reverse=True,
+    )
+    left_order: List[int] = []
+    right_order: List[int] = []
+    for _, li, ri in candidates:
+        if li not in left_order and ri not in right_order:
+            left_order.append(li)
+            right_order.append(ri)
+    left_order.extend(i for i in range(len(left_parts)) if i not in left_order)
+    right_order.extend(i for i in range(len(right_parts)) if i not in right_order)
+    left_aligned = " ".join(left_parts[i] for i in left_order)
+    right_aligned = " ".join(right_parts[i] for i in right_order)
+    return left_aligned, right_aligned
+
+
+def aligned_similarity(left: Optional[str], right: Optional[str]) -> Optional[float]:
+    """Levenshtein similarity of two names after aligning their parts."""
+    if not left or not right:
+        return None
+    left_aligned, right_aligned = align_name_parts(left, right)
+    return Levenshtein.normalized_similarity(left_aligned, right_aligned)
+
+
+def _similarity(scorer, lefts: List[Optional[str]], rights: List[Optional[str]]):
+    """Compute a similarity for each pair of strings, NaN where either is
+    missing or both are empty."""
+    sims = cpdist(
+        [v or "" for v in lefts],
+        [v or "" for v in rights],
+        scorer=scorer,
+        dtype=np.float32,
+    )
+    missing = np.array([not (lv and rv) for lv, rv in zip(lefts, rights)])
+    sims[missing] = np.nan
+    return sims
+
 
+def score_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Compute all distance metrics for a batch of pairs. Runs inside a worker
+    process; the edit distances are computed by rapidfuzz in C."""
+    left_norms = batch.column("left_norm").to_pylist()
+    right_norms = batch.column("right_norm").to_pylist()
+    left_fps = batch.column("left_fp").to_pylist()
+    right_fps = batch.column("right_fp").to_pylist()
+    lev_norm = _similarity(Levenshtein.normalized_similarity, left_norms, right_norms)
+    lev_fp = _similarity(Levenshtein.normalized_similarity, left_fps, right_fps)
+    dist_norm = cpdist(
+        [v or "" for v in left_norms],
+        [v or "" for v in right_norms],
+        scorer=Levenshtein.distance,
+        dtype=np.int32,
+    )
+    dist_fp = cpdist(
+        [v or "" for v in left_fps],
+        [v or "" for v in right_fps],
+        scorer=Levenshtein.distance,
+        dtype=np.int32,
+    )
+    jaro_winkler = _similarity(JaroWinkler.normalized_similarity, left_norms, right_norms)
+    token_set = _similarity(fuzz.token_set_ratio, left_norms, right_norms) / 100.0
+    aligned = [aligned_similarity(ln, rn) for ln, rn in zip(left_norms, right_norms)]
+    no_norm = np.array([ln is None or rn is None for ln, rn in zip(left_norms, right_norms)])
+    no_fp = np.array([lf is None or rf is None for lf, rf in zip(left_fps, right_fps)])
+    # Pairs without a comparable form of both names score 0 rather than NULL,
+    # so that `compute_scores` does not pick them up again on every run:
+    score = np.nan_to_num(np.fmax(lev_norm, lev_fp), nan=0.0)
+    return pa.record_batch(
+        [
+            batch.column("pair_id"),
+            pa.array(dist_norm, mask=no_norm),
+            pa.array(dist_fp, mask=no_fp),
+            pa.array(score),
+            pa.array(jaro_winkler, from_pandas=True),
+            pa.array(token_set, from_pandas=True),
+            pa.array(aligned, type=pa.float32()),
+        ],
+        names=[
+            "pair_id",
+            "dist_norm",
+            "dist_fp",
+            "score",
+            "sim_jaro_winkler",
+            "sim_token_set",
+            "sim_aligned",
+        ],
+    )
 
-def compute_scores():
+
+def compute_scores(workers: Optional[int] = None):
+    """Compute distances and scores for all pairs which have not been scored.
+    All metrics are computed in one pass over the pairs, in batches spread
+    over a pool of worker processes, and then written back to the table."""
     log.info("Computing distances and scores...")
-    con.execute("UPDATE pairs SET dist_norm = levenshtein(left_norm, right_norm);")
-    con.execute("UPDATE pairs SET dist_fp = levenshtein(left_fp, right_fp);")
-    con.execute("""
-        UPDATE pairs SET score = GREATEST(
-                (1.0 - (dist_norm::FLOAT / GREATEST(LENGTH(left_norm)::FLOAT, LENGTH(right_norm)::FLOAT))),
-                (1.0 - (dist_fp::FLOAT / GREATEST(LENGTH(left_fp)::FLOAT, LENGTH(right_fp)::FLOAT)))
-        );
+    started = time.time()
+    con.execute(
+        "CREATE OR REPLACE TABLE pair_scores (pair_id BIGINT, dist_norm INTEGER, "
+        "dist_fp INTEGER, score FLOAT, sim_jaro_winkler FLOAT, sim_token_set FLOAT, "
+        "sim_aligned FLOAT);"
+    )
+    # Stream the pairs through a separate cursor while inserting the scores:
+    batches = (
+        con.cursor()
+        .execute(
+            "SELECT rowid AS pair_id, left_norm, right_norm, left_fp, right_fp "
+            "FROM pairs WHERE score IS NULL;"
+        )
+        .fetch_record_batch(SCORE_BATCH_SIZE)
+    )
+    done = 0
+    for scores in map_batches(score_batch, batches, workers=workers):
+        con.execute("INSERT INTO pair_scores SELECT * FROM scores;")
+        done += scores.num_rows
+        log.info("Scored %s pairs...", done)
+    scored = time.time()
+    columns = [
+        "dist_norm",
+        "dist_fp",
+        "score",
+        "sim_jaro_winkler",
+        "sim_token_set",
+        "sim_aligned",
+    ]
+    # Only the newly scored rows are written, the rest of the table is left as is:
+    updates = ", ".join(f"{c} = ps.{c}" for c in columns)
+    con.execute(f"""
+        UPDATE pairs SET {updates}
+        FROM pair_scores ps WHERE pairs.rowid = ps.pair_id;
     """)
+    con.execute("DROP TABLE pair_scores;")
+    log.info(
+        "Scored %s pairs in %.1fs (%.0f pairs/s), written in %.1fs.",
+        done,
+        scored - started,
+        done / max(scored - started, 1e-9),
+        time.time() - scored,
+    )
 
 
-def export_pairs():
-    log.info("Exporting pairs...")
-    path = Path("pairs.csv").resolve().as_posix()
-    con.execute(f"COPY pairs TO '{path}';")
+def export_pairs(path: Path):
+    """Export the pairs, either as a single CSV file (if the path ends in `.csv`)
+    or as a Parquet dataset partitioned by `match` and `category`, sorted by
+    score so that row-group statistics allow skipping on it."""
+    log.info("Exporting pairs: %s...", path.as_posix())
+    target = path.resolve().as_posix().replace("'", "''")
+    if path.suffix == ".csv":
+        con.execute(f"COPY pairs TO '{target}';")
+        return
+    # Only a previous export, which holds nothing but the match partitions, is
+    # replaced; DuckDB's OVERWRITE removes everything in the directory:
+    if path.exists():
+        entries = list(path.iterdir()) if path.is_dir() else [path]
+        if any(not (e.is_dir() and e.name.startswith("match=")) for e in entries):
+            raise ValueError(f"Not a pairs export, refusing to overwrite: {path}")
+    con.execute(f"""
+        COPY (SELECT *, left_category AS category FROM pairs ORDER BY score)
+        TO '{target}' (
+            FORMAT PARQUET, PARTITION_BY (match, category), COMPRESSION ZSTD,
+            ROW_GROUP_SIZE {EXPORT_ROW_GROUP_SIZE}, OVERWRITE
+        );
+    """)
 
 
-def init_stuff():
+def init_stuff(
+    work_path: Path,
+    cache_path: Path,
+    memory_limit: Optional[str] = None,
+    threads: Optional[int] = None,
+    temp_path: Optional[Path] = None,
+):
+    global con
     logging.basicConfig(level=logging.INFO)
-    con.create_function(
-        "normalize_name",
-        normalize_name,
-        parameters=[duckdb.typing.VARCHAR, duckdb.typing.VARCHAR],
-        return_type=duckdb.typing.VARCHAR,
-        null_handling="special",
-    )
-    con.create_function(
-        "fingerprint_name",
-        fingerprint_name,
-        parameters=[duckdb.typing.VARCHAR, duckdb.typing.VARCHAR],
-        return_type=duckdb.typing.VARCHAR,
-        null_handling="special",
-    )
-    # con.create_function(
-    #     "ref_score",
-    #     ref_score,
-    #     parameters=[duckdb.typing.VARCHAR, duckdb.typing.VARCHAR],
-    #     return_type=duckdb.typing.FLOAT,
-    #     null_handling="special",
-    # )
+    # Not preserving insertion order lets DuckDB stream large inserts and
+    # spill to disk rather than buffer them in memory:
+    config: Dict[str, Any] = {"preserve_insertion_order": False}
+    if memory_limit is not None:
+        config["memory_limit"] = memory_limit
+    if threads is not None:
+        config["threads"] = threads
+    if temp_path is not None:
+        config["temp_directory"] = temp_path.as_posix()
+    con = duckdb.connect(work_path.as_posix(), config=config)
+    # The normalization cache lives in its own file so it can be shared by
+    # several work databases and survive deleting them:
+    cache_path = cache_path.resolve().as_posix().replace("'", "''")
+    con.execute(f"ATTACH '{cache_path}' AS norm_cache;")
+    columns = con.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_catalog = 'norm_cache' AND table_name = 'name_norms';"
+    ).fetchall()
+    if columns and ("version",) not in columns:
+        # Caches from before the key constraint may hold duplicate keys, and
+        # the version of their entries is unknown:
+        log.info("Dropping normalization cache in an old format.")
+        con.execute("DROP TABLE norm_cache.name_norms;")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS norm_cache.name_norms "
+        "(key VARCHAR PRIMARY KEY, norm VARCHAR, fp VARCHAR, version INTEGER);"
+    )
+    # Entries of other versions are never looked up again:
+    con.execute(
+        f"DELETE FROM norm_cache.name_norms WHERE version <> {NORM_VERSION};"
+    )
+
+
+def pipeline_stages(
+    statements_path: Path,
+    resolver_path: Path,
+    output_path: Path,
+    max_pairs: int = MAX_PAIRS_PER_ENTITY,
+    negatives: int = NEGATIVE_SAMPLE_SIZE,
+    negative_strata: Iterable[str] = NEGATIVE_STRATA,
+    workers: Optional[int] = None,
+    materialize: bool = True,
+) -> List[Stage]:
+    """The stages of building the pairs, and what each of them depends on."""
+    return [
+        Stage(
+            "load_statements",
+            load_statements,
+            params={"path": statements_path, "materialize": materialize},
+            # Counting the rows of the view would read the whole file:
+            table="statements" if materialize else None,
+        ),
+        Stage(
+            "load_resolver",
+            load_resolver,
+            params={"path": resolver_path},
+            table="resolver",
+        ),
+        Stage(
+            "canonicalize_resolver",
+            canonicalize_resolver,
+            deps=["load_resolver"],
+            table="resolver_canonical",
+        ),
+        Stage(
+            "make_name_statements",
+            make_name_statements,
+            deps=["load_statements", "canonicalize_resolver"],
+        ),
+        Stage(
+            "update_entity_digests",
+            update_entity_digests,
+            deps=["make_name_statements"],
+            table="changed_entities",
+        ),
+        Stage(
+            "make_names_table",
+            make_names_table,
+            deps=["update_entity_digests"],
+            table="names",
+            incremental=True,
+        ),
+        Stage(
+            "generate_name_norms",
+            generate_name_norms,
+            deps=["make_names_table"],
+            options={"workers": workers},
+            table="names",
+            incremental=True,
+            version=NORM_VERSION,
+        ),
+        Stage(
+            "compute_pairs",
+            compute_pairs,
+            deps=["generate_name_norms"],
+            params={"max_pairs": max_pairs},
+            table="pairs",
+            incremental=True,
+        ),
+        Stage(
+            "compute_non_pairs",
+            compute_non_pairs,
+            deps=["compute_pairs", "canonicalize_resolver"],
+            table="pairs",
+            incremental=True,
+        ),
+        Stage(
+            "sample_non_pairs",
+            sample_non_pairs,
+            deps=["compute_non_pairs"],
+            params={"count": negatives, "strata": tuple(negative_strata)},
+            table="pairs",
+            incremental=True,
+        ),
+        Stage(
+            "commit_entity_digests",
+            commit_entity_digests,
+            deps=["sample_non_pairs"],
+            table="entity_digests",
+        ),
+        Stage(
+            "compute_scores",
+            compute_scores,
+            deps=["sample_non_pairs"],
+            options={"workers": workers},
+            table="pairs",
+        ),
+        Stage(
+            "export_pairs",
+            export_pairs,
+            deps=["compute_scores"],
+            options={"path": output_path},
+            output=output_path,
+        ),
+    ]
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--statements",
+    "statements_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    required=True,
+    help="Statements CSV export.",
+)
+@click.option(
+    "-r",
+    "--resolver",
+    "resolver_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    required=True,
+    help="Resolver judgements (resolve.ijson).",
+)
+@click.option(
+    "-w",
+    "--work",
+    "work_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=Path("work.duckdb"),
+    help="DuckDB file holding the intermediate tables.",
+)
+@click.option(
+    "-c",
+    "--cache",
+    "cache_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=Path("norm_cache.duckdb"),
+    help="DuckDB file caching name normalizations across runs.",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_path",
+    type=click.Path(path_type=Path),
+    default=Path("pairs"),
+    help="Output directory for the partitioned Parquet pairs, or a .csv file.",
+)
+@click.option(
+    "--max-pairs",
+    type=int,
+    default=MAX_PAIRS_PER_ENTITY,
+    help="Maximum number of positive pairs per entity.",
+)
+@click.option(
+    "--negatives",
+    type=int,
+    default=NEGATIVE_SAMPLE_SIZE,
+    help="Number of negative pairs to sample from names sharing a token.",
+)
+@click.option(
+    "--negative-strata",
+    type=str,
+    default=",".join(NEGATIVE_STRATA),
+    help="Comma-separated strata to balance sampled negatives over.",
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of worker processes for normalization and scoring (default: all cores).",
+)
+@click.option(
+    "--stream-statements",
+    is_flag=True,
+    default=False,
+    help="Read the statements CSV on demand instead of loading it into the database.",
+)
+@click.option(
+    "--memory-limit",
+    type=str,
+    default=None,
+    help="DuckDB memory limit, e.g. 24GB (default: 80% of RAM).",
+)
+@click.option(
+    "--threads",
+    type=int,
+    default=None,
+    help="Number of DuckDB threads (default: all cores).",
+)
+@click.option(
+    "--temp-dir",
+    "temp_path",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Directory for DuckDB to spill to when it runs out of memory.",
+)
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only recompute names and pairs for entities changed since the last run.",
+)
+@click.option(
+    "-f",
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Re-run all stages, even if they are up to date.",
+)
+@click.option(
+    "-S",
+    "--stage",
+    "targets",
+    multiple=True,
+    help="Only run up to the given stage(s), default: all.",
+)
+def main(
+    statements_path: Path,
+    resolver_path: Path,
+    work_path: Path,
+    cache_path: Path,
+    output_path: Path,
+    max_pairs: int,
+    negatives: int,
+    negative_strata: str,
+    workers: Optional[int],
+    stream_statements: bool,
+    memory_limit: Optional[str],
+    threads: Optional[int],
+    temp_path: Optional[Path],
+    incremental: bool,
+    force: bool,
+    targets: Tuple[str, ...],
+):
+    init_stuff(
+        work_path,
+        cache_path,
+        memory_limit=memory_limit,
+        threads=threads,
+        temp_path=temp_path,
+    )
+    stages = pipeline_stages(
+        statements_path,
+        resolver_path,
+        output_path,
+        max_pairs=max_pairs,
+        negatives=negatives,
+        negative_strata=[s.strip() for s in negative_strata.split(",") if s.strip()],
+        workers=workers,
+        materialize=not stream_statements,
+    )
+    run_pipeline(
+        con,
+        stages,
+        targets=targets or None,
+        incremental=incremental,
+        force=force,
+    )
+    con.close()
 
 
 if __name__ == "__main__":
-    init_stuff()
-    # load_statements()
-    # load_resolver()
-    # make_names_table()
-    # generate_name_norms()
-    # compute_pairs()
-    # compute_non_pairs()
-    # compute_scores()
-    export_pairs()
+    main()
@@ -1,4 +1,5 @@
 import csv
+import click
 import orjson
 import logging
 from pathlib import Path
@@ -11,7 +12,6 @@ from nomenklatura.util import bool_text
 
 log = logging.getLogger("genpairs")
 
-STATEMENTS_PATH = Path("/Users/pudo/Data/statements.csv")
 SCHEMATA = ("Organization", "Person", "Company", "PublicBody")
 HEADERS = ["left", "right", "match", "type"]
 DEDUPED_DATASETS = set(
@@ -53,10 +53,10 @@ ENTITY_DATASETS: Dict[str, Set[str]] = {}
 NAME_TYPES: Dict[str, str] = {}
 
 
-def load_entities():
-    log.info("Loading entities: %s..." % STATEMENTS_PATH.as_posix())
+def load_entities(statements_path: Path):
+    log.info("Loading entities: %s..." % statements_path.as_posix())
     name_count = 0
-    with open(STATEMENTS_PATH, "r") as fh:
+    with open(statements_path, "r") as fh:
         for row in csv.DictReader(fh):
             if row["schema"] not in SCHEMATA:
                 continue
@@ -145,15 +145,36 @@ def generate_pairs():
         yield left, right, match, NAME_TYPES[left]
 
 
-def write_csv():
-    with open("pairs.csv", "w") as fh:
+def write_csv(output_path: Path):
+    with open(output_path, "w") as fh:
         writer = csv.writer(fh, dialect=csv.unix_dialect)
         writer.writerow(HEADERS)
         for left, right, match, type in generate_pairs():
             writer.writerow([left, right, bool_text(match), type])
 
 
-if __name__ == "__main__":
+@click.command()
+@click.option(
+    "-s",
+    "--statements",
+    "statements_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    required=True,
+    help="Statements CSV export.",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=Path("pairs.csv"),
+    help="Output file for the generated pairs.",
+)
+def main(statements_path: Path, output_path: Path):
     logging.basicConfig(level=logging.INFO)
-    load_entities()
-    write_csv()
+    load_entities(statements_path)
+    write_csv(output_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import sys
+import time
+import duckdb
+import hashlib
+import logging
+import resource
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+log = logging.getLogger("pipeline")
+
+# Seconds between two samples of the memory use of a running stage:
+MEMORY_INTERVAL = 0.2
+
+
+class Stage:
+    """A step of the pipeline. A stage is skipped if it has completed before
+    with the same parameters and the same upstream stages, and its output still
+    exists.
+
+    `params` are passed to the stage function and determine its fingerprint;
+    input files among them are fingerprinted by size and last-modified time.
+    `options` are passed to the function without affecting the fingerprint.
+    Bumping `version` forces the stage to be re-run.
+    Stages marked `incremental` are told to only process what has changed
+    whenever only their upstream data differs from the previous run."""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        deps: Iterable[str] = (),
+        params: Optional[Dict[str, Any]] = None,
+        options: Optional[Dict[str, Any]] = None,
+        table: Optional[str] = None,
+        output: Optional[Path] = None,
+        incremental: bool = False,
+        version: int = 1,
+    ):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.options = options or {}
+        self.table = table
+        self.output = output
+        self.incremental = incremental
+        self.version = version
+
+    @property
+    def params_fingerprint(self) -> str:
+        digest = hashlib.md5(f"{self.name}:{self.version}".encode("utf-8"))
+        for key, value in sorted(self.params.items()):
+            if isinstance(value, Path) and value.is_file():
+                stat = value.stat()
+                value = f"{value.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+            digest.update(f"{key}={value!r}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def __repr__(self) -> str:
+        return f"<Stage({self.name!r})>"
+
+
+class MemoryMonitor(threading.Thread):
+    """Sample the resident memory of the process while a stage runs."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = current_memory()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(MEMORY_INTERVAL):
+            self.peak = max(self.peak, current_memory())
+
+    def stop(self) -> int:
+        self.stopped.set()
+        self.join()
+        return max(self.peak, current_memory())
+
+
+def current_memory() -> int:
+    """Resident memory of the process in bytes. Where /proc is not available,
+    this falls back to the peak memory of the process so far."""
+    try:
+        with open("/proc/self/statm", "r") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes:
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _table_rows(con: duckdb.DuckDBPyConnection, table: str) -> Optional[int]:
+    res = con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?;",
+        [table],
+    ).fetchone()
+    if res is None or res[0] == 0:
+        return None
+    res = con.execute(f"SELECT COUNT(*) FROM {table};").fetchone()
+    return res[0] if res else None
+
+
+def _resolve(stages: Dict[str, Stage], targets: Iterable[str]) -> List[Stage]:
+    """List the target stages and everything upstream, in dependency order."""
+    order: List[Stage] = []
+    seen: Set[str] = set()
+
+    def visit(name: str, path: List[str]):
+        if name in path:
+            raise ValueError(f"Cycle in pipeline: {' -> '.join(path + [name])}")
+        if name not in stages:
+            raise ValueError(f"Unknown stage: {name}")
+        if name in seen:
+            return
+        for dep in stages[name].deps:
+            visit(dep, path + [name])
+        seen.add(name)
+        order.append(stages[name])
+
+    for target in targets:
+        visit(target, [])
+    return order
+
+
+def run_pipeline(
+    con: duckdb.DuckDBPyConnection,
+    stages: List[Stage],
+    targets: Optional[Iterable[str]] = None,
+    incremental: bool = False,
+    force: bool = False,
+):
+    """Run the stages needed for `targets` (default: all), skipping those which
+    are up to date. Completion of each stage is recorded in the `stages` table
+    of the work database, so an interrupted run resumes where it stopped."""
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS stages (name VARCHAR PRIMARY KEY, "
+        "params_fingerprint VARCHAR, fingerprint VARCHAR, finished_at TIMESTAMP, "
+        "duration DOUBLE, row_count BIGINT, peak_memory BIGINT);"
+    )
+    by_name = {s.name: s for s in stages}
+    fingerprints: Dict[str, str] = {}
+    rebuilt: Set[str] = set()
+    for stage in _resolve(by_name, targets or by_name.keys()):
+        params_fp = stage.params_fingerprint
+        digest = hashlib.md5(params_fp.encode("utf-8"))
+        for dep in stage.deps:
+            digest.update(fingerprints[dep].encode("utf-8"))
+        fingerprint = fingerprints[stage.name] = digest.hexdigest()
+
+        previous = con.execute(
+            "SELECT params_fingerprint, fingerprint FROM stages WHERE name = ?;",
+            [stage.name],
+        ).fetchone()
+        output_exists = stage.output is None or stage.output.exists()
+        if stage.table is not None and _table_rows(con, stage.table) is None:
+            output_exists = False
+        if not force and output_exists and previous and previous[1] == fingerprint:
+            log.info("Stage %s is up to date.", stage.name)
+            continue
+
+        kwargs = dict(stage.params)
+        kwargs.update(stage.options)
+        if stage.incremental:
+            # Only process changes if this stage and its upstream produced full
+            # results before, under the same parameters:
+            kwargs["incremental"] = (
+                incremental
+                and not force
+                and output_exists
+                and previous is not None
+                and previous[0] == params_fp
+                and not rebuilt.intersection(stage.deps)
+            )
+        # A full rebuild of an incremental stage means that everything below
+        # it has to be rebuilt in full, too:
+        full_rebuild = stage.incremental and not kwargs["incremental"]
+        if full_rebuild or rebuilt.intersection(stage.deps):
+            rebuilt.add(stage.name)
+
+        con.execute("DELETE FROM stages WHERE name = ?;", [stage.name])
+        log.info("Running stage %s...", stage.name)
+        monitor = MemoryMonitor()
+        monitor.start()
+        started = time.time()
+        try:
+            stage.func(**kwargs)
+        finally:
+            peak_memory = monitor.stop()
+        duration = time.time() - started
+        rows = _table_rows(con, stage.table) if stage.table else None
+        con.execute(
+            "INSERT INTO stages VALUES (?, ?, ?, current_timestamp, ?, ?, ?);",
+            [stage.name, params_fp, fingerprint, duration, rows, peak_memory],
+        )
+        log.info(
+            "Stage %s finished in %.1fs, %s rows, peak memory %.1f MB.",
+            stage.name,
+            duration,
+            rows if rows is not None else "-",
+            peak_memory / 1024 / 1024,
+        )
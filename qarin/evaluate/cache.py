@@ -0,0 +1,159 @@
+"""Persistent cache of matcher scores, so that re-running an evaluation only
+scores the pairs that are new.
+
+Scores are stored in SQLite, keyed by a fingerprint of the matcher (its name
+and `config()`) and a fingerprint of the pair. The cache remembers the last
+fingerprint seen for each matcher name; when the configuration of a matcher
+changes, its old scores are dropped.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# Two FtM entities in their dict form, the original and the query:
+Pair = Tuple[Dict[str, Any], Dict[str, Any]]
+# SQLite limits the number of parameters of a statement:
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matchers (
+    name TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    matcher TEXT NOT NULL,
+    pair TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (matcher, pair)
+) WITHOUT ROWID;
+"""
+
+
+def _digest(data: Any) -> str:
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def matcher_fingerprint(name: str, config: Dict[str, Any]) -> str:
+    """A fingerprint of the matcher name and the settings which affect its
+    scores."""
+    return _digest({"name": name, "config": config})
+
+
+def _entity_key(data: Dict[str, Any]) -> Dict[str, Any]:
+    props = data.get("properties", {})
+    return {
+        "id": data.get("id"),
+        "schema": data.get("schema"),
+        "properties": {k: sorted(v) for k, v in props.items() if v},
+    }
+
+
+def pair_fingerprint(left: Dict[str, Any], right: Dict[str, Any]) -> str:
+    """A fingerprint of a pair of entities which ignores the order of
+    properties and of their values, and any keys other than the ID, schema
+    and properties."""
+    return _digest([_entity_key(left), _entity_key(right)])
+
+
+class ScoreCache:
+    """
+    A score cache in an SQLite file. Use `bind` to look up and store scores
+    for one matcher, e.g.:
+
+        cache = ScoreCache("scores.sqlite")
+        matcher_key = cache.bind(matcher.name, matcher.config())
+        scores = cache.get(matcher_key, pair_keys)
+
+    `hits` and `misses` count the lookups since the cache was opened.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, name: str, config: Dict[str, Any]) -> str:
+        """Register a matcher and return the key its scores are stored under.
+        If the matcher was seen before with a different configuration, its
+        cached scores are invalidated."""
+        fingerprint = matcher_fingerprint(name, config)
+        row = self.conn.execute(
+            "SELECT fingerprint FROM matchers WHERE name = ?", (name,)
+        ).fetchone()
+        if row is not None and row[0] != fingerprint:
+            deleted = self.conn.execute(
+                "DELETE FROM scores WHERE matcher = ?", (row[0],)
+            ).rowcount
+            log.info("Config of %s changed, dropped %d cached scores", name, deleted)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO matchers VALUES (?, ?, ?)",
+                (name, fingerprint, json.dumps(config, sort_keys=True, default=str)),
+            )
+        return fingerprint
+
+    def get(self, matcher_key: str, pair_keys: Sequence[str]) -> List[Optional[float]]:
+        """The cached scores of the given pairs, None where there is none."""
+        found: Dict[str, float] = {}
+        for start in range(0, len(pair_keys), LOOKUP_BATCH_SIZE):
+            batch = list(pair_keys[start : start + LOOKUP_BATCH_SIZE])
+            marks = ", ".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT pair, score FROM scores WHERE matcher = ? AND pair IN ({marks})",
+                [matcher_key, *batch],
+            )
+            found.update(rows)
+        scores = [found.get(key) for key in pair_keys]
+        hits = sum(1 for score in scores if score is not None)
+        self.hits += hits
+        self.misses += len(scores) - hits
+        return scores
+
+    def put(
+        self, matcher_key: str, pair_keys: Sequence[str], scores: Sequence[float]
+    ) -> None:
+        """Store the scores of the given pairs."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?)",
+                [(matcher_key, k, float(s)) for k, s in zip(pair_keys, scores)],
+            )
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Lookup statistics and the number of scores stored per matcher."""
+        rows = self.conn.execute(
+            "SELECT m.name, COUNT(s.pair) FROM matchers m "
+            "LEFT JOIN scores s ON s.matcher = m.fingerprint GROUP BY m.name"
+        )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "stored": dict(rows.fetchall()),
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "ScoreCache":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
@@ -0,0 +1,294 @@
+"""Concurrent client for yente-style `/match` APIs.
+
+Queries are grouped into batches and sent over one pooled HTTP connection,
+with a bounded number of batches in flight, an optional request rate limit,
+and retries with exponential backoff. Responses are written to a JSON lines
+file as they arrive, so a long evaluation can be inspected while it runs.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+# A query ID and the entity to match, e.g. {"schema": "Person", "properties": ...}:
+Query = Tuple[str, Dict[str, Any]]
+# Status codes worth retrying, as the server may be overloaded or restarting:
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Space out requests so that no more than `rate` start per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def fixture_queries(path: Union[str, Path]) -> Iterator[Query]:
+    """
+    Make queries from a fixture file written by `create_fixtures_with_treatment`,
+    one for each treated version of each person. Query IDs take the form
+    `<index>:<treatment>`, the index being the position of the person in the
+    file.
+    """
+    with open(path, "r") as fh:
+        fixtures = json.load(fh)
+    for idx, fixture in enumerate(fixtures):
+        for treatment, changed in fixture["changed"].items():
+            entity = {"schema": changed["schema"], "properties": changed["properties"]}
+            yield f"{idx}:{treatment}", entity
+
+
+def _batches(queries: Iterable[Query], size: int) -> Iterator[Dict[str, Any]]:
+    batch: Dict[str, Any] = {}
+    for query_id, entity in queries:
+        batch[query_id] = entity
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+class MatchClient:
+    """
+    Send entities to the `/match/<dataset>` endpoint of a yente instance.
+    params:
+        url: str = "http://localhost:8000"
+            The base URL of the API.
+        dataset: str = "default"
+            The dataset (scope) to match against.
+        params: Dict[str, Any] = None
+            Query string parameters, e.g. {"algorithm": "best"}.
+        batch_size: int = 10
+            The number of queries sent in one request.
+        concurrency: int = 4
+            The number of requests in flight at the same time.
+        rate_limit: float = None
+            The maximum number of requests started per second.
+        retries: int = 5
+            How often a failed request is retried before giving up.
+        backoff: float = 0.5
+            The delay before the first retry in seconds, doubled each time.
+        timeout: float = 60.0
+            The timeout of a single request in seconds.
+        api_key: str = None
+            Sent as an `Authorization: ApiKey` header.
+        transport: httpx.AsyncBaseTransport = None
+            A custom transport, e.g. `httpx.MockTransport` in tests.
+    """
+
+    def __init__(
+        self,
+        url: str = "http://localhost:8000",
+        dataset: str = "default",
+        params: Optional[Dict[str, Any]] = None,
+        batch_size: int = 10,
+        concurrency: int = 4,
+        rate_limit: Optional[float] = None,
+        retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 60.0,
+        api_key: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.url = url.rstrip("/")
+        self.dataset = dataset
+        self.params = params or {}
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = {"Authorization": f"ApiKey {api_key}"} if api_key else {}
+        self.transport = transport
+
+    def _client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+        )
+        return httpx.AsyncClient(
+            base_url=self.url,
+            headers=self.headers,
+            limits=limits,
+            timeout=self.timeout,
+            transport=self.transport,
+        )
+
+    async def _post(
+        self,
+        client: httpx.AsyncClient,
+        batch: Dict[str, Any],
+        limiter: Optional[RateLimiter],
+    ) -> Dict[str, Any]:
+        """Send one batch, retrying on transport errors and overload."""
+        attempt = 0
+        while True:
+            if limiter is not None:
+                await limiter.wait()
+            try:
+                response = await client.post(
+                    f"/match/{self.dataset}",
+                    json={"queries": batch},
+                    params=self.params,
+                )
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json().get("responses", {})
+                error: Exception = httpx.HTTPStatusError(
+                    f"Server error {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+                retry_after = response.headers.get("Retry-After")
+            except httpx.TransportError as exc:
+                error = exc
+                retry_after = None
+            if attempt >= self.retries:
+                raise error
+            delay = self.backoff * (2**attempt) * (0.5 + random.random())
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            log.warning("Request failed (%s), retrying in %.1fs", error, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def match(self, queries: Iterable[Query]) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Send all queries and yield (query ID, response) tuples as responses
+        arrive, in no particular order. Only `concurrency` batches are read
+        from `queries` ahead of the responses, so it can be a generator.
+        """
+        limiter = RateLimiter(self.rate_limit) if self.rate_limit else None
+        batches = _batches(queries, self.batch_size)
+        async with self._client() as client:
+            pending: Set[asyncio.Task] = set()
+            try:
+                for batch in batches:
+                    post = self._post(client, batch, limiter)
+                    pending.add(asyncio.create_task(post))
+                    if len(pending) < self.concurrency:
+                        continue
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        for item in task.result().items():
+                            yield item
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        for item in task.result().items():
+                            yield item
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    async def match_to_file(
+        self, queries: Iterable[Query], path: Union[str, Path], resume: bool = False
+    ) -> int:
+        """Send all queries and append each response to a JSON lines file
+        as `{"id": ..., "response": ...}`. With `resume`, the file is first
+        repaired with `repair_responses` and queries it already answers are
+        skipped. Returns the number of responses received."""
+        if resume:
+            repair_responses(path)
+            done = set(completed_ids(path))
+            queries = (query for query in queries if query[0] not in done)
+        count = 0
+        started = time.time()
+        with open(path, "a") as fh:
+            async for query_id, response in self.match(queries):
+                fh.write(json.dumps({"id": query_id, "response": response}) + "\n")
+                count += 1
+                if count % 1000 == 0:
+                    fh.flush()
+                    rate = count / max(time.time() - started, 1e-9)
+                    log.info("Received %d responses (%.1f/s)", count, rate)
+        return count
+
+
+def match_to_file(
+    queries: Iterable[Query],
+    path: Union[str, Path],
+    resume: bool = False,
+    **kwargs: Any,
+) -> int:
+    """Blocking version of `MatchClient.match_to_file` for scripts; in a
+    notebook, await the method instead. `kwargs` are passed to `MatchClient`."""
+    client = MatchClient(**kwargs)
+    return asyncio.run(client.match_to_file(queries, path, resume=resume))
+
+
+def repair_responses(path: Union[str, Path]) -> int:
+    """Prepare a responses file left behind by an interrupted run for appending:
+    an incomplete last line is cut off, so that its query is sent again, and a
+    missing line break after the last response is added. Returns the number of
+    bytes cut off."""
+    if not Path(path).exists():
+        return 0
+    with open(path, "rb+") as fh:
+        lines = fh.readlines()
+        if not lines:
+            return 0
+        last = lines[-1]
+        try:
+            if last.strip():
+                json.loads(last)
+        except ValueError:
+            end = fh.tell() - len(last)
+            fh.truncate(end)
+            log.warning(
+                "Cut off %d bytes of an incomplete last line: %s", len(last), path
+            )
+            return len(last)
+        if not last.endswith(b"\n"):
+            fh.write(b"\n")
+    return 0
+
+
+def completed_ids(path: Union[str, Path]) -> List[str]:
+    """The query IDs already answered in a responses file, to resume an
+    interrupted run by skipping them. Raises a `ValueError` on a line that is
+    not a complete response; use `repair_responses` to cut off the last line
+    left incomplete by an interruption."""
+    if not Path(path).exists():
+        return []
+    ids: List[str] = []
+    with open(path, "rb") as fh:
+        for line in fh:
+            if line.strip():
+                ids.append(json.loads(line)["id"])
+    return ids
@@ -0,0 +1,413 @@
+"""Metrics over the results table of an evaluation run.
+
+All metrics are derived from one sort of the scores (by group, then by
+descending score) followed by cumulative sums of the true and false positives,
+so that a sweep over every threshold costs about as much as the sort.
+Results are expected to have a boolean `match` column and a float `score`
+column, as written by `qarin.evaluate.runner`.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+Columns = Union[str, Sequence[str]]
+# Metrics with bootstrap confidence intervals:
+BOOTSTRAP_METRICS = ("precision", "recall", "f1", "fpr")
+# Resamples drawn per task when bootstrapping in worker processes:
+BOOTSTRAP_CHUNK = 250
+
+
+def _sorted_counts(
+    scores: np.ndarray, labels: np.ndarray, groups: np.ndarray
+) -> pd.DataFrame:
+    """For each group and distinct score, count the true and false positives
+    among pairs scoring at least that much."""
+    if not len(scores):
+        columns = {"group": np.int64, "threshold": np.float64}
+        columns.update({c: np.int64 for c in ("tp", "fp", "fn", "tn")})
+        return pd.DataFrame({c: np.empty(0, dtype=t) for c, t in columns.items()})
+    order = np.lexsort((-scores, groups))
+    s = scores[order]
+    y = labels[order].astype(np.int64)
+    g = groups[order]
+    tp = np.cumsum(y)
+    fp = np.cumsum(1 - y)
+    # Restart the counts at the first row of each group:
+    first = np.r_[True, g[1:] != g[:-1]]
+    starts = np.flatnonzero(first)
+    lengths = np.diff(np.r_[starts, len(g)])
+    tp -= np.repeat(np.r_[0, tp][starts], lengths)
+    fp -= np.repeat(np.r_[0, fp][starts], lengths)
+    # Only the last row of each run of equal scores is a valid cut-off:
+    last = np.r_[(g[1:] != g[:-1]) | (s[1:] != s[:-1]), True]
+    positives = np.repeat(tp[np.r_[starts[1:] - 1, len(g) - 1]], lengths)
+    negatives = np.repeat(fp[np.r_[starts[1:] - 1, len(g) - 1]], lengths)
+    return pd.DataFrame(
+        {
+            "group": g[last],
+            "threshold": s[last],
+            "tp": tp[last],
+            "fp": fp[last],
+            "fn": (positives - tp)[last],
+            "tn": (negatives - fp)[last],
+        }
+    )
+
+
+def _add_rates(curve: pd.DataFrame) -> pd.DataFrame:
+    tp, fp, fn, tn = (curve[c].to_numpy() for c in ("tp", "fp", "fn", "tn"))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = tp / (tp + fp)
+        recall = tp / (tp + fn)
+        curve["precision"] = precision
+        curve["recall"] = recall
+        curve["f1"] = 2 * precision * recall / (precision + recall)
+        curve["fpr"] = fp / (fp + tn)
+    return curve
+
+
+def _group_codes(results: pd.DataFrame, by: Optional[Columns]):
+    if by is None:
+        return np.zeros(len(results), dtype=np.int64), None
+    by = [by] if isinstance(by, str) else list(by)
+    grouper = results.groupby(by, sort=True, dropna=False)
+    codes = grouper.ngroup().to_numpy()
+    keys = grouper.size().index.to_frame(index=False)
+    return codes, keys
+
+
+def threshold_curve(
+    results: pd.DataFrame,
+    by: Optional[Columns] = None,
+    score: str = "score",
+    label: str = "match",
+) -> pd.DataFrame:
+    """
+    Precision, recall, F1 and false positive rate at every distinct score,
+    treating pairs that score at or above the threshold as matches.
+    params:
+        results: pd.DataFrame
+            The results table, one row per scored pair.
+        by: str | Sequence[str] = None
+            Compute a separate curve for each group, e.g. "treatment".
+        score: str = "score"
+            The column holding the scores.
+        label: str = "match"
+            The column holding the true labels.
+    returns: a table with the columns of `by`, `threshold`, `tp`, `fp`, `fn`,
+        `tn`, `precision`, `recall`, `f1` and `fpr`, by descending threshold.
+    """
+    codes, keys = _group_codes(results, by)
+    scores = results[score].to_numpy(dtype=np.float64)
+    labels = results[label].to_numpy(dtype=bool)
+    curve = _add_rates(_sorted_counts(scores, labels, codes))
+    if keys is not None:
+        curve = pd.concat(
+            [keys.iloc[curve["group"]].reset_index(drop=True), curve], axis=1
+        )
+    return curve.drop(columns=["group"])
+
+
+def _areas(results: pd.DataFrame, by: Optional[Columns], score: str, label: str):
+    """ROC and precision-recall AUC, best F1 and its threshold per group."""
+    codes, keys = _group_codes(results, by)
+    scores = results[score].to_numpy(dtype=np.float64)
+    labels = results[label].to_numpy(dtype=bool)
+    curve = _add_rates(_sorted_counts(scores, labels, codes))
+    if curve.empty:
+        columns = ["pairs", "positives", "roc_auc", "pr_auc"]
+        columns += ["best_f1", "best_threshold"]
+        table = pd.DataFrame({c: np.empty(0) for c in columns})
+        table = table.astype({"pairs": np.int64, "positives": np.int64})
+        return table if keys is None else pd.concat([keys, table], axis=1)
+    g = curve["group"].to_numpy()
+    first = np.r_[True, g[1:] != g[:-1]]
+    starts = np.flatnonzero(first)
+    tpr = np.nan_to_num(curve["recall"].to_numpy())
+    fpr = np.nan_to_num(curve["fpr"].to_numpy())
+    precision = np.nan_to_num(curve["precision"].to_numpy())
+    # Each curve starts from (0, 0), i.e. a threshold above all scores:
+    prev_tpr = np.where(first, 0.0, np.r_[0.0, tpr[:-1]])
+    prev_fpr = np.where(first, 0.0, np.r_[0.0, fpr[:-1]])
+    roc = np.add.reduceat((fpr - prev_fpr) * (tpr + prev_tpr) / 2, starts)
+    # Average precision, the step-wise area under the precision-recall curve:
+    pr = np.add.reduceat((tpr - prev_tpr) * precision, starts)
+    f1 = np.nan_to_num(curve["f1"].to_numpy(), nan=-1.0)
+    lengths = np.diff(np.r_[starts, len(g)])
+    # Index of the best F1 within each group:
+    group_max = np.maximum.reduceat(f1, starts)
+    is_best = f1 == np.repeat(group_max, lengths)
+    best = starts + np.array(
+        [np.argmax(is_best[s : s + n]) for s, n in zip(starts, lengths)]
+    )
+    table = pd.DataFrame(
+        {
+            "pairs": np.bincount(codes)[g[starts]],
+            "positives": curve["tp"].to_numpy()[starts]
+            + curve["fn"].to_numpy()[starts],
+            "roc_auc": roc,
+            "pr_auc": pr,
+            "best_f1": curve["f1"].to_numpy()[best],
+            "best_threshold": curve["threshold"].to_numpy()[best],
+        }
+    )
+    # The AUCs are undefined for groups without positives or negatives:
+    positives = table["positives"].to_numpy()
+    negatives = table["pairs"].to_numpy() - positives
+    table.loc[(positives == 0) | (negatives == 0), "roc_auc"] = np.nan
+    table.loc[positives == 0, "pr_auc"] = np.nan
+    if keys is not None:
+        table = pd.concat([keys.iloc[g[starts]].reset_index(drop=True), table], axis=1)
+    return table
+
+
+def metrics_at(
+    results: pd.DataFrame,
+    thresholds: Union[float, Sequence[float]],
+    by: Optional[Columns] = None,
+    score: str = "score",
+    label: str = "match",
+) -> pd.DataFrame:
+    """
+    Precision, recall, F1 and false positive rate at the given thresholds,
+    optionally per group. Pairs scoring at or above a threshold count as
+    matches.
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+    codes, keys = _group_codes(results, by)
+    scores = results[score].to_numpy(dtype=np.float64)
+    labels = results[label].to_numpy(dtype=bool)
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
+    # Rank the scores and thresholds together, so that each pair of group and
+    # score becomes one integer key that sorts by group, then by score:
+    values = np.unique(np.r_[scores, thresholds])
+    span = len(values) + 1
+    key = codes * span + np.searchsorted(values, scores)
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    y = labels[order].astype(np.int64)
+    tp_below = np.r_[0, np.cumsum(y)]
+    fp_below = np.r_[0, np.cumsum(1 - y)]
+    groups = np.arange(n_groups)
+    starts = np.searchsorted(key, groups * span)
+    ends = np.searchsorted(key, (groups + 1) * span)
+    # The first pair of each group at or above each threshold:
+    cuts = np.searchsorted(
+        key, groups[:, None] * span + np.searchsorted(values, thresholds)[None, :]
+    )
+    tp = tp_below[ends][:, None] - tp_below[cuts]
+    fp = fp_below[ends][:, None] - fp_below[cuts]
+    positives = (tp_below[ends] - tp_below[starts])[:, None]
+    negatives = (fp_below[ends] - fp_below[starts])[:, None]
+    frame = pd.DataFrame(
+        {
+            "threshold": np.tile(thresholds, n_groups),
+            "tp": tp.ravel(),
+            "fp": fp.ravel(),
+            "fn": (positives - tp).ravel(),
+            "tn": (negatives - fp).ravel(),
+        }
+    )
+    if keys is not None:
+        rows = keys.iloc[np.repeat(groups, len(thresholds))].reset_index(drop=True)
+        frame = pd.concat([rows, frame], axis=1)
+    return _add_rates(frame)
+
+
+def summary(
+    results: pd.DataFrame,
+    by: Optional[Columns] = None,
+    threshold: Optional[float] = None,
+    score: str = "score",
+    label: str = "match",
+) -> pd.DataFrame:
+    """
+    The headline metrics of a results table, optionally broken down by
+    groups such as "treatment", "locale" or "matcher": number of pairs and
+    positives, ROC AUC, PR AUC (average precision), and the best F1 with its
+    threshold. With `threshold`, also the precision, recall, F1 and false
+    positive rate at that threshold.
+
+    Example: per matcher and treatment at a threshold of 0.7:
+        summary(results, by=["matcher", "treatment"], threshold=0.7)
+    """
+    table = _areas(results, by, score, label)
+    if threshold is not None:
+        at = metrics_at(results, threshold, by=by, score=score, label=label)
+        rates = at[["precision", "recall", "f1", "fpr"]].reset_index(drop=True)
+        table = pd.concat([table, rates], axis=1)
+    return table
+
+
+def _cell_metrics(tp: np.ndarray, fn: np.ndarray, fp: np.ndarray, tn: np.ndarray):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = tp / (tp + fp)
+        recall = tp / (tp + fn)
+        return {
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * tp / (2 * tp + fp + fn),
+            "fpr": fp / (fp + tn),
+        }
+
+
+def _draw_counts(
+    counts: np.ndarray, resamples: int, seed: np.random.SeedSequence
+) -> np.ndarray:
+    """Resample the rows behind `counts`, one row count per cell, with
+    replacement; returns the cell counts of each resample."""
+    rng = np.random.default_rng(seed)
+    total = int(counts.sum())
+    return rng.multinomial(total, counts / total, size=resamples)
+
+
+def _paired_cells(
+    results: pd.DataFrame,
+    threshold: float,
+    by: Optional[Columns],
+    score: str,
+    label: str,
+    matcher: str,
+) -> Tuple[pd.DataFrame, List[str]]:
+    """One row per pair with the confusion cell of each matcher, encoded as
+    one base-4 digit per matcher (0: tp, 1: fn, 2: fp, 3: tn)."""
+    if matcher not in results.columns:
+        results = results.assign(**{matcher: ""})
+    frame = results.assign(_pair=results.groupby(matcher, sort=False).cumcount())
+    truth = frame[label].to_numpy(dtype=bool)
+    predicted = frame[score].to_numpy(dtype=np.float64) >= threshold
+    frame["_cell"] = 2 * (~truth).astype(np.int64) + (~predicted).astype(np.int64)
+    matchers = list(pd.unique(frame[matcher]))
+    wide = frame.pivot(index="_pair", columns=matcher, values="_cell")
+    if wide.isna().any().any():
+        raise ValueError("All matchers must have scored the same pairs")
+    joint = np.zeros(len(wide), dtype=np.int64)
+    for pos, name in enumerate(matchers):
+        joint += wide[name].to_numpy(dtype=np.int64) * 4**pos
+    cells = pd.DataFrame({"_joint": joint}, index=wide.index)
+    if by is not None:
+        by = [by] if isinstance(by, str) else list(by)
+        first = frame[frame[matcher] == matchers[0]].set_index("_pair")
+        cells = cells.join(first[by])
+    return cells, matchers
+
+
+def bootstrap(
+    results: pd.DataFrame,
+    threshold: float,
+    by: Optional[Columns] = "treatment",
+    resamples: int = 1000,
+    confidence: float = 0.95,
+    baseline: Optional[str] = None,
+    workers: int = 1,
+    seed: int = 0,
+    score: str = "score",
+    label: str = "match",
+    matcher: str = "matcher",
+) -> pd.DataFrame:
+    """
+    Bootstrap confidence intervals of precision, recall, F1 and false positive
+    rate at a threshold, per matcher and group.
+
+    The metrics only depend on how many resampled rows fall into each cell of
+    the confusion matrix, so instead of drawing row indices, each resample
+    draws the cell counts from a multinomial distribution over the cells. This
+    is equivalent, and costs the same for millions of pairs as for a hundred.
+    Pairs are resampled jointly for all matchers, so that the intervals of
+    the differences to a `baseline` matcher account for the pairing.
+    params:
+        results: pd.DataFrame
+            The results table; each matcher must have scored the same pairs
+            in the same order, as `run_evaluation` does.
+        threshold: float
+            Pairs scoring at or above this are predicted matches.
+        by: str | Sequence[str] = "treatment"
+            Resample each group separately, e.g. per treatment or locale.
+        resamples: int = 1000
+            The number of bootstrap resamples.
+        confidence: float = 0.95
+            The coverage of the percentile intervals.
+        baseline: str = None
+            Also estimate the difference of each other matcher to this one.
+        workers: int = 1
+            Draw chunks of resamples in this many processes, 0 for all cores.
+    returns: a table with the columns of `by`, `matcher`, `metric`,
+        `estimate`, `lower` and `upper`. Differences to the baseline are
+        labelled `<matcher> - <baseline>`.
+    """
+    cells, matchers = _paired_cells(results, threshold, by, score, label, matcher)
+    if baseline is not None and baseline not in matchers:
+        raise ValueError(f"Unknown baseline matcher: {baseline}")
+    groups = (
+        [((), cells)]
+        if by is None
+        else list(cells.groupby(by, sort=True, dropna=False))
+    )
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    tasks = []
+    for (key, group), group_seed in zip(groups, seeds):
+        joint, counts = np.unique(group["_joint"].to_numpy(), return_counts=True)
+        chunks = [
+            min(BOOTSTRAP_CHUNK, resamples - start)
+            for start in range(0, resamples, BOOTSTRAP_CHUNK)
+        ]
+        for size, chunk_seed in zip(chunks, group_seed.spawn(len(chunks))):
+            tasks.append((key, joint, counts, size, chunk_seed))
+
+    draws: Dict[tuple, List[np.ndarray]] = {}
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_draw_counts, t[2], t[3], t[4]) for t in tasks]
+            for task, future in zip(tasks, futures):
+                draws.setdefault(task[0], []).append(future.result())
+    else:
+        for task in tasks:
+            draws.setdefault(task[0], []).append(_draw_counts(*task[2:]))
+
+    alpha = (1 - confidence) / 2
+    rows = []
+    for key, group in groups:
+        joint, counts = np.unique(group["_joint"].to_numpy(), return_counts=True)
+        sampled = np.concatenate(draws[key])
+        values: Dict[str, Tuple[Dict, Dict]] = {}
+        for pos, name in enumerate(matchers):
+            # The cell of this matcher in each joint cell:
+            cell = (joint // 4**pos) % 4
+            onehot = np.stack([cell == c for c in range(4)], axis=1).astype(np.int64)
+            point = _cell_metrics(*(counts @ onehot)[:, None])
+            spread = _cell_metrics(*(sampled @ onehot).T)
+            values[name] = (point, spread)
+        labels = [(name, values[name]) for name in matchers]
+        if baseline is not None:
+            base_point, base_spread = values[baseline]
+            for name in matchers:
+                if name == baseline:
+                    continue
+                point, spread = values[name]
+                diff_point = {m: point[m] - base_point[m] for m in point}
+                diff_spread = {m: spread[m] - base_spread[m] for m in spread}
+                labels.append((f"{name} - {baseline}", (diff_point, diff_spread)))
+        key = key if isinstance(key, tuple) else (key,)
+        for name, (point, spread) in labels:
+            for metric in BOOTSTRAP_METRICS:
+                valid = spread[metric][~np.isnan(spread[metric])]
+                lower, upper = (
+                    np.quantile(valid, [alpha, 1 - alpha])
+                    if len(valid)
+                    else (np.nan,) * 2
+                )
+                row = dict(zip([] if by is None else cells.columns[1:], key))
+                row.update(
+                    matcher=name,
+                    metric=metric,
+                    estimate=float(point[metric][0]),
+                    lower=float(lower),
+                    upper=float(upper),
+                )
+                rows.append(row)
+    return pd.DataFrame(rows)
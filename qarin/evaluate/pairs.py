@@ -0,0 +1,75 @@
+"""Load the labelled name pairs exported by `namepairs/duck_gen.py`."""
+
+from pathlib import Path
+from typing import List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("match", pa.bool_()), ("category", pa.string())]),
+    flavor="hive",
+)
+
+
+def pairs_dataset(path: Union[str, Path]) -> ds.Dataset:
+    """Open a Parquet pairs export, partitioned by `match` and `category`."""
+    return ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+
+
+def pairs_filter(
+    match: Optional[bool] = None,
+    category: Optional[str] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+) -> Optional[ds.Expression]:
+    """Build a dataset filter expression for the given criteria."""
+    expr: Optional[ds.Expression] = None
+    conditions = []
+    if match is not None:
+        conditions.append(ds.field("match") == match)
+    if category is not None:
+        conditions.append(ds.field("category") == category)
+    if min_score is not None:
+        conditions.append(ds.field("score") > min_score)
+    if max_score is not None:
+        conditions.append(ds.field("score") <= max_score)
+    for condition in conditions:
+        expr = condition if expr is None else expr & condition
+    return expr
+
+
+def load_pairs(
+    path: Union[str, Path],
+    match: Optional[bool] = None,
+    category: Optional[str] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Load a filtered subset of the pairs into a data frame. Filters on `match`
+    and `category` only read the matching partitions, filters on the score
+    skip row groups based on their statistics.
+    params:
+        path: str | Path
+            The directory of the Parquet pairs export.
+        match: bool = None
+            Only load positive (True) or negative (False) pairs.
+        category: str = None
+            Only load pairs of the given category, `PER` or `ORG`.
+        min_score: float = None
+            Only load pairs with a score above this value.
+        max_score: float = None
+            Only load pairs with a score up to this value.
+        columns: List[str] = None
+            The columns to load, defaults to all.
+
+    Example: all person negatives scoring above 0.8:
+        load_pairs("pairs", match=False, category="PER", min_score=0.8)
+    """
+    dataset = pairs_dataset(path)
+    expr = pairs_filter(match, category, min_score, max_score)
+    table = dataset.to_table(columns=columns, filter=expr)
+    return table.to_pandas()
@@ -0,0 +1,366 @@
+"""Score treated fixtures against one or more matchers and collect the results.
+
+The fixtures written by `create_fixtures_with_treatment` are turned into pairs:
+each treated person against their original (a match), and against the original
+of another person (a non-match). Every matcher scores all pairs; CPU-bound
+matchers are spread over a pool of worker processes.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Coroutine, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from followthemoney import model
+from tqdm import tqdm
+
+from qarin.evaluate.cache import ScoreCache, pair_fingerprint
+from qarin.evaluate.client import MatchClient
+from qarin.match.scorer import PairScorer
+
+log = logging.getLogger(__name__)
+
+# Two FtM entities in their dict form, the original and the query:
+Pair = Tuple[Dict[str, Any], Dict[str, Any]]
+# Number of pairs handed to a worker process at a time:
+CHUNK_SIZE = 500
+
+
+def entity_name(data: Dict[str, Any]) -> str:
+    """The first name of an entity in its dict form."""
+    names = data.get("properties", {}).get("name", [])
+    return names[0] if names else ""
+
+
+class Matcher:
+    """
+    Base class of the matchers the runner can evaluate. Subclasses implement
+    `score` for a single pair, or `score_pairs` to score many pairs at once;
+    each of the two is implemented by way of the other.
+    """
+
+    name = "matcher"
+    # Whether scoring is CPU-bound and worth spreading over worker processes:
+    parallel = True
+
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        if cls.score is Matcher.score and cls.score_pairs is Matcher.score_pairs:
+            raise TypeError(f"{cls.__name__} must implement score or score_pairs")
+
+    def config(self) -> Dict[str, Any]:
+        """The settings which affect the scores of this matcher."""
+        return {}
+
+    def score(self, left: Dict[str, Any], right: Dict[str, Any]) -> float:
+        """Score a single pair."""
+        scores, _ = self.score_pairs([(left, right)])
+        return scores[0]
+
+    def score_pairs(self, pairs: Sequence[Pair]) -> Tuple[List[float], List[float]]:
+        """Score a list of pairs, returning the scores and the time taken for
+        each pair in seconds."""
+        scores: List[float] = []
+        latencies: List[float] = []
+        for left, right in pairs:
+            started = time.perf_counter()
+            scores.append(self.score(left, right))
+            latencies.append(time.perf_counter() - started)
+        return scores, latencies
+
+
+class NomenklaturaMatcher(Matcher):
+    """Score pairs with a nomenklatura matching algorithm, e.g. `logic-v1`."""
+
+    def __init__(self, algorithm: str = "logic-v1"):
+        self.algorithm = algorithm
+        self.name = algorithm
+        self._impl: Any = None
+
+    def config(self) -> Dict[str, Any]:
+        # Scores change between releases, so the version is part of the config:
+        try:
+            version: Optional[str] = metadata.version("nomenklatura")
+        except metadata.PackageNotFoundError:
+            version = None
+        return {"algorithm": self.algorithm, "nomenklatura": version}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The algorithm is looked up again in each worker process:
+        return {"algorithm": self.algorithm, "name": self.name, "_impl": None}
+
+    def score(self, left: Dict[str, Any], right: Dict[str, Any]) -> float:
+        if self._impl is None:
+            from nomenklatura.matching import get_algorithm
+
+            self._impl = get_algorithm(self.algorithm)
+            if self._impl is None:
+                raise ValueError(f"Unknown algorithm: {self.algorithm}")
+        result = self._impl.compare(model.get_proxy(right), model.get_proxy(left))
+        return float(result.score)
+
+
+class ScorerMatcher(Matcher):
+    """Score the names of each pair with a `qarin.match` `PairScorer`. The
+    name defaults to one listing the weights, e.g. `scorer:levenshtein=1`."""
+
+    def __init__(
+        self, weights: Optional[Dict[str, float]] = None, name: Optional[str] = None
+    ):
+        # Each worker process is single-threaded, parallelism comes from the pool:
+        self.scorer = PairScorer(weights=weights, workers=1)
+        weighted = (f"{k}={v:g}" for k, v in sorted(self.scorer.weights.items()))
+        self.name = name or "scorer:" + ",".join(weighted)
+
+    def config(self) -> Dict[str, Any]:
+        return {"weights": self.scorer.weights}
+
+    def score_pairs(self, pairs: Sequence[Pair]) -> Tuple[List[float], List[float]]:
+        started = time.perf_counter()
+        scores = self.scorer.score(
+            [entity_name(left) for left, _ in pairs],
+            [entity_name(right) for _, right in pairs],
+        )
+        latency = (time.perf_counter() - started) / max(len(pairs), 1)
+        return np.nan_to_num(scores).tolist(), [latency] * len(pairs)
+
+
+class HttpMatcher(Matcher):
+    """
+    Score pairs through a yente-style `/match` API: the right entity of each
+    pair is sent as the query, and the score is that of the result which has
+    the ID or the name of the left entity, or 0.0 if it is not among the
+    results. This only makes sense if the left entities are in the dataset
+    the API matches against. `kwargs` are passed to `MatchClient`.
+    """
+
+    parallel = False
+
+    def __init__(self, name: str = "yente", **kwargs: Any):
+        self.name = name
+        self.kwargs = kwargs
+
+    def config(self) -> Dict[str, Any]:
+        keep = ("url", "dataset", "params")
+        return {k: v for k, v in self.kwargs.items() if k in keep}
+
+    def score_pairs(self, pairs: Sequence[Pair]) -> Tuple[List[float], List[float]]:
+        queries = [(str(i), right) for i, (_, right) in enumerate(pairs)]
+
+        async def collect() -> Dict[str, Any]:
+            client = MatchClient(**self.kwargs)
+            return {qid: resp async for qid, resp in client.match(queries)}
+
+        started = time.perf_counter()
+        responses = _run_coroutine(collect())
+        latency = (time.perf_counter() - started) / max(len(pairs), 1)
+        scores = []
+        for i, (left, _) in enumerate(pairs):
+            name = entity_name(left)
+            score = 0.0
+            for result in responses.get(str(i), {}).get("results", []):
+                if result.get("id") == left.get("id") or result.get("caption") == name:
+                    score = max(score, float(result["score"]))
+            scores.append(score)
+        return scores, [latency] * len(pairs)
+
+
+def _run_coroutine(coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """Run a coroutine to completion from synchronous code. If an event loop is
+    already running in this thread, as in a notebook, it is run in a worker
+    thread with its own loop instead."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coroutine).result()
+
+
+def fixture_pairs(
+    path: Union[str, Path], negatives: bool = True, seed: int = 0
+) -> pd.DataFrame:
+    """
+    Turn a fixture file from `create_fixtures_with_treatment` into a table of
+    pairs: each treated entity against its original and, with `negatives`,
+    against the original of another randomly chosen fixture.
+    """
+    with open(path, "r") as fh:
+        fixtures = json.load(fh)
+    rng = random.Random(seed)
+    rows = []
+    for idx, fixture in enumerate(fixtures):
+        for treatment, changed in fixture["changed"].items():
+            others = [(idx, True)]
+            if negatives and len(fixtures) > 1:
+                other = rng.randrange(len(fixtures) - 1)
+                others.append((other + 1 if other >= idx else other, False))
+            for left_idx, match in others:
+                left = fixtures[left_idx]["original"]
+                rows.append(
+                    {
+                        "fixture": idx,
+                        "treatment": treatment,
+                        "locale": fixture.get("locale"),
+                        "match": match,
+                        "left": left,
+                        "right": changed,
+                        "left_name": entity_name(left),
+                        "right_name": entity_name(changed),
+                    }
+                )
+    return pd.DataFrame(rows)
+
+
+def _score_chunk(
+    matcher: Matcher, pairs: List[Pair]
+) -> Tuple[List[float], List[float]]:
+    return matcher.score_pairs(pairs)
+
+
+def score_matcher(
+    matcher: Matcher,
+    pairs: List[Pair],
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Score all pairs with a matcher, in worker processes if it is CPU-bound.
+    Returns the scores and the latency of each pair in seconds."""
+    chunks = [pairs[i : i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    scores: List[float] = []
+    latencies: List[float] = []
+    progress = tqdm(total=len(pairs), desc=matcher.name, unit="pairs")
+
+    def collect(result: Tuple[List[float], List[float]]):
+        scores.extend(result[0])
+        latencies.extend(result[1])
+        progress.update(len(result[0]))
+
+    if not matcher.parallel:
+        for chunk in chunks:
+            collect(matcher.score_pairs(chunk))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Results are collected in order, with a few chunks in flight:
+            pending: Deque[Future] = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_score_chunk, matcher, chunk))
+                if len(pending) >= workers * 2:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+    progress.close()
+    return np.array(scores, dtype=np.float32), np.array(latencies)
+
+
+def run_evaluation(
+    fixtures_path: Union[str, Path],
+    matchers: Sequence[Matcher],
+    output_path: Optional[Union[str, Path]] = None,
+    negatives: bool = True,
+    workers: Optional[int] = None,
+    cache_path: Optional[Union[str, Path]] = None,
+) -> pd.DataFrame:
+    """
+    Score the pairs made from a fixture file with each matcher.
+    params:
+        fixtures_path: str | Path
+            A fixture file written by `create_fixtures_with_treatment`.
+        matchers: Sequence[Matcher]
+            The matchers to evaluate.
+        output_path: str | Path = None
+            Write the results table to this Parquet file.
+        negatives: bool = True
+            Also score each treated entity against another fixture's original.
+        workers: int = None
+            The number of worker processes, defaults to all cores.
+        cache_path: str | Path = None
+            An SQLite `ScoreCache` file: cached scores are reused, and only
+            the pairs missing from it are scored.
+    returns: a table with one row per pair and matcher, with the columns
+        `matcher`, `fixture`, `treatment`, `locale`, `match`, `left_name`,
+        `right_name`, `score`, `latency_ms` and `cached`. The latency of
+        cached pairs is NaN.
+    """
+    pairs = fixture_pairs(fixtures_path, negatives=negatives)
+    entities = list(zip(pairs["left"], pairs["right"]))
+    base = pairs.drop(columns=["left", "right"])
+    cache = ScoreCache(cache_path) if cache_path is not None else None
+    pair_keys = [pair_fingerprint(l, r) for l, r in entities] if cache else []
+    frames = []
+    for matcher in matchers:
+        started = time.perf_counter()
+        scores = np.full(len(entities), np.nan, dtype=np.float32)
+        latencies = np.full(len(entities), np.nan)
+        cached = np.zeros(len(entities), dtype=bool)
+        if cache is not None:
+            matcher_key = cache.bind(matcher.name, matcher.config())
+            found = cache.get(matcher_key, pair_keys)
+            cached = np.array([s is not None for s in found], dtype=bool)
+            scores[cached] = [s for s in found if s is not None]
+        todo = np.flatnonzero(~cached)
+        if len(todo):
+            todo_scores, todo_latencies = score_matcher(
+                matcher, [entities[i] for i in todo], workers=workers
+            )
+            scores[todo] = todo_scores
+            latencies[todo] = todo_latencies
+            if cache is not None:
+                cache.put(matcher_key, [pair_keys[i] for i in todo], todo_scores)
+        took = time.perf_counter() - started
+        frame = base.copy()
+        frame.insert(0, "matcher", matcher.name)
+        frame["score"] = scores
+        frame["latency_ms"] = latencies * 1000
+        frame["cached"] = cached
+        frames.append(frame)
+        lat = frame["latency_ms"]
+        log.info(
+            "%s: %d pairs (%d cached) in %.1fs, latency p50 %.2fms, "
+            "p95 %.2fms, p99 %.2fms",
+            matcher.name,
+            len(frame),
+            cached.sum(),
+            took,
+            lat.quantile(0.5),
+            lat.quantile(0.95),
+            lat.quantile(0.99),
+        )
+    if cache is not None:
+        stats = cache.stats()
+        log.info(
+            "Score cache: %d hits, %d misses (%.1f%% hit rate)",
+            stats["hits"],
+            stats["misses"],
+            stats["hit_rate"] * 100,
+        )
+        cache.close()
+    results = pd.concat(frames, ignore_index=True)
+    if output_path is not None:
+        results.to_parquet(output_path, index=False)
+    return results
+
+
+def latency_summary(results: pd.DataFrame) -> pd.DataFrame:
+    """Latency percentiles in milliseconds for each matcher in a results table.
+    Pairs taken from the score cache have no latency and are not counted."""
+    grouped = results.groupby("matcher")["latency_ms"]
+    return pd.DataFrame(
+        {
+            "pairs": grouped.count(),
+            "p50": grouped.quantile(0.5),
+            "p95": grouped.quantile(0.95),
+            "p99": grouped.quantile(0.99),
+            "mean": grouped.mean(),
+        }
+    )
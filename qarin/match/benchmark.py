@@ -0,0 +1,344 @@
+"""Latency and recall benchmarks for the candidate retrieval in `qarin.match`.
+
+    python -m qarin.match.benchmark index -w work.duckdb -n 500
+"""
+
+import random
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+
+from qarin.evaluate.generators import treatment_mapping
+from qarin.match.embeddings import DEFAULT_MODEL, DTYPES, EmbeddingIndex, load_encoder
+from qarin.match.index import (
+    NameIndex,
+    fuse_candidates,
+    names_from_entities,
+    names_from_work_db,
+)
+from qarin.match.phonetic import PHONETIC_ALGORITHMS, PhoneticIndex
+from qarin.match.text import normalize_name
+
+# Retrieves the ids of up to `depth` candidate names for a query:
+Retriever = Callable[[str, int], List[int]]
+
+
+def treated_queries(
+    names: Sequence[str],
+    keys: Sequence[Optional[str]],
+    n: int = 500,
+    treatments: Optional[List[str]] = None,
+    seed: int = 0,
+) -> List[Tuple[str, Optional[str], str]]:
+    """
+    Sample names and apply a random treatment from `qarin.evaluate.generators`
+    to each, so that the key each query should retrieve is known.
+    returns: a list of (query, expected key, treatment) tuples.
+    """
+    rng = random.Random(seed)
+    treatments = treatments or list(treatment_mapping.keys())
+    # The treatments draw from the global generator, which is seeded for them
+    # and then restored, so that the caller's random state is left alone:
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        queries = []
+        for name_id in rng.sample(range(len(names)), min(n, len(names))):
+            treatment = rng.choice(treatments)
+            query = treatment_mapping[treatment](names[name_id])
+            queries.append((query, keys[name_id], treatment))
+    finally:
+        random.setstate(state)
+    return queries
+
+
+def brute_force_search(norms: List[str], query: str, limit: int) -> List[int]:
+    """Rank all names against the query, the reference for retrieval recall."""
+    norm = normalize_name(query) or ""
+    scores = cdist([norm], norms, scorer=fuzz.WRatio, workers=-1)[0]
+    limit = min(limit, len(norms))
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    return [int(i) for i in top[np.argsort(-scores[top], kind="stable")]]
+
+
+def benchmark_retrieval(
+    retrieve: Retriever,
+    names: Sequence[str],
+    keys: Sequence[Optional[str]],
+    queries: List[Tuple[str, Optional[str], str]],
+    limit: int = 10,
+    depth: int = 100,
+    brute_force: bool = True,
+) -> Dict[str, float]:
+    """
+    Measure a retriever on the given queries.
+    params:
+        retrieve: Retriever
+            Returns the ids of up to `depth` candidates for a query.
+        limit: int = 10
+            The number of brute-force results which should be retrieved.
+        depth: int = 100
+            The number of candidates the retriever may return.
+        brute_force: bool = True
+            Compare against an exhaustive fuzzy search of all names.
+    returns: latency percentiles in milliseconds, the share of queries whose
+        expected key was retrieved (`hit_rate`, also per treatment), and the
+        share of the top brute-force results among the candidates
+        (`brute_recall`).
+    """
+    latencies: List[float] = []
+    brute_latencies: List[float] = []
+    hits = 0
+    treatment_hits: Dict[str, List[bool]] = {}
+    found = 0
+    wanted = 0
+    candidates = 0
+    norms = [normalize_name(n) or "" for n in names] if brute_force else []
+    for query, key, treatment in queries:
+        started = time.perf_counter()
+        ids = retrieve(query, depth)
+        latencies.append(time.perf_counter() - started)
+        candidates += len(ids)
+        hit = key is not None and key in {keys[i] for i in ids}
+        treatment_hits.setdefault(treatment, []).append(hit)
+        hits += hit
+        if brute_force:
+            started = time.perf_counter()
+            expected = brute_force_search(norms, query, limit)
+            brute_latencies.append(time.perf_counter() - started)
+            found += len(set(expected).intersection(ids))
+            wanted += len(expected)
+
+    lat = np.array(latencies) * 1000
+    result = {
+        "queries": len(queries),
+        "candidates_mean": candidates / max(len(queries), 1),
+        "hit_rate": hits / max(len(queries), 1),
+        "latency_p50_ms": float(np.percentile(lat, 50)),
+        "latency_p95_ms": float(np.percentile(lat, 95)),
+        "latency_p99_ms": float(np.percentile(lat, 99)),
+        "queries_per_second": len(queries) / max(lat.sum() / 1000, 1e-9),
+    }
+    for treatment, treated in sorted(treatment_hits.items()):
+        result[f"hit_rate:{treatment}"] = sum(treated) / len(treated)
+    if brute_force:
+        brute = np.array(brute_latencies) * 1000
+        result["brute_recall"] = found / max(wanted, 1)
+        result["brute_latency_p50_ms"] = float(np.percentile(brute, 50))
+        result["brute_latency_p95_ms"] = float(np.percentile(brute, 95))
+    return result
+
+
+def print_results(title: str, results: Dict[str, float]):
+    click.echo(title)
+    for key, value in results.items():
+        text = f"{value:.4f}" if isinstance(value, float) else str(value)
+        click.echo(f"  {key:<48} {text}")
+
+
+@click.group()
+def cli():
+    """Benchmark candidate retrieval over a corpus of names."""
+
+
+CORPUS_OPTIONS = [
+    click.option("-w", "--work", "work_path", help="namepairs work database."),
+    click.option("-e", "--entities", "entities_path", help="FtM entities file."),
+    click.option("-c", "--category", default="PER", help="Category of names to read."),
+    click.option("-n", "--queries", "n", type=int, default=500, help="Number of queries."),
+    click.option("--limit", type=int, default=10, help="Brute-force results to find."),
+    click.option("--depth", type=int, default=100, help="Candidates per query."),
+    click.option("--no-brute-force", is_flag=True, default=False),
+]
+
+
+def corpus_options(func):
+    for option in reversed(CORPUS_OPTIONS):
+        func = option(func)
+    return func
+
+
+def load_corpus(work_path: Optional[str], entities_path: Optional[str], category: str):
+    if work_path is not None:
+        return list(names_from_work_db(work_path, category=category))
+    if entities_path is not None:
+        return list(names_from_entities(entities_path))
+    raise click.UsageError("Pass either --work or --entities.")
+
+
+@cli.command("index")
+@corpus_options
+@click.option("--ngram-size", type=int, default=3)
+@click.option("--max-df", type=float, default=0.1)
+def bench_index(
+    work_path: Optional[str],
+    entities_path: Optional[str],
+    category: str,
+    n: int,
+    limit: int,
+    depth: int,
+    no_brute_force: bool,
+    ngram_size: int,
+    max_df: float,
+):
+    """Benchmark the token and n-gram inverted index."""
+    corpus = load_corpus(work_path, entities_path, category)
+    started = time.perf_counter()
+    index = NameIndex.from_names(corpus, ngram_size=ngram_size, max_df=max_df)
+    click.echo(f"Indexed {len(index)} names in {time.perf_counter() - started:.1f}s")
+    queries = treated_queries(index.names, index.keys, n=n)
+    results = benchmark_retrieval(
+        lambda q, k: [i for i, _ in index.search(q, limit=k)],
+        index.names,
+        index.keys,
+        queries,
+        limit=limit,
+        depth=depth,
+        brute_force=not no_brute_force,
+    )
+    print_results("Inverted index:", results)
+
+
+@cli.command("phonetic")
+@corpus_options
+@click.option(
+    "--algorithm", type=click.Choice(list(PHONETIC_ALGORITHMS)), default="metaphone"
+)
+def bench_phonetic(
+    work_path: Optional[str],
+    entities_path: Optional[str],
+    category: str,
+    n: int,
+    limit: int,
+    depth: int,
+    no_brute_force: bool,
+    algorithm: str,
+):
+    """Benchmark phonetic blocking, alone and fused with the inverted index."""
+    corpus = load_corpus(work_path, entities_path, category)
+    index = NameIndex.from_names(corpus)
+    phonetic = PhoneticIndex.from_names(corpus, algorithm=algorithm)
+    click.echo(f"Indexed {len(phonetic)} names, {len(phonetic.terms)} phonetic keys")
+    queries = treated_queries(index.names, index.keys, n=n)
+
+    blocks = np.array([len(phonetic.block(q)) for q, _, _ in queries])
+    click.echo(
+        f"Phonetic block size: mean {blocks.mean():.1f}, "
+        f"p50 {np.percentile(blocks, 50):.0f}, p95 {np.percentile(blocks, 95):.0f}, "
+        f"max {blocks.max()} of {len(phonetic)} names"
+    )
+    retrievers: Dict[str, Retriever] = {
+        "Inverted index": lambda q, k: [i for i, _ in index.search(q, limit=k)],
+        "Phonetic index": lambda q, k: [i for i, _ in phonetic.search(q, limit=k)],
+        "Fused": lambda q, k: fuse_candidates(
+            [index.search(q, limit=k), phonetic.search(q, limit=k)], limit=k
+        ),
+    }
+    for title, retrieve in retrievers.items():
+        results = benchmark_retrieval(
+            retrieve,
+            index.names,
+            index.keys,
+            queries,
+            limit=limit,
+            depth=depth,
+            brute_force=not no_brute_force,
+        )
+        print_results(f"{title}:", results)
+
+
+@cli.command("embeddings")
+@corpus_options
+@click.option("-o", "--index-dir", default="name-embeddings", help="Index directory.")
+@click.option("--model", "model_name", default=DEFAULT_MODEL)
+@click.option("--dtype", type=click.Choice(DTYPES), default="float16")
+@click.option("--nlist", type=int, default=None, help="Number of IVF clusters.")
+@click.option("--nprobe", type=int, default=8, help="Clusters searched per query.")
+@click.option("--reuse", is_flag=True, default=False, help="Reuse an existing index.")
+@click.option(
+    "--int8-model", is_flag=True, default=False, help="Quantize the model to int8."
+)
+def bench_embeddings(
+    work_path: Optional[str],
+    entities_path: Optional[str],
+    category: str,
+    n: int,
+    limit: int,
+    depth: int,
+    no_brute_force: bool,
+    index_dir: str,
+    model_name: str,
+    dtype: str,
+    nlist: Optional[int],
+    nprobe: int,
+    reuse: bool,
+    int8_model: bool,
+):
+    """Benchmark embedding encoding and approximate nearest-neighbour search."""
+    corpus = load_corpus(work_path, entities_path, category)
+    keys = [key for key, _ in corpus]
+    names = [name for _, name in corpus]
+    encoder = load_encoder(model_name, int8=int8_model)
+    if reuse:
+        try:
+            index = EmbeddingIndex(index_dir, encoder=encoder, int8_model=int8_model)
+        except ValueError as exc:
+            raise click.UsageError(str(exc))
+    else:
+        started = time.perf_counter()
+        index = EmbeddingIndex.build(
+            index_dir,
+            names,
+            encoder=encoder,
+            model_name=model_name,
+            dtype=dtype,
+            nlist=nlist,
+            int8_model=int8_model,
+        )
+        took = time.perf_counter() - started
+        click.echo(f"Built index of {len(names)} names in {took:.1f}s")
+    queries = treated_queries(names, keys, n=n)
+
+    # Encode the queries in one batch, to separate search from encoding:
+    started = time.perf_counter()
+    vectors = encoder([q for q, _, _ in queries])
+    took = time.perf_counter() - started
+    click.echo(f"Encoded {len(queries)} queries: {len(queries) / took:.0f} names/s")
+    singles = []
+    for query, _, _ in queries[:50]:
+        started = time.perf_counter()
+        encoder([query])
+        singles.append((time.perf_counter() - started) * 1000)
+    click.echo(f"Single query encoding: p50 {np.percentile(singles, 50):.2f}ms")
+    by_query = {q: v for (q, _, _), v in zip(queries, vectors)}
+
+    # Share of the exact nearest neighbours found by the approximate search:
+    clusters = len(index.centroids)
+    found = 0
+    wanted = 0
+    for vector in vectors:
+        exact = index.search_vector(vector, limit=limit, nprobe=clusters)
+        approx = index.search_vector(vector, limit=limit, nprobe=nprobe)
+        found += len({i for i, _ in exact}.intersection(i for i, _ in approx))
+        wanted += len(exact)
+    recall = found / max(wanted, 1)
+    click.echo(f"ANN recall@{limit} at nprobe={nprobe}/{clusters}: {recall:.4f}")
+
+    results = benchmark_retrieval(
+        lambda q, k: [i for i, _ in index.search_vector(by_query[q], k, nprobe)],
+        names,
+        keys,
+        queries,
+        limit=limit,
+        depth=depth,
+        brute_force=not no_brute_force,
+    )
+    print_results("Embedding search (excluding encoding):", results)
+
+
+if __name__ == "__main__":
+    cli()
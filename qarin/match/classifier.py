@@ -0,0 +1,244 @@
+"""Score name pairs with a compact learned classifier, on the CPU.
+
+The classifier is a binned logistic regression (a "scorecard"): each pair
+feature is cut into bins at quantiles of the training data, and every bin has
+a learned weight. Scoring a batch of pairs takes one binary search and one
+lookup per feature, so it keeps up with millions of pairs per second; the
+features themselves are computed by rapidfuzz in C++, as in `PairScorer`.
+Models are trained with `qarin.train.classifier` and stored as JSON.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from fingerprints import fingerprint
+from rapidfuzz import fuzz
+from rapidfuzz.distance import Indel, JaroWinkler, Levenshtein
+from rapidfuzz.process import cpdist
+
+from qarin.match.scorer import PairScorer
+from qarin.match.text import normalize_name
+
+# The features of a pair, in column order. The distances and similarities
+# mirror the metrics of `namepairs/duck_gen.py`, computed on the normalized
+# names (norm) and on their fingerprints (fp); `token_sort` stands in for
+# duck_gen's aligned similarity, which is too slow to compute in Python:
+FEATURES = (
+    "lev_norm",
+    "lev_fp",
+    "dist_norm",
+    "dist_fp",
+    "jaro_winkler",
+    "token_set",
+    "token_sort",
+    "token_dice",
+    "token_diff",
+    "length_ratio",
+)
+# Features that are missing (NaN) when either fingerprint is empty:
+FP_FEATURES = ("lev_fp", "dist_fp")
+# Similarities computed by rapidfuzz, with the factor that scales them to 0..1:
+STRING_FEATURES = {
+    "lev_norm": (Levenshtein.normalized_similarity, 1.0),
+    "lev_fp": (Levenshtein.normalized_similarity, 1.0),
+    "dist_norm": (Levenshtein.distance, 1.0),
+    "dist_fp": (Levenshtein.distance, 1.0),
+    "jaro_winkler": (JaroWinkler.normalized_similarity, 1.0),
+    "token_set": (fuzz.token_set_ratio, 0.01),
+    "token_sort": (fuzz.token_sort_ratio, 0.01),
+}
+
+
+def fingerprint_name(name: str) -> Optional[str]:
+    """A module-level function, so it can be sent to worker processes."""
+    return fingerprint(name)
+
+
+class PairFeatures:
+    """
+    Compute the `FEATURES` of many pairs of names at once. The normalized form
+    and fingerprint of each distinct name are cached, see `PairScorer`.
+    params:
+        workers: int = -1
+            The number of threads to use, -1 for all cores.
+        cache_size: int = 5_000_000
+            The number of prepared names to keep of each form.
+    """
+
+    def __init__(self, workers: int = -1, cache_size: int = 5_000_000):
+        self.workers = workers
+        self.norms = PairScorer(
+            prepare=normalize_name, workers=workers, cache_size=cache_size
+        )
+        self.fingerprints = PairScorer(
+            prepare=fingerprint_name, workers=workers, cache_size=cache_size
+        )
+
+    def compute(
+        self, lefts: Sequence[Optional[str]], rights: Sequence[Optional[str]]
+    ) -> np.ndarray:
+        """
+        Compute the features of each pair of names at the same position in
+        `lefts` and `rights`.
+        returns: a float32 array of shape (pairs, len(FEATURES)), NaN where
+            either name is empty after preparation.
+        """
+        if len(lefts) != len(rights):
+            raise ValueError("Both sides must have the same number of names")
+        n = len(lefts)
+        names = [*lefts, *rights]
+        norms = self.norms.prepare_names(names)
+        fps = self.fingerprints.prepare_names(names)
+        return self.compare(norms[:n], norms[n:], fps[:n], fps[n:])
+
+    def compare(
+        self,
+        left_norms: np.ndarray,
+        right_norms: np.ndarray,
+        left_fps: np.ndarray,
+        right_fps: np.ndarray,
+    ) -> np.ndarray:
+        """Compute the features of prepared names."""
+        n = len(left_norms)
+        features = np.empty((n, len(FEATURES)), dtype=np.float32)
+        for name, (scorer, scale) in STRING_FEATURES.items():
+            fp = name in FP_FEATURES
+            values = cpdist(
+                left_fps if fp else left_norms,
+                right_fps if fp else right_norms,
+                scorer=scorer,
+                dtype=np.float32,
+                workers=self.workers,
+            )
+            features[:, FEATURES.index(name)] = (
+                values * scale if scale != 1.0 else values
+            )
+
+        # The token features are derived from the distinct names only; with
+        # sorted tokens, the Indel similarity is the Dice overlap of the sets:
+        codes, uniques = pd.factorize(np.concatenate([left_norms, right_norms]))
+        tokens = np.empty(len(uniques), dtype=object)
+        for i, norm in enumerate(uniques):
+            tokens[i] = sorted(norm.split())
+        counts = np.array([len(t) for t in tokens], dtype=np.float32)
+        lengths = np.array([len(u) for u in uniques], dtype=np.float32)
+        left, right = codes[:n], codes[n:]
+        features[:, FEATURES.index("token_dice")] = cpdist(
+            tokens[left],
+            tokens[right],
+            scorer=Indel.normalized_similarity,
+            dtype=np.float32,
+            workers=self.workers,
+        )
+        features[:, FEATURES.index("token_diff")] = np.abs(counts[left] - counts[right])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            features[:, FEATURES.index("length_ratio")] = np.minimum(
+                lengths[left], lengths[right]
+            ) / np.maximum(lengths[left], lengths[right])
+
+        features[(left_norms == "") | (right_norms == "")] = np.nan
+        no_fp = (left_fps == "") | (right_fps == "")
+        features[np.ix_(no_fp, [FEATURES.index(f) for f in FP_FEATURES])] = np.nan
+        return features
+
+
+class PairClassifier:
+    """
+    A binned logistic regression over the `FEATURES` of a pair. Values of a
+    feature below `edges[0]` fall into bin 0, values from `edges[k-1]` up to
+    `edges[k]` into bin k, and missing values into a last bin of their own.
+    params:
+        edges: Dict[str, np.ndarray]
+            The increasing bin edges of each feature.
+        weights: Dict[str, np.ndarray]
+            The weight of each bin, `len(edges) + 2` per feature.
+        bias: float
+            The intercept of the model.
+        meta: Dict[str, Any] = None
+            Training details to keep with the model.
+        features: PairFeatures = None
+            Computes the features in `score`, defaults to using all cores.
+
+    Example: score pairs of names
+        model = PairClassifier.load("pair-classifier.json")
+        probs = model.score(["John Smith"], ["Jon Smith"])
+    """
+
+    def __init__(
+        self,
+        edges: Dict[str, np.ndarray],
+        weights: Dict[str, np.ndarray],
+        bias: float,
+        meta: Optional[Dict[str, Any]] = None,
+        features: Optional[PairFeatures] = None,
+    ):
+        if set(edges) != set(FEATURES) or set(weights) != set(FEATURES):
+            raise ValueError(f"The model must cover the features: {FEATURES}")
+        # A trailing infinite edge makes NaN values, which sort after it, land
+        # in the last bin without a separate check:
+        self.edges = [
+            np.append(np.asarray(edges[f], dtype=np.float32), np.inf) for f in FEATURES
+        ]
+        self.weights = [np.asarray(weights[f], dtype=np.float32) for f in FEATURES]
+        for feature, edge, weight in zip(FEATURES, self.edges, self.weights):
+            if len(weight) != len(edge) + 1:
+                raise ValueError(f"Wrong number of weights for {feature}")
+        self.bias = float(bias)
+        self.meta = meta or {}
+        self.features = features or PairFeatures()
+
+    def logits(self, features: np.ndarray) -> np.ndarray:
+        """The log-odds of a match for each row of a `FEATURES` array."""
+        logits = np.full(len(features), self.bias, dtype=np.float32)
+        for col, (edges, weights) in enumerate(zip(self.edges, self.weights)):
+            logits += weights[np.searchsorted(edges, features[:, col], side="right")]
+        return logits
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """The probability of a match for each row of a `FEATURES` array."""
+        logits = self.logits(features)
+        np.negative(logits, out=logits)
+        np.exp(logits, out=logits)
+        logits += 1.0
+        return np.reciprocal(logits, out=logits)
+
+    def score(
+        self, lefts: Sequence[Optional[str]], rights: Sequence[Optional[str]]
+    ) -> np.ndarray:
+        """
+        Score each pair of names at the same position in `lefts` and `rights`.
+        returns: a float32 array of match probabilities between 0 and 1.
+        """
+        return self.predict(self.features.compute(lefts, rights))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "features": list(FEATURES),
+            "edges": {f: e[:-1].tolist() for f, e in zip(FEATURES, self.edges)},
+            "weights": {f: w.tolist() for f, w in zip(FEATURES, self.weights)},
+            "bias": self.bias,
+            "meta": self.meta,
+        }
+
+    def save(self, path: Union[str, Path]):
+        with open(path, "w") as fh:
+            json.dump(self.to_dict(), fh)
+
+    @classmethod
+    def load(
+        cls, path: Union[str, Path], features: Optional[PairFeatures] = None
+    ) -> "PairClassifier":
+        with open(path, "r") as fh:
+            data = json.load(fh)
+        if data["features"] != list(FEATURES):
+            raise ValueError(f"Model was trained on other features: {path}")
+        return cls(
+            edges=data["edges"],
+            weights=data["weights"],
+            bias=data["bias"],
+            meta=data.get("meta"),
+            features=features,
+        )
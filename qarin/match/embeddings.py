@@ -0,0 +1,296 @@
+"""Approximate nearest-neighbour retrieval over name embeddings, on the CPU.
+
+Names are encoded with a small sentence-transformers model and stored as a
+float16 or int8 matrix in a memory-mapped `.npy` file. An inverted-file (IVF)
+index clusters the vectors with spherical k-means; a query is compared to the
+vectors of the `nprobe` clusters closest to it only. The vectors are stored
+sorted by cluster, so that each probe reads one contiguous slice.
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Small multilingual model, names come in many scripts:
+DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+DTYPES = ("float32", "float16", "int8")
+# Vectors used to train the cluster centroids:
+TRAIN_SAMPLE = 100_000
+KMEANS_ITERATIONS = 10
+# Rows compared against the centroids at a time:
+ASSIGN_BATCH_SIZE = 50_000
+
+# Encodes a list of names into unit-length float32 vectors:
+Encoder = Callable[[List[str]], np.ndarray]
+
+
+def load_encoder(
+    model_name: str = DEFAULT_MODEL, batch_size: int = 256, int8: bool = False
+) -> Encoder:
+    """Load a sentence-transformers model on the CPU and wrap it as an
+    `Encoder`. The import is deferred since loading torch takes a while.
+    With `int8`, the model is quantized with `quantize_model`."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    if int8:
+        model = quantize_model(model)
+    return model_encoder(model, batch_size)
+
+
+def quantize_model(model: Any) -> Any:
+    """Quantize the weights of the linear layers of a torch model to int8,
+    with the activations quantized on the fly. Encoding on the CPU gets
+    faster at a small loss of accuracy; returns a quantized copy."""
+    import torch
+
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def model_encoder(model: Any, batch_size: int = 256) -> Encoder:
+    """Wrap a loaded `SentenceTransformer` as an `Encoder`."""
+
+    def encode(names: List[str]) -> np.ndarray:
+        return model.encode(
+            names,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+    return encode
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert float32 vectors to the storage type. For int8, each row is scaled
+    so its largest component maps to 127; the scale is returned alongside so
+    that dot products can be restored.
+    returns: the stored vectors and a float32 scale per row.
+    """
+    if dtype == "int8":
+        peak = np.abs(vectors).max(axis=1, keepdims=True)
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        stored = np.round(vectors / scales).astype(np.int8)
+        return stored, scales[:, 0]
+    return vectors.astype(dtype), np.ones(len(vectors), dtype=np.float32)
+
+
+def _spherical_kmeans(sample: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        lengths = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = lengths[:, 0] == 0
+        # Re-seed empty clusters with random vectors:
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        lengths[empty] = 1.0
+        centroids = sums / lengths
+    return centroids.astype(np.float32)
+
+
+def _batches(items: Sequence[str], size: int) -> Iterator[List[str]]:
+    for start in range(0, len(items), size):
+        yield list(items[start : start + size])
+
+
+class EmbeddingIndex:
+    """
+    An IVF index over memory-mapped name embeddings. Use `EmbeddingIndex.build`
+    to encode a corpus, and `EmbeddingIndex(path)` to open it again. Results
+    are name ids: the position of the name in the corpus, as in `NameIndex`.
+    Queries have to be encoded like the corpus: pass `int8_model` to check
+    that the index was built with an int8-quantized model, or without one.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        encoder: Optional[Encoder] = None,
+        int8_model: Optional[bool] = None,
+    ):
+        self.path = Path(path)
+        with open(self.path / "meta.json", "r") as fh:
+            self.meta = json.load(fh)
+        built_int8 = self.meta.get("int8_model", False)
+        if int8_model is not None and int8_model != built_int8:
+            model = "an int8-quantized" if built_int8 else "a float"
+            raise ValueError(f"Index was encoded with {model} model: {self.path}")
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self.scales = np.load(self.path / "scales.npy", mmap_mode="r")
+        self.ids = np.load(self.path / "ids.npy", mmap_mode="r")
+        self.offsets = np.load(self.path / "offsets.npy")
+        self.centroids = np.load(self.path / "centroids.npy")
+        self._encoder = encoder
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def encoder(self) -> Encoder:
+        if self._encoder is None:
+            int8 = self.meta.get("int8_model", False)
+            self._encoder = load_encoder(self.meta["model"], int8=int8)
+        return self._encoder
+
+    def search_vector(
+        self, query: np.ndarray, limit: int = 10, nprobe: int = 8
+    ) -> List[Tuple[int, float]]:
+        """
+        Find the names whose embeddings are closest to a query vector.
+        params:
+            query: np.ndarray
+                A unit-length float32 vector.
+            limit: int = 10
+                The maximum number of results.
+            nprobe: int = 8
+                The number of clusters to search; more is slower but finds
+                more of the exact nearest neighbours.
+        returns: a list of (name id, cosine similarity) tuples, best first.
+        """
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        ids: List[np.ndarray] = []
+        scores: List[np.ndarray] = []
+        for probe in probes:
+            start, end = self.offsets[probe], self.offsets[probe + 1]
+            if start == end:
+                continue
+            block = np.asarray(self.vectors[start:end], dtype=np.float32)
+            scores.append((block @ query) * self.scales[start:end])
+            ids.append(self.ids[start:end])
+        if not ids:
+            return []
+        all_ids = np.concatenate(ids)
+        all_scores = np.concatenate(scores)
+        if len(all_ids) > limit:
+            top = np.argpartition(-all_scores, limit - 1)[:limit]
+            all_ids, all_scores = all_ids[top], all_scores[top]
+        order = np.argsort(-all_scores, kind="stable")
+        return [(int(all_ids[i]), float(all_scores[i])) for i in order]
+
+    def search(
+        self, name: str, limit: int = 10, nprobe: int = 8
+    ) -> List[Tuple[int, float]]:
+        """Encode a name and find the closest names, see `search_vector`."""
+        return self.search_vector(self.encoder([name])[0], limit, nprobe)
+
+    @classmethod
+    def build(
+        cls,
+        path: Union[str, Path],
+        names: Sequence[str],
+        encoder: Optional[Encoder] = None,
+        model_name: str = DEFAULT_MODEL,
+        dtype: str = "float16",
+        nlist: Optional[int] = None,
+        batch_size: int = 10_000,
+        int8_model: bool = False,
+    ) -> "EmbeddingIndex":
+        """
+        Encode a corpus of names and build an index over their embeddings.
+        params:
+            path: str | Path
+                The directory to write the index to.
+            names: Sequence[str]
+                The names to index, their position is their id.
+            encoder: Encoder = None
+                The encoder to use, defaults to loading `model_name`.
+            dtype: str = "float16"
+                How to store the vectors, one of `DTYPES`.
+            nlist: int = None
+                The number of clusters, defaults to about 4 * sqrt(len(names)).
+            batch_size: int = 10_000
+                The number of names encoded and written at a time.
+            int8_model: bool = False
+                Whether the model is quantized to int8, see `load_encoder`.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype: {dtype}")
+        if not len(names):
+            raise ValueError("Cannot build an embedding index without names")
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "meta.json").unlink(missing_ok=True)
+        encoder = encoder or load_encoder(model_name, int8=int8_model)
+
+        # Encode into a temporary matrix in corpus order:
+        started = time.time()
+        encoded: Any = None
+        scales = np.empty(len(names), dtype=np.float32)
+        position = 0
+        for batch in _batches(names, batch_size):
+            vectors = encoder(batch)
+            if encoded is None:
+                encoded = np.lib.format.open_memmap(
+                    path / "encoded.npy",
+                    mode="w+",
+                    dtype=dtype,
+                    shape=(len(names), vectors.shape[1]),
+                )
+            stored, row_scales = quantize(vectors, dtype)
+            encoded[position : position + len(batch)] = stored
+            scales[position : position + len(batch)] = row_scales
+            position += len(batch)
+        took = time.time() - started
+        log.info(
+            "Encoded %d names in %.1fs (%.0f names/s)",
+            len(names),
+            took,
+            len(names) / max(took, 1e-9),
+        )
+
+        # Cluster a sample of the vectors and assign all of them:
+        rng = np.random.default_rng(0)
+        nlist = nlist or max(1, int(4 * np.sqrt(len(names))))
+        nlist = min(nlist, len(names))
+        sample_ids = np.sort(
+            rng.choice(len(names), min(TRAIN_SAMPLE, len(names)), replace=False)
+        )
+        sample = np.asarray(encoded[sample_ids], dtype=np.float32)
+        sample *= scales[sample_ids, None]
+        sample /= np.maximum(np.linalg.norm(sample, axis=1, keepdims=True), 1e-9)
+        centroids = _spherical_kmeans(sample, nlist)
+        assign = np.empty(len(names), dtype=np.int32)
+        for start in range(0, len(names), ASSIGN_BATCH_SIZE):
+            block = np.asarray(encoded[start : start + ASSIGN_BATCH_SIZE], np.float32)
+            assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        # Write the vectors sorted by cluster, so a probe reads one slice:
+        ids = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        vectors = np.lib.format.open_memmap(
+            path / "vectors.npy", mode="w+", dtype=dtype, shape=encoded.shape
+        )
+        for start in range(0, len(ids), ASSIGN_BATCH_SIZE):
+            chunk = ids[start : start + ASSIGN_BATCH_SIZE]
+            vectors[start : start + len(chunk)] = encoded[chunk]
+        vectors.flush()
+        del vectors, encoded
+        (path / "encoded.npy").unlink()
+        np.save(path / "scales.npy", scales[ids])
+        np.save(path / "ids.npy", ids)
+        np.save(path / "offsets.npy", offsets)
+        np.save(path / "centroids.npy", centroids)
+        meta = {
+            "model": model_name,
+            "int8_model": int8_model,
+            "dtype": dtype,
+            "nlist": nlist,
+        }
+        with open(path / "meta.json", "w") as fh:
+            json.dump(meta, fh)
+        return cls(path, encoder=encoder)
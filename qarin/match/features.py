@@ -0,0 +1,203 @@
+"""A persistent store of precomputed name features, read via memory maps.
+
+The store is a directory of `.npy` files: each text feature is kept as one
+array of UTF-8 bytes plus an array of offsets into it, and the n-gram hashes
+as one uint32 array plus offsets. Opening a store maps these files without
+reading them, so many processes can share one copy of the features.
+"""
+
+import json
+import os
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from fingerprints import fingerprint
+from normality import normalize
+
+from qarin.match.text import name_tokens, ngram_hashes, phonetic_token
+
+# Bump this when the computation of any feature changes, so that stores built
+# with the old code are rejected rather than silently mixed with new features:
+FEATURES_VERSION = 1
+# Text features; lists of tokens are stored joined by spaces:
+TEXT_FEATURES = ("name", "key", "tokens", "latin", "fingerprint", "phonetic")
+# Number of names handed to a worker process at a time:
+BUILD_BATCH_SIZE = 20_000
+
+
+class NameFeatures(NamedTuple):
+    name: str
+    key: str
+    tokens: List[str]
+    latin: List[str]
+    fingerprint: str
+    phonetic: List[str]
+    ngrams: np.ndarray
+
+
+def compute_features(
+    key: Optional[str], name: str, ngram_size: int = 3
+) -> Tuple[Dict[str, str], List[int]]:
+    """Compute the text features and n-gram hashes of a single name."""
+    latin = name_tokens(name)
+    text = {
+        "name": name,
+        "key": key or "",
+        "tokens": normalize(name, lowercase=True, collapse=True) or "",
+        "latin": " ".join(latin),
+        "fingerprint": fingerprint(name) or "",
+        "phonetic": " ".join(phonetic_token(t) for t in latin),
+    }
+    return text, ngram_hashes(latin, ngram_size)
+
+
+def _compute_batch(
+    batch: List[Tuple[Optional[str], str]], ngram_size: int
+) -> List[Tuple[Dict[str, str], List[int]]]:
+    return [compute_features(key, name, ngram_size) for key, name in batch]
+
+
+def _batches(
+    names: Iterable[Tuple[Optional[str], str]], size: int
+) -> Iterator[List[Tuple[Optional[str], str]]]:
+    it = iter(names)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+class FeatureStore:
+    """
+    Precomputed features of a corpus of names, keyed by name id: the position
+    of the name in the corpus, as in `NameIndex`. Use `FeatureStore.build` to
+    create a store, and `FeatureStore(path)` to open it.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / "meta.json", "r") as fh:
+            meta = json.load(fh)
+        if meta.get("version") != FEATURES_VERSION:
+            raise ValueError(
+                f"Feature store {self.path} has version {meta.get('version')}, "
+                f"expected {FEATURES_VERSION}; please rebuild it."
+            )
+        self.count: int = meta["count"]
+        self.ngram_size: int = meta["ngram_size"]
+        self._data: Dict[str, np.ndarray] = {}
+        self._offsets: Dict[str, np.ndarray] = {}
+        for feature in (*TEXT_FEATURES, "ngrams"):
+            data_path = self.path / f"{feature}.data.npy"
+            offsets_path = self.path / f"{feature}.offsets.npy"
+            self._data[feature] = np.load(data_path, mmap_mode="r")
+            self._offsets[feature] = np.load(offsets_path, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def text(self, feature: str, name_id: int) -> str:
+        """Get a text feature of a name."""
+        offsets = self._offsets[feature]
+        start, end = offsets[name_id], offsets[name_id + 1]
+        return self._data[feature][start:end].tobytes().decode("utf-8")
+
+    def column(self, feature: str, ids: Optional[Sequence[int]] = None) -> List[str]:
+        """Get a text feature for many names, by default all of them."""
+        if ids is None:
+            ids = range(self.count)
+        return [self.text(feature, i) for i in ids]
+
+    def ngrams(self, name_id: int) -> np.ndarray:
+        """The sorted n-gram hashes of a name, as a read-only view."""
+        offsets = self._offsets["ngrams"]
+        return self._data["ngrams"][offsets[name_id] : offsets[name_id + 1]]
+
+    def features(self, name_id: int) -> NameFeatures:
+        """Get all features of a name."""
+        return NameFeatures(
+            name=self.text("name", name_id),
+            key=self.text("key", name_id),
+            tokens=self.text("tokens", name_id).split(),
+            latin=self.text("latin", name_id).split(),
+            fingerprint=self.text("fingerprint", name_id),
+            phonetic=self.text("phonetic", name_id).split(),
+            ngrams=self.ngrams(name_id),
+        )
+
+    @classmethod
+    def build(
+        cls,
+        path: Union[str, Path],
+        names: Iterable[Tuple[Optional[str], str]],
+        ngram_size: int = 3,
+        workers: Optional[int] = None,
+    ) -> "FeatureStore":
+        """
+        Compute the features of a corpus of names and write them to a store.
+        params:
+            path: str | Path
+                The directory to write the store to.
+            names: Iterable[Tuple[Optional[str], str]]
+                (key, name) tuples, e.g. from `names_from_work_db`.
+            ngram_size: int = 3
+                The length of the hashed character n-grams.
+            workers: int = None
+                The number of worker processes, defaults to all cores.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta_path = path / "meta.json"
+        # Written last, so that an interrupted build leaves no usable store:
+        meta_path.unlink(missing_ok=True)
+        data = {f: bytearray() for f in TEXT_FEATURES}
+        offsets = {f: array("q", [0]) for f in (*TEXT_FEATURES, "ngrams")}
+        ngrams = array("I")
+        count = 0
+
+        def collect(results: List[Tuple[Dict[str, str], List[int]]]):
+            nonlocal count
+            for text, hashes in results:
+                for feature in TEXT_FEATURES:
+                    data[feature].extend(text[feature].encode("utf-8"))
+                    offsets[feature].append(len(data[feature]))
+                ngrams.extend(hashes)
+                offsets["ngrams"].append(len(ngrams))
+                count += 1
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Only keep a few batches in flight, so the names can be streamed:
+            pending: Deque[Future] = deque()
+            for batch in _batches(names, BUILD_BATCH_SIZE):
+                pending.append(pool.submit(_compute_batch, batch, ngram_size))
+                if len(pending) >= workers * 2:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+
+        for feature in TEXT_FEATURES:
+            values = np.frombuffer(data[feature], dtype=np.uint8)
+            np.save(path / f"{feature}.data.npy", values)
+        np.save(path / "ngrams.data.npy", np.frombuffer(ngrams, dtype=np.uint32))
+        for feature, positions in offsets.items():
+            values = np.frombuffer(positions, dtype=np.int64)
+            np.save(path / f"{feature}.offsets.npy", values)
+        meta = {"version": FEATURES_VERSION, "count": count, "ngram_size": ngram_size}
+        with open(meta_path, "w") as fh:
+            json.dump(meta, fh)
+        return cls(path)
@@ -0,0 +1,218 @@
+"""In-memory inverted index for retrieving candidate names to match against."""
+
+import json
+import math
+from array import array
+from pathlib import Path
+from typing import Dict, Generator, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from followthemoney import model
+from followthemoney.types import registry
+
+from qarin.match.text import name_tokens, token_ngrams
+
+# Prefix of n-gram terms, keeping them apart from whole-token terms:
+NGRAM_PREFIX = "#"
+
+
+class NameIndex:
+    """
+    An inverted index over the tokens and character n-grams of names. Each
+    name gets an integer id in the order it was added; postings are stored as
+    one contiguous int32 array, sliced by term offsets. Candidates are ranked
+    by the cosine similarity of their IDF-weighted term sets.
+    params:
+        ngram_size: int = 3
+            The length of the character n-grams, 0 to only index tokens.
+        ngram_weight: float = 0.5
+            The weight of an n-gram relative to a whole token.
+        max_df: float = 0.1
+            N-grams which occur in more than this share of names are skipped
+            when querying, since their long postings cost more time than they
+            add information.
+    """
+
+    def __init__(
+        self, ngram_size: int = 3, ngram_weight: float = 0.5, max_df: float = 0.1
+    ):
+        self.ngram_size = ngram_size
+        self.ngram_weight = ngram_weight
+        self.max_df = max_df
+        self.names: List[str] = []
+        self.keys: List[Optional[str]] = []
+        self.terms: Dict[str, int] = {}
+        self._building: List[array] = []
+        self.offsets: Optional[np.ndarray] = None
+        self.postings: Optional[np.ndarray] = None
+        self.weights: Optional[np.ndarray] = None
+        self.lengths: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def name_terms(self, name: str) -> List[str]:
+        """The distinct tokens and n-grams of a name."""
+        terms: Dict[str, None] = {}
+        for token in name_tokens(name):
+            terms[token] = None
+            if self.ngram_size > 0:
+                for gram in token_ngrams(token, self.ngram_size):
+                    terms[NGRAM_PREFIX + gram] = None
+        return list(terms)
+
+    def add(self, name: str, key: Optional[str] = None) -> int:
+        """Add a name to the index, returning its id. `key` is usually the ID
+        of the entity the name belongs to."""
+        if self.postings is not None:
+            raise RuntimeError("Cannot add names to an index after build()")
+        name_id = len(self.names)
+        self.names.append(name)
+        self.keys.append(key)
+        for term in self.name_terms(name):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                term_id = self.terms[term] = len(self._building)
+                self._building.append(array("i"))
+            self._building[term_id].append(name_id)
+        return name_id
+
+    def build(self) -> "NameIndex":
+        """Freeze the postings into arrays and compute the term weights."""
+        counts = np.fromiter((len(p) for p in self._building), dtype=np.int64)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.postings = np.empty(self.offsets[-1], dtype=np.int32)
+        for term_id, postings in enumerate(self._building):
+            start = self.offsets[term_id]
+            self.postings[start : start + len(postings)] = np.frombuffer(
+                postings, dtype=np.int32
+            )
+        self._building = []
+
+        kinds = np.ones(len(counts), dtype=np.float32)
+        for term, term_id in self.terms.items():
+            if term.startswith(NGRAM_PREFIX):
+                kinds[term_id] = self.ngram_weight
+        idf = np.log(max(len(self.names), 1) / np.maximum(counts, 1)) + 1.0
+        self.weights = (idf * kinds).astype(np.float32)
+
+        # The length of each name's term vector, for cosine normalisation:
+        squares = np.repeat(self.weights**2, counts)
+        self.lengths = np.sqrt(
+            np.bincount(self.postings, weights=squares, minlength=len(self.names))
+        ).astype(np.float32)
+        return self
+
+    def search(self, name: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Find the names most similar to the given one.
+        params:
+            name: str
+                The name to look up.
+            limit: int = 10
+                The maximum number of candidates to return.
+        returns: a list of (name id, score) tuples, best first.
+        """
+        if self.postings is None:
+            raise RuntimeError("The index must be built before searching")
+        max_postings = max(1, int(self.max_df * len(self.names)))
+        slices: List[np.ndarray] = []
+        products: List[np.ndarray] = []
+        query_length = 0.0
+        for term in self.name_terms(name):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            weight = float(self.weights[term_id])
+            query_length += weight**2
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            if term.startswith(NGRAM_PREFIX) and end - start > max_postings:
+                continue
+            slices.append(self.postings[start:end])
+            products.append(np.full(end - start, weight**2, dtype=np.float32))
+        if not slices:
+            return []
+        ids, inverse = np.unique(np.concatenate(slices), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(products))
+        scores /= self.lengths[ids] * math.sqrt(query_length)
+        if len(ids) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def search_keys(self, name: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Like `search`, but return the best score for each distinct key."""
+        best: Dict[str, float] = {}
+        for name_id, score in self.search(name, limit=limit):
+            key = self.keys[name_id] or str(name_id)
+            best[key] = max(best.get(key, 0.0), score)
+        return sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+
+    @classmethod
+    def from_names(
+        cls, names: Iterable[Tuple[Optional[str], str]], **kwargs
+    ) -> "NameIndex":
+        """Build an index from (key, name) tuples."""
+        index = cls(**kwargs)
+        for key, name in names:
+            index.add(name, key=key)
+        return index.build()
+
+
+def fuse_candidates(
+    results: Iterable[List[Tuple[int, float]]], limit: int = 10, k: int = 60
+) -> List[int]:
+    """
+    Merge the ranked candidates of several indexes over the same names, e.g.
+    `NameIndex` and `PhoneticIndex`, by reciprocal rank fusion: their scores
+    are not comparable, but their ranks are.
+    returns: up to `limit` name ids, best first.
+    """
+    fused: Dict[int, float] = {}
+    for result in results:
+        for rank, (name_id, _) in enumerate(result):
+            fused[name_id] = fused.get(name_id, 0.0) + 1.0 / (k + rank + 1)
+    ranked = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+    return [name_id for name_id, _ in ranked[:limit]]
+
+
+def names_from_work_db(
+    path: Union[str, Path], category: Optional[str] = None
+) -> Generator[Tuple[str, str], None, None]:
+    """
+    Read (entity ID, name) tuples from the `names` table of a work database
+    built by `namepairs/duck_gen.py`. Needs the `duckdb` package.
+    params:
+        path: str | Path
+            The DuckDB work database.
+        category: str = None
+            Only read names of the given category, `PER` or `ORG`.
+    """
+    import duckdb
+
+    con = duckdb.connect(str(path), read_only=True)
+    try:
+        query = "SELECT DISTINCT entity_id, name FROM names"
+        params: List[str] = []
+        if category is not None:
+            query += " WHERE category = ?"
+            params.append(category)
+        cur = con.execute(query, params)
+        while rows := cur.fetchmany(10_000):
+            yield from rows
+    finally:
+        con.close()
+
+
+def names_from_entities(
+    path: Union[str, Path]
+) -> Generator[Tuple[str, str], None, None]:
+    """Read (entity ID, name) tuples from a file of FtM entities, one JSON
+    object per line."""
+    with open(path, "r") as fh:
+        for line in fh:
+            proxy = model.get_proxy(json.loads(line))
+            for name in proxy.get_type_values(registry.name):
+                yield proxy.id, name
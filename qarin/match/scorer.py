@@ -0,0 +1,182 @@
+"""Score large batches of name pairs in one call."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
+from rapidfuzz.distance import JaroWinkler, Levenshtein
+from rapidfuzz.process import cpdist
+
+from qarin.evaluate.pairs import pairs_dataset, pairs_filter
+from qarin.match.features import FeatureStore
+from qarin.match.text import normalize_name
+
+# Similarity functions, each scaled to 0..1 by the factor next to it:
+METRICS: Dict[str, tuple] = {
+    "levenshtein": (Levenshtein.normalized_similarity, 1.0),
+    "jaro_winkler": (JaroWinkler.normalized_similarity, 1.0),
+    "token_set": (fuzz.token_set_ratio, 0.01),
+    "token_sort": (fuzz.token_sort_ratio, 0.01),
+    "wratio": (fuzz.WRatio, 0.01),
+}
+# Preparing fewer new names than this is not worth starting worker processes:
+PARALLEL_PREPARE = 50_000
+
+
+class PairScorer:
+    """
+    Compute similarity scores for many pairs of names at once, as a faster
+    replacement for comparing two `EntityProxy` objects at a time. Each
+    distinct name is normalized only once and kept in a cache; the string
+    comparisons run in rapidfuzz's C++ code across all cores.
+    params:
+        weights: Dict[str, float] = None
+            Metrics from `METRICS` and their weight in the score, defaults to
+            the Levenshtein similarity alone.
+        prepare: Callable[[str], Optional[str]] = normalize_name
+            The preprocessing applied to each name before comparison.
+        workers: int = -1
+            The number of threads/processes to use, -1 for all cores.
+        cache_size: int = 5_000_000
+            The number of prepared names to keep; the cache is cleared when
+            it grows beyond this.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        prepare: Callable[[str], Optional[str]] = normalize_name,
+        workers: int = -1,
+        cache_size: int = 5_000_000,
+    ):
+        self.weights = weights or {"levenshtein": 1.0}
+        for metric in self.weights:
+            if metric not in METRICS:
+                raise ValueError(f"Unknown metric: {metric}")
+        self.prepare = prepare
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def prepare_names(self, names: Sequence[Optional[str]]) -> np.ndarray:
+        """Prepare a list of names for comparison, using the cache where
+        possible. Returns an object array of strings, with missing names as
+        empty strings."""
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+        missing = [n for n in uniques if n not in self.cache]
+        self.misses += len(missing)
+        self.hits += len(uniques) - len(missing)
+        if len(self.cache) + len(missing) > self.cache_size:
+            self.cache.clear()
+        if len(missing) >= PARALLEL_PREPARE and self.workers != 1:
+            workers = (os.cpu_count() or 1) if self.workers < 1 else self.workers
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(missing) // (4 * workers))
+                prepared = list(pool.map(self.prepare, missing, chunksize=chunksize))
+        else:
+            prepared = [self.prepare(n) for n in missing]
+        for name, value in zip(missing, prepared):
+            self.cache[name] = value or ""
+        # The extra trailing entry is picked by the code -1 of missing names:
+        values = np.array([self.cache.get(n, "") for n in uniques] + [""], dtype=object)
+        return values[codes]
+
+    def score(
+        self, lefts: Sequence[Optional[str]], rights: Sequence[Optional[str]]
+    ) -> np.ndarray:
+        """
+        Score each pair of names at the same position in `lefts` and `rights`.
+        returns: a float32 array of scores between 0 and 1, NaN where either
+            name is empty after preparation.
+        """
+        if len(lefts) != len(rights):
+            raise ValueError("Both sides must have the same number of names")
+        return self.compare(self.prepare_names(lefts), self.prepare_names(rights))
+
+    def score_ids(
+        self,
+        store: FeatureStore,
+        left_ids: Sequence[int],
+        right_ids: Sequence[int],
+        feature: str = "latin",
+    ) -> np.ndarray:
+        """
+        Score pairs of names from a `FeatureStore`, given by their ids. The
+        precomputed `feature` is compared instead of preparing the names, so
+        neither the `prepare` function nor the cache are used.
+        """
+        if len(left_ids) != len(right_ids):
+            raise ValueError("Both sides must have the same number of names")
+        all_ids = np.concatenate([np.asarray(left_ids), np.asarray(right_ids)])
+        ids, inverse = np.unique(all_ids, return_inverse=True)
+        values = np.array(store.column(feature, ids.tolist()), dtype=object)
+        return self.compare(
+            values[inverse[: len(left_ids)]], values[inverse[len(left_ids) :]]
+        )
+
+    def compare(
+        self, left_prepared: np.ndarray, right_prepared: np.ndarray
+    ) -> np.ndarray:
+        """Compute the weighted similarity of prepared names."""
+        scores = np.zeros(len(left_prepared), dtype=np.float32)
+        total = sum(self.weights.values())
+        for metric, weight in self.weights.items():
+            scorer, scale = METRICS[metric]
+            sims = cpdist(
+                left_prepared,
+                right_prepared,
+                scorer=scorer,
+                dtype=np.float32,
+                workers=self.workers,
+            )
+            scores += sims * (scale * weight / total)
+        scores[(left_prepared == "") | (right_prepared == "")] = np.nan
+        return scores
+
+    def score_pairs_file(
+        self,
+        path: Union[str, Path],
+        match: Optional[bool] = None,
+        category: Optional[str] = None,
+        columns: Sequence[str] = ("left_name", "right_name", "match"),
+        batch_size: int = 1_000_000,
+    ) -> pd.DataFrame:
+        """
+        Score the pairs of a Parquet export from `namepairs/duck_gen.py`.
+        params:
+            path: str | Path
+                The directory of the Parquet pairs export.
+            match: bool = None
+                Only score positive (True) or negative (False) pairs.
+            category: str = None
+                Only score pairs of the given category, `PER` or `ORG`.
+            columns: Sequence[str] = ("left_name", "right_name", "match")
+                The columns of the export to return alongside the scores.
+            batch_size: int = 1_000_000
+                The number of pairs read and scored at a time.
+        returns: a data frame of the given columns and a `score` column.
+        """
+        dataset = pairs_dataset(path)
+        read = list(dict.fromkeys(["left_name", "right_name", *columns]))
+        batches = dataset.to_batches(
+            columns=read,
+            filter=pairs_filter(match=match, category=category),
+            batch_size=batch_size,
+        )
+        frames = []
+        for batch in batches:
+            frame = batch.select(list(columns)).to_pandas()
+            frame["score"] = self.score(
+                batch.column("left_name").to_pylist(),
+                batch.column("right_name").to_pylist(),
+            )
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=[*columns, "score"])
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,58 @@
+"""Text preparation shared by the matchers and indexes in `qarin.match`."""
+
+import zlib
+from functools import lru_cache
+from typing import List, Optional
+
+from jellyfish import metaphone
+from normality import normalize
+
+
+@lru_cache(maxsize=200_000)
+def normalize_name(name: str) -> Optional[str]:
+    """
+    Lower-case and latinize a name, replacing punctuation with spaces.
+    Joe O'Biden -> joe o biden
+    """
+    return normalize(name, lowercase=True, collapse=True, latinize=True)
+
+
+def name_tokens(name: str) -> List[str]:
+    """Split a name into its normalized tokens."""
+    norm = normalize_name(name)
+    if norm is None:
+        return []
+    return norm.split(" ")
+
+
+def token_ngrams(token: str, n: int = 3) -> List[str]:
+    """
+    Character n-grams of a token, padded so that the start and end of the
+    token make up n-grams of their own.
+    joe -> [" jo", "joe", "oe "]
+    """
+    padded = f" {token} "
+    if len(padded) <= n:
+        return [padded]
+    return [padded[i : i + n] for i in range(len(padded) - n + 1)]
+
+
+@lru_cache(maxsize=200_000)
+def phonetic_token(token: str) -> str:
+    """
+    Metaphone key of a latinized token, empty for tokens without letters.
+    picasso -> PKS
+    """
+    return metaphone(token)
+
+
+def phonetic_tokens(name: str) -> List[str]:
+    """The phonetic keys of the tokens of a name, skipping empty keys."""
+    keys = (phonetic_token(t) for t in name_tokens(name))
+    return [k for k in keys if k]
+
+
+def ngram_hashes(tokens: List[str], n: int = 3) -> List[int]:
+    """Sorted, distinct 32-bit hashes of the character n-grams of tokens."""
+    grams = {g for t in tokens for g in token_ngrams(t, n)}
+    return sorted(zlib.crc32(g.encode("utf-8")) for g in grams)
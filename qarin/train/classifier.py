@@ -0,0 +1,305 @@
+"""Train the pair classifier of `qarin.match.classifier` on namepairs data.
+
+python -m qarin.train.classifier fit data/pairs -o pair-classifier.json
+python -m qarin.train.classifier benchmark pair-classifier.json data/pairs
+"""
+
+import logging
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from qarin.evaluate.metrics import summary
+from qarin.match.classifier import FEATURES, PairClassifier, PairFeatures
+from qarin.train.data import Batch, NameTextEncoder, PairStream, batch_labels
+
+log = logging.getLogger(__name__)
+
+# Adam step sizes and decay rates of the gradient averages:
+LEARNING_RATE = 0.05
+BETAS = (0.9, 0.999)
+
+
+@lru_cache(maxsize=1)
+def _process_features(cache_size: int) -> PairFeatures:
+    """One feature cache per encoding process, kept across chunks."""
+    return PairFeatures(workers=1, cache_size=cache_size)
+
+
+class PairFeatureEncoder:
+    """Encode pairs as a float32 `features` array, see `PairFeatures`, and a
+    float32 `label` array, for use with `PairStream`."""
+
+    def __init__(self, cache_size: int = 1_000_000):
+        self.cache_size = cache_size
+
+    def __call__(self, batch: pa.RecordBatch) -> Batch:
+        features = _process_features(self.cache_size).compute(
+            batch.column("left_name").to_pylist(),
+            batch.column("right_name").to_pylist(),
+        )
+        return {"features": features, "label": batch_labels(batch)}
+
+
+def load_features(
+    path: Union[str, Path],
+    max_pairs: int = 1_000_000,
+    category: Optional[str] = None,
+    workers: Optional[int] = None,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the features of a random sample of pairs from a pairs export.
+    returns: the features, of shape (pairs, len(FEATURES)), and the labels.
+    """
+    stream = PairStream(
+        path,
+        encoder=PairFeatureEncoder(),
+        batch_size=min(max_pairs, 50_000),
+        buffer_size=min(max_pairs, 200_000),
+        category=category,
+        workers=workers,
+        drop_last=False,
+        seed=seed,
+    )
+    sample = stream.sample(max_pairs)
+    return sample["features"], sample["label"]
+
+
+def _bin_edges(values: np.ndarray, bins: int) -> np.ndarray:
+    """Edges at the quantiles of the known values; features with few distinct
+    values, such as edit distances, end up with fewer bins."""
+    known = values[~np.isnan(values)]
+    if not len(known):
+        return np.zeros(0, dtype=np.float32)
+    quantiles = np.quantile(known, np.linspace(0, 1, bins + 1)[1:-1])
+    # A bin must start at a value that occurs, so that it is ever filled:
+    edges = np.unique(known[np.searchsorted(np.sort(known), quantiles)])
+    return edges[edges > known.min()].astype(np.float32)
+
+
+def fit_classifier(
+    features: np.ndarray,
+    labels: np.ndarray,
+    bins: int = 32,
+    iterations: int = 300,
+    l2: float = 1e-4,
+    smoothing: float = 1e-3,
+    learning_rate: float = LEARNING_RATE,
+) -> PairClassifier:
+    """
+    Fit a `PairClassifier` by minimizing the log loss with full-batch Adam.
+    Each pair is turned into the index of one bin per feature, so that the
+    scores are a sum of looked-up weights and the gradient a `bincount`.
+    params:
+        features: np.ndarray
+            The pair features, see `PairFeatures.compute`.
+        labels: np.ndarray
+            1 for matching pairs, 0 for others.
+        bins: int = 32
+            The largest number of bins per feature, besides the missing bin.
+        iterations: int = 300
+            The number of gradient steps.
+        l2: float = 1e-4
+            Penalty on the squared weights.
+        smoothing: float = 1e-3
+            Penalty on the squared difference between neighbouring bins of a
+            feature, which keeps the weights from jumping between bins.
+        learning_rate: float = LEARNING_RATE
+            The Adam step size.
+    """
+    n, width = features.shape
+    labels = labels.astype(np.float64)
+    positives = labels.mean()
+    if not 0.0 < positives < 1.0:
+        raise ValueError("Need both matching and non-matching pairs to train")
+    edges = [_bin_edges(features[:, col], bins) for col in range(width)]
+    sizes = np.array([len(e) + 2 for e in edges])
+    offsets = np.cumsum(sizes) - sizes
+    # The bin of each pair in one weight vector of all features; as in
+    # `PairClassifier.logits`, missing values sort into the last bin:
+    index = np.empty((n, width), dtype=np.int32)
+    for col, edge in enumerate(edges):
+        bounded = np.append(edge, np.inf)
+        index[:, col] = np.searchsorted(bounded, features[:, col], side="right")
+    index += offsets.astype(np.int32)
+    flat = index.ravel()
+    # Neighbouring bins of each feature, excluding the missing bin:
+    lower = np.concatenate([np.arange(o, o + s - 2) for o, s in zip(offsets, sizes)])
+
+    weights = np.zeros(int(sizes.sum()))
+    bias = np.log(positives / (1.0 - positives))
+    # The gradients of the weights and of the bias, and their averages:
+    gradient = np.zeros(len(weights) + 1)
+    moment = np.zeros_like(gradient)
+    second = np.zeros_like(gradient)
+    beta1, beta2 = BETAS
+    for step in range(1, iterations + 1):
+        logits = bias + weights[index].sum(axis=1)
+        residual = 1.0 / (1.0 + np.exp(-logits)) - labels
+        grad = np.bincount(
+            flat, weights=np.repeat(residual, width), minlength=len(weights)
+        )
+        grad = grad / n + 2 * l2 * weights
+        jumps = 2 * smoothing * (weights[lower + 1] - weights[lower])
+        np.subtract.at(grad, lower, jumps)
+        np.add.at(grad, lower + 1, jumps)
+        gradient[:-1] = grad
+        gradient[-1] = residual.mean()
+        moment = beta1 * moment + (1 - beta1) * gradient
+        second = beta2 * second + (1 - beta2) * gradient**2
+        update = learning_rate * (moment / (1 - beta1**step))
+        update /= np.sqrt(second / (1 - beta2**step)) + 1e-8
+        weights -= update[:-1]
+        bias -= update[-1]
+        if step % 50 == 0 or step == iterations:
+            log.info("Step %d: log loss %.5f", step, log_loss(residual, labels))
+
+    return PairClassifier(
+        edges={f: e for f, e in zip(FEATURES, edges)},
+        weights={f: weights[o : o + s] for f, o, s in zip(FEATURES, offsets, sizes)},
+        bias=bias,
+        meta={
+            "pairs": n,
+            "positives": float(positives),
+            "bins": bins,
+            "iterations": iterations,
+            "l2": l2,
+            "smoothing": smoothing,
+        },
+    )
+
+
+def log_loss(residual: np.ndarray, labels: np.ndarray) -> float:
+    """The mean log loss, given the residuals `probability - label`."""
+    probs = np.clip(residual + labels, 1e-7, 1 - 1e-7)
+    return float(-np.mean(labels * np.log(probs) + (1 - labels) * np.log(1 - probs)))
+
+
+def evaluate_classifier(
+    model: PairClassifier, features: np.ndarray, labels: np.ndarray
+) -> pd.DataFrame:
+    """
+    Compare the classifier on held-out pairs to its best single feature, the
+    Levenshtein similarity of the normalized names or of the fingerprints,
+    as combined into the `score` of `namepairs/duck_gen.py`.
+    returns: the `summary` metrics of both, at a threshold of 0.5.
+    """
+    lev = np.fmax(
+        features[:, FEATURES.index("lev_norm")], features[:, FEATURES.index("lev_fp")]
+    )
+    scores = {"classifier": model.predict(features), "levenshtein": np.nan_to_num(lev)}
+    results = pd.concat(
+        [
+            pd.DataFrame({"matcher": matcher, "score": score, "match": labels > 0})
+            for matcher, score in scores.items()
+        ],
+        ignore_index=True,
+    )
+    return summary(results, by="matcher", threshold=0.5)
+
+
+def print_table(table: pd.DataFrame):
+    click.echo(table.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+
+@click.group()
+def cli():
+    """Train and benchmark the pair classifier of `qarin.match.classifier`."""
+    logging.basicConfig(level=logging.INFO)
+
+
+@cli.command("fit")
+@click.argument("pairs_path", type=click.Path(exists=True))
+@click.option("-o", "--output", default="pair-classifier.json", help="Model file.")
+@click.option("-n", "--max-pairs", type=int, default=1_000_000)
+@click.option("-c", "--category", default=None, help="Only train on PER or ORG.")
+@click.option("--holdout", type=float, default=0.1, help="Share of pairs to test on.")
+@click.option("--bins", type=int, default=32)
+@click.option("--iterations", type=int, default=300)
+@click.option("--workers", type=int, default=None)
+def fit_command(
+    pairs_path: str,
+    output: str,
+    max_pairs: int,
+    category: Optional[str],
+    holdout: float,
+    bins: int,
+    iterations: int,
+    workers: Optional[int],
+):
+    """Train a classifier on a Parquet pairs export or a CSV file of pairs."""
+    started = time.perf_counter()
+    features, labels = load_features(
+        pairs_path, max_pairs=max_pairs, category=category, workers=workers
+    )
+    took = time.perf_counter() - started
+    click.echo(
+        f"Computed features of {len(labels)} pairs in {took:.1f}s "
+        f"({len(labels) / took:.0f} pairs/s), {labels.mean():.1%} matching"
+    )
+    split = int(len(labels) * (1 - holdout))
+    started = time.perf_counter()
+    model = fit_classifier(
+        features[:split], labels[:split], bins=bins, iterations=iterations
+    )
+    took = time.perf_counter() - started
+    click.echo(f"Trained on {split} pairs in {took:.1f}s")
+    model.meta["category"] = category
+    model.save(output)
+    if split < len(labels):
+        probs = model.predict(features[split:])
+        loss = log_loss(probs - labels[split:], labels[split:])
+        click.echo(f"Held-out pairs: {len(labels) - split}, log loss {loss:.4f}")
+        print_table(evaluate_classifier(model, features[split:], labels[split:]))
+
+
+@cli.command("benchmark")
+@click.argument("model_path", type=click.Path(exists=True))
+@click.argument("pairs_path", type=click.Path(exists=True))
+@click.option("-n", "--pairs", "n", type=int, default=200_000)
+@click.option("--repeat", type=int, default=5, help="Timed runs of each step.")
+def benchmark_command(model_path: str, pairs_path: str, n: int, repeat: int):
+    """Measure the throughput of feature computation and of the model."""
+    # A random sample of the names as they are, without reading the whole export:
+    stream = PairStream(
+        pairs_path,
+        encoder=NameTextEncoder(normalize=False),
+        batch_size=min(n, 50_000),
+        buffer_size=min(n, 200_000),
+        workers=1,
+        drop_last=False,
+    )
+    sample = stream.sample(n)
+    lefts = sample["left"].tolist()
+    rights = sample["right"].tolist()
+    model = PairClassifier.load(model_path)
+    timings: Dict[str, Any] = {}
+
+    started = time.perf_counter()
+    features = model.features.compute(lefts, rights)
+    timings["Features, names not cached"] = time.perf_counter() - started
+    for label, run in (
+        ("Features, names cached", lambda: model.features.compute(lefts, rights)),
+        ("Model on computed features", lambda: model.predict(features)),
+        ("Features and model", lambda: model.score(lefts, rights)),
+    ):
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            runs.append(time.perf_counter() - started)
+        timings[label] = float(np.median(runs))
+    click.echo(f"Scored {len(lefts)} pairs:")
+    for label, took in timings.items():
+        click.echo(f"  {label:<32} {len(lefts) / took:>12,.0f} pairs/s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,349 @@
+"""Stream labelled name pairs from `namepairs/duck_gen.py` into training batches.
+
+The pairs are read in chunks, from a Parquet export or a CSV file, encoded in
+worker processes, and shuffled through a bounded buffer, so that memory use
+depends on the buffer size and not on the number of pairs. For Parquet
+exports, the order of the row groups is shuffled as well: the export is
+partitioned by `match` and sorted by score, so reading it in order would
+yield long runs of similar pairs that no buffer could mix.
+"""
+
+import os
+import random
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+
+from qarin.evaluate.pairs import pairs_dataset, pairs_filter
+from qarin.match.text import name_tokens, normalize_name, token_ngrams
+
+# Turns a chunk of pairs into arrays with one row per pair:
+Encoder = Callable[[pa.RecordBatch], Dict[str, np.ndarray]]
+Batch = Dict[str, np.ndarray]
+# The columns read by the default encoders:
+PAIR_COLUMNS = ["left_name", "right_name", "match"]
+# Pairs read from the file and handed to an encoder at a time:
+READ_SIZE = 10_000
+# Parquet row groups read from at the same time, in random turns:
+INTERLEAVE = 16
+
+
+@lru_cache(maxsize=500_000)
+def _token_hashes(token: str, ngram_size: int, buckets: int) -> Tuple[int, ...]:
+    """Hashed ids of the n-grams of a token; tokens recur across many names."""
+    grams = token_ngrams(token, ngram_size)
+    return tuple(zlib.crc32(g.encode("utf-8")) % buckets + 1 for g in grams)
+
+
+def batch_labels(batch: pa.RecordBatch) -> np.ndarray:
+    """The `match` column of a chunk of pairs as float32 labels, for encoders."""
+    labels = batch.column("match").to_numpy(zero_copy_only=False)
+    return labels.astype(np.float32)
+
+
+class HashedNgramEncoder:
+    """
+    Encode each name as the hashed ids of the character n-grams of its
+    normalized tokens, padded with 0 to a fixed length, for models with an
+    embedding bag over n-grams.
+    params:
+        ngram_size: int = 3
+            The length of the character n-grams.
+        buckets: int = 2**18
+            The number of hash buckets, ids range from 1 to `buckets`.
+        max_ngrams: int = 48
+            The length of each row; longer names are truncated.
+    returns: `left` and `right` int32 arrays of shape (pairs, max_ngrams),
+        and a float32 `label` array.
+    """
+
+    def __init__(self, ngram_size: int = 3, buckets: int = 2**18, max_ngrams: int = 48):
+        self.ngram_size = ngram_size
+        self.buckets = buckets
+        self.max_ngrams = max_ngrams
+
+    def encode_names(self, names: List[Optional[str]]) -> np.ndarray:
+        # Names recur across pairs, so each distinct name is encoded once:
+        rows: Dict[Optional[str], int] = {}
+        index = np.array([rows.setdefault(n, len(rows)) for n in names], dtype=np.int64)
+        flat: List[int] = []
+        lengths = np.zeros(len(rows), dtype=np.int64)
+        for row, name in enumerate(rows):
+            hashes: List[int] = []
+            for token in name_tokens(name or ""):
+                hashes.extend(_token_hashes(token, self.ngram_size, self.buckets))
+            flat.extend(hashes[: self.max_ngrams])
+            lengths[row] = min(len(hashes), self.max_ngrams)
+        # Scatter the ids of all names into the padded matrix at once:
+        ids = np.zeros((len(rows), self.max_ngrams), dtype=np.int32)
+        starts = np.cumsum(lengths) - lengths
+        cols = np.arange(len(flat)) - np.repeat(starts, lengths)
+        ids[np.repeat(np.arange(len(rows)), lengths), cols] = flat
+        return ids[index]
+
+    def __call__(self, batch: pa.RecordBatch) -> Batch:
+        return {
+            "left": self.encode_names(batch.column("left_name").to_pylist()),
+            "right": self.encode_names(batch.column("right_name").to_pylist()),
+            "label": batch_labels(batch),
+        }
+
+
+class NameTextEncoder:
+    """Keep the names as strings, e.g. for a sentence-transformers model which
+    tokenizes them itself. Returns object arrays `left` and `right` and a
+    float32 `label` array. With `normalize=False`, the names are kept as they
+    are, as they would be passed to the model at inference time."""
+
+    def __init__(self, normalize: bool = True):
+        self.normalize = normalize
+
+    def __call__(self, batch: pa.RecordBatch) -> Batch:
+        return {
+            side: np.array(
+                [
+                    (normalize_name(n or "") if self.normalize else n) or ""
+                    for n in batch.column(f"{side}_name").to_pylist()
+                ],
+                dtype=object,
+            )
+            for side in ("left", "right")
+        } | {"label": batch_labels(batch)}
+
+
+class PairStream:
+    """
+    An iterable over fixed-size batches of encoded pairs, which never holds
+    more than the shuffle buffer and a few chunks in memory. Each iteration
+    is one epoch, with a different shuffle.
+    params:
+        path: str | Path
+            A Parquet pairs export (a directory), or a CSV file.
+        encoder: Encoder = None
+            Turns chunks of pairs into arrays, defaults to `HashedNgramEncoder`.
+        batch_size: int = 1024
+            The number of pairs in each batch.
+        buffer_size: int = 200_000
+            The number of encoded pairs to shuffle among; 0 keeps file order.
+        columns: List[str] = PAIR_COLUMNS
+            The columns the encoder needs.
+        match: bool = None
+            Only read positive (True) or negative (False) pairs (Parquet only).
+        category: str = None
+            Only read pairs of the given category (Parquet only).
+        min_score: float = None
+            Only read pairs with a duck_gen `score` above this (Parquet only),
+            e.g. to pick hard negatives.
+        workers: int = None
+            The number of encoding processes, defaults to all cores; 1 encodes
+            in the current process.
+        drop_last: bool = True
+            Skip the last batch of an epoch if it is smaller than `batch_size`.
+        seed: int = 0
+            Seed of the shuffle, incremented with each epoch.
+        read_size: int = READ_SIZE
+            The number of pairs read and encoded at a time.
+
+    Example: train for three epochs
+        stream = PairStream("data/pairs", batch_size=4096)
+        for epoch in range(3):
+            for batch in stream:
+                model.step(batch["left"], batch["right"], batch["label"])
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        encoder: Optional[Encoder] = None,
+        batch_size: int = 1024,
+        buffer_size: int = 200_000,
+        columns: List[str] = PAIR_COLUMNS,
+        match: Optional[bool] = None,
+        category: Optional[str] = None,
+        min_score: Optional[float] = None,
+        workers: Optional[int] = None,
+        drop_last: bool = True,
+        seed: int = 0,
+        read_size: int = READ_SIZE,
+    ):
+        self.path = Path(path)
+        self.encoder = encoder or HashedNgramEncoder()
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.columns = list(columns)
+        self.match = match
+        self.category = category
+        self.min_score = min_score
+        self.workers = workers or os.cpu_count() or 1
+        self.drop_last = drop_last
+        self.seed = seed
+        self.read_size = read_size
+        self.epoch = 0
+
+    def _read_chunks(self, rng: random.Random) -> Iterator[pa.RecordBatch]:
+        """Read the pairs in chunks; Parquet row groups in random order."""
+        if self.path.suffix == ".csv":
+            filters = (self.match, self.category, self.min_score)
+            if any(f is not None for f in filters):
+                raise ValueError("Filters are only supported for Parquet exports")
+            convert = pa_csv.ConvertOptions(include_columns=self.columns)
+            reader = pa_csv.open_csv(self.path, convert_options=convert)
+            for chunk in reader:
+                for start in range(0, chunk.num_rows, self.read_size):
+                    yield chunk.slice(start, self.read_size)
+            return
+        dataset = pairs_dataset(self.path)
+        expr = pairs_filter(
+            match=self.match, category=self.category, min_score=self.min_score
+        )
+        pieces = [
+            piece
+            for fragment in dataset.get_fragments(filter=expr)
+            for piece in fragment.split_by_row_group(filter=expr, schema=dataset.schema)
+        ]
+        if not self.buffer_size:
+            for piece in pieces:
+                yield from self._read_piece(dataset, piece, expr)
+            return
+        # Read from several random row groups at a time, as each holds only
+        # positive or only negative pairs of a narrow range of scores. Row
+        # groups differ in size, so the order in which they are opened is
+        # weighted by their number of rows, and the turns by the number of
+        # chunks left in each, as every turn reads one chunk:
+        sizes = [sum(rg.num_rows for rg in p.row_groups) for p in pieces]
+        keys = [rng.random() ** (1.0 / max(size, 1)) for size in sizes]
+        order = sorted(range(len(pieces)), key=keys.__getitem__, reverse=True)
+        queue = iter(order)
+        active: List[Tuple[Iterator[pa.RecordBatch], int]] = []
+        while True:
+            while len(active) < INTERLEAVE:
+                idx = next(queue, None)
+                if idx is None:
+                    break
+                active.append(
+                    (self._read_piece(dataset, pieces[idx], expr), sizes[idx])
+                )
+            if not active:
+                return
+            remaining = [-(-size // self.read_size) for _, size in active]
+            pick = rng.choices(range(len(active)), weights=remaining)[0]
+            reader, size = active[pick]
+            chunk = next(reader, None)
+            if chunk is None or size <= chunk.num_rows:
+                active.pop(pick)
+            else:
+                active[pick] = (reader, size - chunk.num_rows)
+            if chunk is not None:
+                yield chunk
+
+    def _read_piece(
+        self, dataset: ds.Dataset, piece: ds.Fragment, expr: Optional[ds.Expression]
+    ) -> Iterator[pa.RecordBatch]:
+        # The dataset schema includes the partition columns, e.g. `match`:
+        return iter(
+            piece.to_batches(
+                schema=dataset.schema,
+                columns=self.columns,
+                filter=expr,
+                batch_size=self.read_size,
+            )
+        )
+
+    def _encoded(self, rng: random.Random) -> Iterator[Batch]:
+        """Encode the chunks, in worker processes if there are several."""
+        chunks = (c for c in self._read_chunks(rng) if c.num_rows)
+        if self.workers == 1:
+            for chunk in chunks:
+                yield self.encoder(chunk)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # Chunks are encoded in order, with a few in flight:
+            pending: Deque[Future] = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(self.encoder, chunk))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def __iter__(self) -> Iterator[Batch]:
+        seed = self.seed + self.epoch
+        self.epoch += 1
+        rng = random.Random(seed)
+        shuffle = np.random.default_rng(seed)
+        # The buffer is reshuffled once a quarter of its size has come in, so
+        # that each pair is not copied around once for every chunk:
+        step = max(self.batch_size, self.buffer_size // 4)
+        parts: List[Batch] = []
+        size = 0
+        for encoded in self._encoded(rng):
+            parts.append(encoded)
+            size += len(encoded["label"])
+            if size < self.buffer_size + step:
+                continue
+            buffer = concat_batches(parts)
+            # Emit random rows from the buffer, keeping `buffer_size` of them:
+            order = shuffle.permutation(size) if self.buffer_size else np.arange(size)
+            emit = (size - self.buffer_size) // self.batch_size * self.batch_size
+            yield from _split(buffer, order[:emit], self.batch_size)
+            parts = [take_rows(buffer, order[emit:])]
+            size -= emit
+        if not parts:
+            return
+        buffer = concat_batches(parts)
+        order = shuffle.permutation(size) if self.buffer_size else np.arange(size)
+        if self.drop_last:
+            order = order[: size // self.batch_size * self.batch_size]
+        yield from _split(buffer, order, self.batch_size)
+
+    def sample(self, limit: int) -> Batch:
+        """The first `limit` pairs of the next epoch, in one batch; with a
+        shuffle buffer, a random sample of the pairs."""
+        parts: List[Batch] = []
+        size = 0
+        for batch in self:
+            parts.append(batch)
+            size += len(batch["label"])
+            if size >= limit:
+                break
+        if not parts:
+            raise ValueError(f"No pairs found: {self.path}")
+        return take_rows(concat_batches(parts), np.arange(min(size, limit)))
+
+    def torch_batches(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over one epoch with the arrays converted to torch tensors,
+        leaving object arrays of strings as lists."""
+        import torch
+
+        for batch in self:
+            yield {
+                key: (
+                    value.tolist() if value.dtype == object else torch.from_numpy(value)
+                )
+                for key, value in batch.items()
+            }
+
+
+def take_rows(batch: Batch, index: np.ndarray) -> Batch:
+    """Select the given rows of every array of a batch."""
+    return {key: value[index] for key, value in batch.items()}
+
+
+def concat_batches(parts: List[Batch]) -> Batch:
+    """Join batches with the same keys into one."""
+    if len(parts) == 1:
+        return parts[0]
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def _split(batch: Batch, order: np.ndarray, size: int) -> Iterator[Batch]:
+    for start in range(0, len(order), size):
+        yield take_rows(batch, order[start : start + size])
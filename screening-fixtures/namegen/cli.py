@@ -1,12 +1,23 @@
 """Command-line interface for namegen."""
 
 import csv
+import json
 import os
+import time
 from pathlib import Path
 
 import click
 
 from namegen.generators import generate_records
+from namegen.loadtest import read_records, run_load_test
+from namegen.mockserver import MockScreeningServer
+from namegen.report import (
+    DEFAULT_THRESHOLDS,
+    false_positive_rates,
+    most_flagged,
+    read_scores,
+    write_rates,
+)
 from namegen.validators import RecordValidator
 from namegen.cultures import NameCulture
 
@@ -76,7 +87,8 @@ def generate(lines: int, seed: int | None, culture: str | None, distribution: st
     with open(output_path, 'w', newline='', encoding='utf-8') as f:
         fieldnames = [
             'full_name', 'first_name', 'middle_name', 'last_name',
-            'gender', 'date_of_birth', 'place_of_birth', 'nationality'
+            'gender', 'date_of_birth', 'place_of_birth', 'nationality',
+            'culture'
         ]
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
@@ -116,5 +128,216 @@ def validate(threshold: float, csv_file: str) -> None:
         click.echo(f"Error validating file: {e}", err=True)
 
 
+@cli.command()
+@click.option(
+    "--url",
+    required=True,
+    help="Match endpoint of the screening API, e.g. http://localhost:8000/match/default"
+)
+@click.option(
+    "-c", "--concurrency",
+    type=int,
+    default=4,
+    help="Number of requests in flight at the same time (default: 4)"
+)
+@click.option(
+    "--rate",
+    type=float,
+    help="Maximum number of requests started per second (default: unlimited)"
+)
+@click.option(
+    "-n", "--limit",
+    type=int,
+    help="Only send the first N records"
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.7,
+    help="Score at or above which a result counts as a hit (default: 0.7)"
+)
+@click.option(
+    "--timeout",
+    type=float,
+    default=30.0,
+    help="Timeout of a single request in seconds (default: 30)"
+)
+@click.option(
+    "--api-key",
+    envvar="SCREENING_API_KEY",
+    help="API key sent in the Authorization header (env: SCREENING_API_KEY)"
+)
+@click.option(
+    "--report",
+    type=click.Path(),
+    help="Write the summary and latency histogram to this JSON file"
+)
+@click.option(
+    "--results",
+    type=click.Path(),
+    help="Write the top score of each record to this CSV file, for 'namegen report'"
+)
+@click.argument("csv_file", type=click.Path(exists=True))
+def loadtest(
+    url: str,
+    concurrency: int,
+    rate: float | None,
+    limit: int | None,
+    threshold: float,
+    timeout: float,
+    api_key: str | None,
+    report: str | None,
+    results: str | None,
+    csv_file: str,
+) -> None:
+    """Replay a CSV file of records against a screening API."""
+
+    rows = read_records(Path(csv_file), limit=limit)
+    click.echo(f"Sending {len(rows)} records to {url} with concurrency {concurrency}")
+    if rate:
+        click.echo(f"Rate limited to {rate} requests per second")
+
+    result = run_load_test(
+        rows,
+        url,
+        concurrency=concurrency,
+        rate=rate,
+        threshold=threshold,
+        timeout=timeout,
+        api_key=api_key,
+        results_path=Path(results) if results else None,
+    )
+    click.echo(result.format())
+
+    if report:
+        data = result.summary()
+        data["histogram_us"] = [list(bucket) for bucket in result.histogram.buckets()]
+        report_path = Path(report)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        click.echo(f"Wrote report to {report}")
+    if results:
+        click.echo(f"Wrote results to {results}")
+
+
+@cli.command()
+@click.option(
+    "-t", "--threshold",
+    "thresholds",
+    type=float,
+    multiple=True,
+    help="Score threshold, can be repeated (default: 0.5 to 0.9 in steps of 0.1)"
+)
+@click.option(
+    "--min-records",
+    type=int,
+    default=20,
+    help="Leave out groups with fewer screened records from the summary (default: 20)"
+)
+@click.option(
+    "-o", "--output",
+    type=click.Path(),
+    help="Write all false-positive rates to this CSV file"
+)
+@click.argument("csv_file", type=click.Path(exists=True))
+@click.argument("results_file", type=click.Path(exists=True))
+def report(
+    thresholds: tuple[float, ...],
+    min_records: int,
+    output: str | None,
+    csv_file: str,
+    results_file: str,
+) -> None:
+    """Report false-positive rates by culture and nationality."""
+
+    thresholds = tuple(sorted(thresholds)) or DEFAULT_THRESHOLDS
+    scores = read_scores(Path(results_file))
+    rates = false_positive_rates(Path(csv_file), scores, thresholds=thresholds)
+    if not rates:
+        click.echo("Error: No screened records found in results file", err=True)
+        return
+
+    for rate in rates:
+        if rate.dimension == "all":
+            click.echo(
+                f"Threshold {rate.threshold:g}: {rate.flagged} of {rate.records} "
+                f"records flagged ({rate.fpr:.2%})"
+            )
+
+    threshold = thresholds[len(thresholds) // 2]
+    click.echo(f"\nMost over-flagged groups at threshold {threshold:g}:")
+    for rate in most_flagged(rates, threshold, min_records=min_records):
+        click.echo(
+            f"  {rate.dimension:<12} {rate.value:<28} {rate.fpr:7.2%} "
+            f"({rate.ratio:.2f}x, {rate.records} records)"
+        )
+
+    if output:
+        output_path = Path(output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        write_rates(rates, output_path)
+        click.echo(f"Wrote false-positive rates to {output}")
+
+
+@cli.command("mock-server")
+@click.option("--host", default="127.0.0.1", help="Interface to listen on")
+@click.option("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+@click.option(
+    "--latency",
+    type=float,
+    default=20.0,
+    help="Fixed response time in milliseconds (default: 20)"
+)
+@click.option(
+    "--jitter",
+    type=float,
+    default=10.0,
+    help="Mean extra random response time in milliseconds (default: 10)"
+)
+@click.option(
+    "--error-rate",
+    type=float,
+    default=0.0,
+    help="Share of requests answered with HTTP 503 (default: 0)"
+)
+@click.option(
+    "--hit-rate",
+    type=float,
+    default=0.01,
+    help="Share of queries returning a match (default: 0.01)"
+)
+@click.option("--seed", type=int, help="Random seed for reproducible responses")
+def mock_server(
+    host: str,
+    port: int,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+    hit_rate: float,
+    seed: int | None,
+) -> None:
+    """Run a mock screening API to try out the load test locally."""
+
+    server = MockScreeningServer(
+        host=host,
+        port=port,
+        latency_ms=latency,
+        jitter_ms=jitter,
+        error_rate=error_rate,
+        hit_rate=hit_rate,
+        seed=seed,
+    )
+    click.echo(f"Mock screening API listening on {server.url}/match/default")
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        click.echo("Stopping mock server")
+    finally:
+        server.stop()
+
+
 if __name__ == "__main__":
     cli()
@@ -115,6 +115,7 @@ def _generate_single_record(fake: Faker, culture: NameCulture | None = None) ->
         date_of_birth=date_of_birth,
         place_of_birth=place_of_birth,
         nationality=nationality,
+        culture=culture,
     )
 
 
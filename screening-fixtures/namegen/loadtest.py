@@ -0,0 +1,335 @@
+"""Replay generated records against a screening API and measure its latency."""
+
+import csv
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+# Values below this are counted exactly, above it with 7 bits of precision
+# (a relative error below 1%), as in an HDR histogram with 2 significant digits.
+SUB_BUCKETS = 256
+HALF_BUCKETS = SUB_BUCKETS // 2
+
+# FollowTheMoney properties filled from the CSV columns of a record
+QUERY_PROPERTIES = {
+    "name": "full_name",
+    "firstName": "first_name",
+    "middleName": "middle_name",
+    "lastName": "last_name",
+    "gender": "gender",
+    "birthDate": "date_of_birth",
+    "birthPlace": "place_of_birth",
+    "nationality": "nationality",
+}
+
+# Columns of the per-record results file: the row number of the record in the
+# CSV file, the highest result score, the number of hits and the error, if any
+RESULT_FIELDS = ["row", "score", "hits", "error"]
+
+
+def _bucket_index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - 8
+    return SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + (value >> shift) - HALF_BUCKETS
+
+
+def _bucket_range(index: int) -> tuple[int, int]:
+    """Lowest and highest value counted in a bucket."""
+    if index < SUB_BUCKETS:
+        return index, index
+    shift = (index - SUB_BUCKETS) // HALF_BUCKETS + 1
+    lowest = ((index - SUB_BUCKETS) % HALF_BUCKETS + HALF_BUCKETS) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in microseconds.
+
+    Memory does not grow with the number of recorded values, and percentiles
+    are accurate to within 1% of the value, like an HDR histogram.
+    """
+
+    def __init__(self) -> None:
+        self.counts: list[int] = []
+        self.total = 0
+        self.sum = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        """Record a latency in microseconds."""
+        value = max(0, int(value))
+        index = _bucket_index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.min = value if self.total == 0 else min(self.min, value)
+        self.max = max(self.max, value)
+        self.total += 1
+        self.sum += value
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Add the values recorded in another histogram to this one."""
+        if other.total == 0:
+            return
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.min = other.min if self.total == 0 else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.sum += other.sum
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile(self, percentile: float) -> int:
+        """The value below or at which the given percentage of values fall."""
+        if self.total == 0:
+            return 0
+        rank = max(1, round(percentile / 100 * self.total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_bucket_range(index)[1], self.max)
+        return self.max
+
+    def buckets(self) -> Iterator[tuple[int, int, int]]:
+        """Yield (lowest value, highest value, count) for non-empty buckets."""
+        for index, count in enumerate(self.counts):
+            if count:
+                lowest, highest = _bucket_range(index)
+                yield lowest, highest, count
+
+
+def record_to_query(row: dict[str, str]) -> dict[str, Any]:
+    """Build a FollowTheMoney person query from a generated CSV row."""
+    properties = {
+        prop: [row[column]]
+        for prop, column in QUERY_PROPERTIES.items()
+        if row.get(column)
+    }
+    return {"schema": "Person", "properties": properties}
+
+
+def read_records(
+    csv_path: Path, limit: int | None = None
+) -> list[tuple[int, dict[str, str]]]:
+    """Read generated records from a CSV file, skipping rows marked to skip.
+
+    Returns:
+        (row number, row) tuples, numbering the data rows of the file from 0
+    """
+    rows = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for number, row in enumerate(csv.DictReader(f)):
+            if row.get("skip") == "true":
+                continue
+            rows.append((number, row))
+            if limit is not None and len(rows) >= limit:
+                break
+    return rows
+
+
+@dataclass
+class LoadTestReport:
+    """Latencies, errors and hits collected during a load test."""
+
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+    requests: int = 0
+    errors: Counter[str] = field(default_factory=Counter)
+    hits: int = 0
+    results: int = 0
+    duration: float = 0.0
+
+    @property
+    def error_count(self) -> int:
+        return sum(self.errors.values())
+
+    def summary(self) -> dict[str, Any]:
+        """Summarise the test as a JSON-serialisable dictionary."""
+        ok = self.requests - self.error_count
+        hist = self.histogram
+        return {
+            "requests": self.requests,
+            "duration_s": round(self.duration, 3),
+            "throughput_rps": round(self.requests / self.duration, 2)
+            if self.duration
+            else 0.0,
+            "errors": dict(self.errors),
+            "error_rate": round(self.error_count / self.requests, 4)
+            if self.requests
+            else 0.0,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / ok, 4) if ok else 0.0,
+            "results": self.results,
+            "latency_ms": {
+                "min": hist.min / 1000,
+                "mean": round(hist.mean / 1000, 3),
+                "p50": hist.percentile(50) / 1000,
+                "p90": hist.percentile(90) / 1000,
+                "p99": hist.percentile(99) / 1000,
+                "p99.9": hist.percentile(99.9) / 1000,
+                "max": hist.max / 1000,
+            },
+        }
+
+    def format(self) -> str:
+        """Render the summary as a plain text report."""
+        data = self.summary()
+        lines = [
+            f"Requests:    {data['requests']} in {data['duration_s']:.1f}s "
+            f"({data['throughput_rps']:.1f} req/s)",
+            f"Errors:      {self.error_count} ({data['error_rate']:.2%})",
+        ]
+        for kind, count in sorted(self.errors.items()):
+            lines.append(f"  {kind}: {count}")
+        lines.append(
+            f"Hits:        {data['hits']} records ({data['hit_rate']:.2%}), "
+            f"{data['results']} results"
+        )
+        lines.append("Latency (ms):")
+        for name, value in data["latency_ms"].items():
+            lines.append(f"  {name:>6}: {value:10.3f}")
+        return "\n".join(lines)
+
+
+class _RequestPacer:
+    """Space out request starts so no more than `rate` begin per second."""
+
+    def __init__(self, rate: float | None) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _count_hits(body: dict[str, Any], threshold: float) -> tuple[int, float]:
+    """Number of results counting as hits, and the highest result score."""
+    hits = 0
+    top_score = 0.0
+    for response in body.get("responses", {}).values():
+        for result in response.get("results", []):
+            score = float(result.get("score", 0.0))
+            top_score = max(top_score, score)
+            if result.get("match") or score >= threshold:
+                hits += 1
+    return hits, top_score
+
+
+def run_load_test(
+    rows: Iterable[tuple[int, dict[str, str]]],
+    url: str,
+    concurrency: int = 4,
+    rate: float | None = None,
+    threshold: float = 0.7,
+    timeout: float = 30.0,
+    api_key: str | None = None,
+    results_path: Path | None = None,
+) -> LoadTestReport:
+    """Send each record as a yente-style match query and measure the responses.
+
+    Args:
+        rows: Row numbers and CSV rows of generated records, see `read_records`
+        url: Match endpoint, e.g. http://localhost:8000/match/default
+        concurrency: Number of requests in flight at the same time
+        rate: Maximum number of requests started per second, or None
+        threshold: Score at or above which a result counts as a hit
+        timeout: Timeout of a single request in seconds
+        api_key: Sent as an `Authorization: ApiKey` header
+        results_path: Write the top score of each record to this CSV file,
+            with the columns `RESULT_FIELDS`
+
+    Returns:
+        A report with the latency histogram, error counts and hit counts
+    """
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"ApiKey {api_key}"
+    report = LoadTestReport()
+    pacer = _RequestPacer(rate)
+    records = iter(rows)
+    lock = threading.Lock()
+    results_file = None
+    writer = None
+    if results_path is not None:
+        results_file = open(results_path, "w", newline="", encoding="utf-8")
+        writer = csv.writer(results_file)
+        writer.writerow(RESULT_FIELDS)
+
+    def worker() -> None:
+        histogram = LatencyHistogram()
+        while True:
+            with lock:
+                item = next(records, None)
+            if item is None:
+                break
+            number, row = item
+            payload = json.dumps({"queries": {"q": record_to_query(row)}})
+            request = urllib.request.Request(
+                url, data=payload.encode("utf-8"), headers=headers, method="POST"
+            )
+            pacer.wait()
+            error: str | None = None
+            hits = 0
+            top_score = 0.0
+            started = time.perf_counter_ns()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    body = json.loads(response.read())
+                hits, top_score = _count_hits(body, threshold)
+            except urllib.error.HTTPError as exc:
+                error = f"http_{exc.code}"
+            except TimeoutError:
+                error = "timeout"
+            except urllib.error.URLError as exc:
+                timed_out = isinstance(exc.reason, TimeoutError)
+                error = "timeout" if timed_out else "connection"
+            except ValueError:
+                error = "invalid_response"
+            elapsed = (time.perf_counter_ns() - started) // 1000
+            histogram.record(elapsed)
+            with lock:
+                report.requests += 1
+                if error is not None:
+                    report.errors[error] += 1
+                elif hits:
+                    report.hits += 1
+                    report.results += hits
+                if writer is not None:
+                    writer.writerow([number, f"{top_score:.4f}", hits, error or ""])
+        with lock:
+            report.histogram.merge(histogram)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if results_file is not None:
+            results_file.close()
+    report.duration = time.perf_counter() - started
+    return report
@@ -0,0 +1,124 @@
+"""A mock screening API for exercising the load test harness locally."""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any
+
+
+class MockScreeningServer:
+    """Serve yente-style match responses with simulated latency and errors.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on, 0 picks a free port
+        latency_ms: Fixed part of the response time
+        jitter_ms: Mean of an exponentially distributed extra delay
+        error_rate: Share of requests answered with HTTP 503
+        hit_rate: Share of queries returning a high-scoring result
+        seed: Random seed for reproducible responses
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        hit_rate: float = 0.01,
+        seed: int | None = None,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.hit_rate = hit_rate
+        self.random = random.Random(seed)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    def respond(self, body: dict[str, Any]) -> tuple[int, dict[str, Any]]:
+        """Build the status and response body for a match request."""
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay += self.random.expovariate(1.0 / self.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+        if self.random.random() < self.error_rate:
+            return 503, {"detail": "Service temporarily unavailable"}
+        responses = {}
+        for query_id, query in body.get("queries", {}).items():
+            results = []
+            if self.random.random() < self.hit_rate:
+                names = query.get("properties", {}).get("name", ["Unknown"])
+                score = round(self.random.uniform(0.7, 1.0), 3)
+                results.append(
+                    {
+                        "id": f"mock-{self.random.getrandbits(32):08x}",
+                        "caption": names[0],
+                        "schema": "Person",
+                        "score": score,
+                        "match": score >= 0.7,
+                    }
+                )
+            responses[query_id] = {"status": 200, "results": results}
+        return 200, {"responses": responses}
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:  # noqa: N802
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    status, data = 400, {"detail": "Invalid JSON"}
+                else:
+                    status, data = mock.respond(body)
+                payload = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+
+    def __enter__(self) -> "MockScreeningServer":
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.stop()
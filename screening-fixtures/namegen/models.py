@@ -3,6 +3,8 @@
 from dataclasses import dataclass
 from datetime import date
 
+from namegen.cultures import NameCulture
+
 
 @dataclass
 class PersonRecord:
@@ -16,6 +18,7 @@ class PersonRecord:
     date_of_birth: date
     place_of_birth: str
     nationality: str
+    culture: NameCulture | None = None  # name culture the record was generated from
 
     def to_dict(self) -> dict[str, str]:
         """Convert to dictionary for CSV export."""
@@ -28,4 +31,5 @@ class PersonRecord:
             "date_of_birth": self.date_of_birth.isoformat(),
             "place_of_birth": self.place_of_birth,
             "nationality": self.nationality,
+            "culture": self.culture.value if self.culture else "",
         }
@@ -0,0 +1,150 @@
+"""False-positive rates of screening results for generated records."""
+
+import csv
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+# Record columns to break the false-positive rates down by
+DIMENSIONS = ("culture", "nationality")
+DEFAULT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+# Fields of the rows written by `write_rates`
+RATE_FIELDS = [
+    "dimension", "value", "threshold", "records", "flagged", "fpr", "ratio"
+]
+
+
+@dataclass
+class FalsePositiveRate:
+    """Share of screened records in a group flagged at a score threshold.
+
+    All generated records are synthetic, so every flagged record is a false
+    positive. `ratio` compares the rate to that of all records: a group with
+    a ratio of 2.0 is flagged twice as often as the average record.
+    """
+
+    dimension: str
+    value: str
+    threshold: float
+    records: int
+    flagged: int
+    ratio: float = 0.0
+
+    @property
+    def fpr(self) -> float:
+        return self.flagged / self.records if self.records else 0.0
+
+    def to_dict(self) -> dict[str, str]:
+        """Convert to dictionary for CSV export."""
+        return {
+            "dimension": self.dimension,
+            "value": self.value,
+            "threshold": f"{self.threshold:g}",
+            "records": str(self.records),
+            "flagged": str(self.flagged),
+            "fpr": f"{self.fpr:.4f}",
+            "ratio": f"{self.ratio:.2f}",
+        }
+
+
+def read_scores(results_path: Path) -> dict[int, float]:
+    """Read the top score of each screened record from a results CSV file.
+
+    The file needs a `row` column with the row number of the record in the
+    generated CSV file, counting data rows from 0, and a `score` column, as
+    written by `namegen loadtest --results`. Rows with an `error` are skipped,
+    as the record was not screened.
+    """
+    scores = {}
+    with open(results_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("error"):
+                continue
+            scores[int(row["row"])] = float(row.get("score") or 0.0)
+    return scores
+
+
+def false_positive_rates(
+    records_path: Path,
+    scores: dict[int, float],
+    thresholds: tuple[float, ...] = DEFAULT_THRESHOLDS,
+    dimensions: tuple[str, ...] = DIMENSIONS,
+) -> list[FalsePositiveRate]:
+    """Compute false-positive rates per group of records and threshold.
+
+    The records are read in a single pass, collecting the score of each
+    screened record into every group it belongs to. Each group's scores are
+    then sorted once, so the number of records flagged at any threshold is a
+    binary search away.
+
+    Args:
+        records_path: CSV file of generated records
+        scores: Top screening score by record row number, see `read_scores`
+        thresholds: Scores at or above which a record counts as flagged
+        dimensions: Record columns to group by
+
+    Returns:
+        Rates for all records (dimension "all"), then for each value of each
+        dimension, for every threshold
+    """
+    groups: dict[tuple[str, str], list[float]] = defaultdict(list)
+    with open(records_path, newline="", encoding="utf-8") as f:
+        for number, row in enumerate(csv.DictReader(f)):
+            score = scores.get(number)
+            if score is None:
+                continue
+            groups[("all", "all")].append(score)
+            for dimension in dimensions:
+                groups[(dimension, row.get(dimension) or "unknown")].append(score)
+
+    overall: dict[float, float] = {}
+    rates = []
+    order = {dimension: i for i, dimension in enumerate(("all",) + dimensions)}
+    for (dimension, value), values in sorted(
+        groups.items(), key=lambda item: (order[item[0][0]], item[0][1])
+    ):
+        values.sort()
+        for threshold in thresholds:
+            flagged = len(values) - bisect_left(values, threshold)
+            rate = FalsePositiveRate(
+                dimension=dimension,
+                value=value,
+                threshold=threshold,
+                records=len(values),
+                flagged=flagged,
+            )
+            if dimension == "all":
+                overall[threshold] = rate.fpr
+            baseline = overall.get(threshold, 0.0)
+            rate.ratio = rate.fpr / baseline if baseline else 0.0
+            rates.append(rate)
+    return rates
+
+
+def write_rates(rates: list[FalsePositiveRate], output_path: Path) -> None:
+    """Write false-positive rates to a CSV file."""
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RATE_FIELDS)
+        writer.writeheader()
+        for rate in rates:
+            writer.writerow(rate.to_dict())
+
+
+def most_flagged(
+    rates: list[FalsePositiveRate],
+    threshold: float,
+    min_records: int = 20,
+    limit: int = 10,
+) -> list[FalsePositiveRate]:
+    """The groups flagged most often relative to all records at a threshold,
+    ignoring groups with fewer than `min_records` screened records."""
+    candidates = [
+        rate
+        for rate in rates
+        if rate.threshold == threshold
+        and rate.dimension != "all"
+        and rate.records >= min_records
+    ]
+    candidates.sort(key=lambda rate: (-rate.ratio, -rate.records))
+    return candidates[:limit]
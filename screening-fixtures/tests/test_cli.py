@@ -64,7 +64,8 @@ def test_generate_basic(runner):
         # Check headers
         expected_headers = [
             'full_name', 'first_name', 'middle_name', 'last_name',
-            'gender', 'date_of_birth', 'place_of_birth', 'nationality'
+            'gender', 'date_of_birth', 'place_of_birth', 'nationality',
+            'culture'
         ]
         assert list(reader.fieldnames) == expected_headers
 
@@ -116,6 +116,8 @@ def test_generate_cultural_record():
     assert record.gender in ["female", "male", "other"]
     assert record.place_of_birth
     assert record.nationality
+    assert record.culture == NameCulture.EAST_ASIAN
+    assert record.to_dict()["culture"] == "east_asian"
     
     # Name consistency
     assert record.first_name in record.full_name
@@ -128,6 +130,7 @@ def test_generate_records_single_culture():
     
     assert len(records) == 10
     assert all(isinstance(r, PersonRecord) for r in records)
+    assert all(r.culture == NameCulture.SPANISH_PORTUGUESE for r in records)
     
     # All records should have consistent cultural markers
     # (Note: exact validation would require complex cultural name analysis)
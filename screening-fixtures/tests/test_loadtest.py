@@ -0,0 +1,209 @@
+"""Tests for the screening API load test harness."""
+
+import csv
+import json
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from namegen.cli import cli
+from namegen.loadtest import (
+    LatencyHistogram,
+    read_records,
+    record_to_query,
+    run_load_test,
+)
+from namegen.mockserver import MockScreeningServer
+
+FIELDNAMES = [
+    'full_name', 'first_name', 'middle_name', 'last_name',
+    'gender', 'date_of_birth', 'place_of_birth', 'nationality'
+]
+
+
+@pytest.fixture
+def runner():
+    """Create a Click test runner."""
+    return CliRunner()
+
+
+@pytest.fixture
+def rows():
+    """Create a list of CSV rows for testing."""
+    return [
+        {
+            'full_name': f'Person Number{i}',
+            'first_name': 'Person',
+            'middle_name': '',
+            'last_name': f'Number{i}',
+            'gender': 'female',
+            'date_of_birth': '1980-01-01',
+            'place_of_birth': 'Lisbon',
+            'nationality': 'Portugal',
+        }
+        for i in range(40)
+    ]
+
+
+@pytest.fixture
+def csv_file(tmp_path, rows):
+    """Write the test rows to a CSV file."""
+    path = tmp_path / "records.csv"
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def test_histogram_exact_small_values():
+    """Test that small values are counted exactly."""
+    histogram = LatencyHistogram()
+    for value in range(1, 101):
+        histogram.record(value)
+
+    assert histogram.total == 100
+    assert histogram.min == 1
+    assert histogram.max == 100
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+    assert histogram.mean == pytest.approx(50.5)
+
+
+def test_histogram_relative_error():
+    """Test that percentiles of large values are within 1%."""
+    histogram = LatencyHistogram()
+    values = [int(1.07 ** i) + 300 for i in range(300)]
+    for value in values:
+        histogram.record(value)
+
+    values.sort()
+    for percentile in (10, 50, 90, 99):
+        expected = values[round(percentile / 100 * len(values)) - 1]
+        assert histogram.percentile(percentile) == pytest.approx(expected, rel=0.01)
+
+
+def test_histogram_merge():
+    """Test merging two histograms."""
+    first = LatencyHistogram()
+    second = LatencyHistogram()
+    first.record(10)
+    second.record(5000)
+    second.record(20)
+    first.merge(second)
+
+    assert first.total == 3
+    assert first.min == 10
+    assert first.max == 5000
+    assert sum(count for _, _, count in first.buckets()) == 3
+
+
+def test_empty_histogram():
+    """Test percentiles of an empty histogram."""
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0
+    assert histogram.mean == 0.0
+
+
+def test_record_to_query(rows):
+    """Test building a match query from a CSV row."""
+    query = record_to_query(rows[0])
+
+    assert query['schema'] == 'Person'
+    assert query['properties']['name'] == ['Person Number0']
+    assert query['properties']['birthDate'] == ['1980-01-01']
+    assert 'middleName' not in query['properties']
+
+
+def test_read_records_skips_marked_rows(tmp_path, rows):
+    """Test that rows marked to skip by validation are not sent."""
+    path = tmp_path / "validated.csv"
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES + ['skip'])
+        writer.writeheader()
+        for i, row in enumerate(rows):
+            writer.writerow({**row, 'skip': 'true' if i % 2 else 'false'})
+
+    assert len(read_records(path)) == 20
+    assert len(read_records(path, limit=5)) == 5
+
+
+def test_run_load_test(rows):
+    """Test replaying records against the mock server."""
+    with MockScreeningServer(latency_ms=2, hit_rate=0.5, seed=1) as server:
+        report = run_load_test(enumerate(rows), f"{server.url}/match/default", concurrency=4)
+
+    assert report.requests == 40
+    assert report.error_count == 0
+    assert report.histogram.total == 40
+    assert report.histogram.min >= 2000
+    assert 0 < report.hits < 40
+    summary = report.summary()
+    assert summary['latency_ms']['p50'] >= 2
+    assert summary['hit_rate'] == pytest.approx(report.hits / 40, abs=1e-4)
+
+
+def test_run_load_test_counts_errors(rows):
+    """Test that failed requests are counted by kind."""
+    with MockScreeningServer(error_rate=1.0) as server:
+        report = run_load_test(enumerate(rows[:10]), f"{server.url}/match/default")
+
+    assert report.requests == 10
+    assert report.errors == {'http_503': 10}
+    assert report.summary()['error_rate'] == 1.0
+    assert report.hits == 0
+
+
+def test_run_load_test_connection_error(rows):
+    """Test that an unreachable server is reported as connection errors."""
+    server = MockScreeningServer()
+    url = f"{server.url}/match/default"
+    server.stop()
+
+    report = run_load_test(enumerate(rows[:3]), url, concurrency=1, timeout=2)
+
+    assert report.errors == {'connection': 3}
+
+
+def test_run_load_test_rate_limit(rows):
+    """Test that the request rate is limited."""
+    with MockScreeningServer() as server:
+        started = time.monotonic()
+        run_load_test(enumerate(rows[:11]), f"{server.url}/match/default", concurrency=4, rate=50)
+        elapsed = time.monotonic() - started
+
+    # 11 requests at 50/s start over at least 10 intervals of 20ms
+    assert elapsed >= 0.19
+
+
+def test_loadtest_command(runner, csv_file, tmp_path):
+    """Test the loadtest command with a JSON report."""
+    report_file = tmp_path / "report.json"
+    with MockScreeningServer(hit_rate=1.0) as server:
+        result = runner.invoke(cli, [
+            'loadtest',
+            '--url', f"{server.url}/match/default",
+            '-c', '2',
+            '-n', '10',
+            '--report', str(report_file),
+            str(csv_file)
+        ])
+
+    assert result.exit_code == 0
+    assert 'Sending 10 records' in result.output
+    assert 'Requests:    10' in result.output
+    assert 'p99' in result.output
+
+    data = json.loads(report_file.read_text())
+    assert data['requests'] == 10
+    assert data['hits'] == 10
+    assert sum(bucket[2] for bucket in data['histogram_us']) == 10
+
+
+def test_loadtest_command_help(runner):
+    """Test loadtest command help."""
+    result = runner.invoke(cli, ['loadtest', '--help'])
+    assert result.exit_code == 0
+    assert 'Replay a CSV file of records' in result.output
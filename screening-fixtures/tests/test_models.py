@@ -68,6 +68,7 @@ def test_person_record_to_dict():
         "date_of_birth": "1992-03-10",
         "place_of_birth": "Paris",
         "nationality": "France",
+        "culture": "",
     }
 
     assert result == expected
@@ -0,0 +1,162 @@
+"""Tests for the false-positive rate report."""
+
+import csv
+
+import pytest
+from click.testing import CliRunner
+
+from namegen.cli import cli
+from namegen.mockserver import MockScreeningServer
+from namegen.report import (
+    false_positive_rates,
+    most_flagged,
+    read_scores,
+    write_rates,
+)
+
+
+@pytest.fixture
+def runner():
+    """Create a Click test runner."""
+    return CliRunner()
+
+
+@pytest.fixture
+def records_file(tmp_path):
+    """Write a CSV file of records from two cultures."""
+    path = tmp_path / "records.csv"
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['full_name', 'nationality', 'culture'])
+        writer.writeheader()
+        for i in range(10):
+            writer.writerow({
+                'full_name': f'Person {i}',
+                'nationality': 'Iran' if i < 4 else 'Spain',
+                'culture': 'iranian_persian' if i < 4 else 'spanish_portuguese',
+            })
+    return path
+
+
+@pytest.fixture
+def results_file(tmp_path):
+    """Write screening results for the records, one of which failed."""
+    path = tmp_path / "results.csv"
+    scores = [0.9, 0.75, 0.6, 0.1, 0.8, 0.2, 0.1, 0.0, 0.0, 0.95]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['row', 'score', 'hits', 'error'])
+        for i, score in enumerate(scores):
+            error = 'http_503' if i == 9 else ''
+            writer.writerow([i, score, int(score >= 0.7), error])
+    return path
+
+
+def test_read_scores_skips_errors(results_file):
+    """Test that failed requests are not counted as screened."""
+    scores = read_scores(results_file)
+
+    assert len(scores) == 9
+    assert 9 not in scores
+    assert scores[0] == 0.9
+
+
+def test_false_positive_rates(records_file, results_file):
+    """Test rates per culture and threshold."""
+    scores = read_scores(results_file)
+    rates = false_positive_rates(records_file, scores, thresholds=(0.5, 0.7))
+    by_key = {(r.dimension, r.value, r.threshold): r for r in rates}
+
+    overall = by_key[('all', 'all', 0.7)]
+    assert overall.records == 9
+    assert overall.flagged == 3
+    assert overall.fpr == pytest.approx(3 / 9)
+
+    iranian = by_key[('culture', 'iranian_persian', 0.7)]
+    assert iranian.records == 4
+    assert iranian.flagged == 2
+    assert iranian.ratio == pytest.approx(0.5 / (3 / 9))
+
+    spanish = by_key[('culture', 'spanish_portuguese', 0.5)]
+    assert spanish.records == 5
+    assert spanish.flagged == 1
+
+    assert by_key[('nationality', 'Iran', 0.5)].flagged == 3
+    assert rates[0].dimension == 'all'
+
+
+def test_threshold_is_inclusive(records_file, results_file):
+    """Test that a score equal to the threshold counts as flagged."""
+    scores = read_scores(results_file)
+    rates = false_positive_rates(records_file, scores, thresholds=(0.75,))
+    overall = next(r for r in rates if r.dimension == 'all')
+
+    assert overall.flagged == 3
+
+
+def test_most_flagged(records_file, results_file):
+    """Test ranking groups by how much more often they are flagged."""
+    scores = read_scores(results_file)
+    rates = false_positive_rates(records_file, scores, thresholds=(0.7,))
+    top = most_flagged(rates, 0.7, min_records=1)
+
+    assert top[0].value in ('iranian_persian', 'Iran')
+    assert all(r.dimension != 'all' for r in top)
+    assert most_flagged(rates, 0.7, min_records=100) == []
+
+
+def test_write_rates(records_file, results_file, tmp_path):
+    """Test writing the rates to CSV."""
+    scores = read_scores(results_file)
+    rates = false_positive_rates(records_file, scores, thresholds=(0.7,))
+    output = tmp_path / "rates.csv"
+    write_rates(rates, output)
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    assert len(rows) == len(rates)
+    assert rows[0]['dimension'] == 'all'
+    assert rows[0]['fpr'] == '0.3333'
+
+
+def test_report_command(runner, records_file, results_file, tmp_path):
+    """Test the report command."""
+    output = tmp_path / "rates.csv"
+    result = runner.invoke(cli, [
+        'report',
+        '-t', '0.7',
+        '--min-records', '1',
+        '-o', str(output),
+        str(records_file),
+        str(results_file)
+    ])
+
+    assert result.exit_code == 0
+    assert 'Threshold 0.7: 3 of 9 records flagged' in result.output
+    assert 'iranian_persian' in result.output
+    assert output.exists()
+
+
+def test_loadtest_results_feed_report(runner, tmp_path):
+    """Test generating, screening and reporting end to end."""
+    records = tmp_path / "records.csv"
+    results = tmp_path / "results.csv"
+    result = runner.invoke(cli, ['generate', '-l', '30', '--seed', '1', str(records)])
+    assert result.exit_code == 0
+
+    with MockScreeningServer(hit_rate=0.3, seed=2) as server:
+        result = runner.invoke(cli, [
+            'loadtest',
+            '--url', f"{server.url}/match/default",
+            '--results', str(results),
+            str(records)
+        ])
+    assert result.exit_code == 0
+
+    with open(results, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(int(row['row']) for row in rows) == list(range(30))
+
+    result = runner.invoke(cli, ['report', str(records), str(results)])
+    assert result.exit_code == 0
+    assert 'records flagged' in result.output
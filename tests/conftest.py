@@ -0,0 +1,76 @@
+import sys
+import zlib
+from pathlib import Path
+from typing import List
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+# The `namepairs` scripts import each other as top-level modules:
+sys.path.insert(0, str(Path(__file__).parent.parent / "namepairs"))
+
+FIRST_NAMES = ["John", "Maria", "Ahmed", "Olga", "Chen", "Fatima", "Pedro", "Anna"]
+LAST_NAMES = ["Smith", "Garcia", "Hassan", "Ivanova", "Wei", "Khan", "Silva", "Berg"]
+
+
+def make_pairs(n: int, seed: int = 0) -> pd.DataFrame:
+    """A frame of `n` pairs with the columns of a `namepairs` export; every
+    pair has a distinct `pair_id`, so that tests can tell which were read."""
+    rng = np.random.default_rng(seed)
+    first = rng.choice(FIRST_NAMES, size=(n, 2))
+    last = rng.choice(LAST_NAMES, size=(n, 2))
+    return pd.DataFrame(
+        {
+            "pair_id": np.arange(n),
+            "left_name": [f"{f} {l}" for f, l in zip(first[:, 0], last[:, 0])],
+            "right_name": [f"{f} {l}" for f, l in zip(first[:, 1], last[:, 1])],
+            "match": np.arange(n) % 3 == 0,
+            "category": np.where(np.arange(n) % 2 == 0, "PER", "ORG"),
+            "score": rng.random(n).astype(np.float32),
+        }
+    )
+
+
+def write_pairs(frame: pd.DataFrame, path: Path, row_group_size: int = 1000) -> Path:
+    """Write pairs as `namepairs/duck_gen.py` exports them: a single CSV file
+    if the path ends in `.csv`, otherwise a Parquet dataset partitioned by
+    `match` and `category`."""
+    con = duckdb.connect()
+    con.register("frame", pa.Table.from_pandas(frame, preserve_index=False))
+    if path.suffix == ".csv":
+        con.execute(f"COPY frame TO '{path.as_posix()}';")
+    else:
+        con.execute(f"""
+            COPY (SELECT * FROM frame ORDER BY score) TO '{path.as_posix()}' (
+                FORMAT PARQUET, PARTITION_BY (match, category),
+                ROW_GROUP_SIZE {row_group_size}
+            );
+        """)
+    con.close()
+    return path
+
+
+def stub_encoder(names: List[str]) -> np.ndarray:
+    """Sum a fixed random vector per character trigram, then normalize: names
+    sharing trigrams end up close, as with a real embedding model."""
+    vectors = np.zeros((len(names), 32), dtype=np.float32)
+    for row, name in enumerate(names):
+        padded = f" {name.lower()} "
+        for i in range(len(padded) - 2):
+            seed = zlib.crc32(padded[i : i + 3].encode("utf-8"))
+            vectors[row] += np.random.default_rng(seed).normal(size=32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+@pytest.fixture
+def pairs_frame() -> pd.DataFrame:
+    return make_pairs(3000)
+
+
+@pytest.fixture
+def pairs_path(tmp_path: Path, pairs_frame: pd.DataFrame) -> Path:
+    return write_pairs(pairs_frame, tmp_path / "pairs")
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+from qarin.evaluate.cache import ScoreCache, matcher_fingerprint, pair_fingerprint
+
+LEFT = {"id": "a", "schema": "Person", "properties": {"name": ["John", "Johnny"]}}
+RIGHT = {"id": "b", "schema": "Person", "properties": {"name": ["Jon"]}}
+
+
+def test_pair_fingerprint():
+    reordered = {
+        "schema": "Person",
+        "properties": {"name": ["Johnny", "John"], "country": []},
+        "id": "a",
+        "caption": "ignored",
+    }
+    assert pair_fingerprint(LEFT, RIGHT) == pair_fingerprint(reordered, RIGHT)
+    assert pair_fingerprint(LEFT, RIGHT) != pair_fingerprint(RIGHT, LEFT)
+    assert matcher_fingerprint("m", {"a": 1}) != matcher_fingerprint("m", {"a": 2})
+
+
+def test_hits_and_misses(tmp_path: Path):
+    with ScoreCache(tmp_path / "scores.sqlite") as cache:
+        key = cache.bind("scorer", {"weights": {"levenshtein": 1.0}})
+        assert cache.get(key, ["p1", "p2"]) == [None, None]
+        cache.put(key, ["p1", "p2"], [0.5, 0.25])
+        assert cache.get(key, ["p2", "p3", "p1"]) == [0.25, None, 0.5]
+        assert (cache.hits, cache.misses) == (2, 3)
+        assert cache.hit_rate == pytest.approx(0.4)
+        assert cache.stats()["stored"] == {"scorer": 2}
+
+
+def test_scores_persist_across_opens(tmp_path: Path):
+    path = tmp_path / "scores.sqlite"
+    with ScoreCache(path) as cache:
+        key = cache.bind("scorer", {"version": 1})
+        cache.put(key, ["p1"], [0.75])
+    with ScoreCache(path) as cache:
+        assert cache.bind("scorer", {"version": 1}) == key
+        assert cache.get(key, ["p1"]) == [0.75]
+
+
+def test_config_change_invalidates(tmp_path: Path):
+    path = tmp_path / "scores.sqlite"
+    with ScoreCache(path) as cache:
+        old = cache.bind("scorer", {"version": 1})
+        other = cache.bind("other", {})
+        cache.put(old, ["p1", "p2"], [0.5, 0.5])
+        cache.put(other, ["p1"], [0.9])
+    with ScoreCache(path) as cache:
+        new = cache.bind("scorer", {"version": 2})
+        assert new != old
+        assert cache.get(new, ["p1"]) == [None]
+        assert cache.get(old, ["p1", "p2"]) == [None, None]
+        assert cache.get(other, ["p1"]) == [0.9]
+        assert cache.stats()["stored"] == {"scorer": 0, "other": 1}
+
+
+def test_large_lookups(tmp_path: Path):
+    keys = [f"p{i}" for i in range(1234)]
+    with ScoreCache(tmp_path / "scores.sqlite") as cache:
+        key = cache.bind("scorer", {})
+        cache.put(key, keys[::2], [float(i) for i in range(0, 1234, 2)])
+        found = cache.get(key, keys)
+        assert found[::2] == [float(i) for i in range(0, 1234, 2)]
+        assert found[1::2] == [None] * 617
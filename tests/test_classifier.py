@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from qarin.match.classifier import FEATURES, PairClassifier, PairFeatures
+from qarin.train.classifier import cli, fit_classifier, load_features
+
+
+def toy_set(n: int = 2000, seed: int = 0):
+    """Pairs that match exactly when their `lev_norm` is at least 0.6, with
+    noise in the other features and some missing fingerprint features."""
+    rng = np.random.default_rng(seed)
+    features = rng.random((n, len(FEATURES))).astype(np.float32)
+    features[rng.random(n) < 0.2, FEATURES.index("lev_fp")] = np.nan
+    # Similarities in steps of 0.1, so that a bin edge falls on the boundary:
+    lev_norm = rng.integers(0, 11, size=n) / 10
+    features[:, FEATURES.index("lev_norm")] = lev_norm
+    labels = (lev_norm >= 0.6).astype(np.float32)
+    return features, labels
+
+
+@pytest.fixture(scope="module")
+def model() -> PairClassifier:
+    features, labels = toy_set()
+    return fit_classifier(features, labels, bins=16, iterations=300)
+
+
+def test_fit_separable_set(model: PairClassifier):
+    features, labels = toy_set(seed=1)
+    probs = model.predict(features)
+    assert probs.dtype == np.float32
+    assert ((probs > 0.5) == (labels > 0)).mean() > 0.99
+    # The weights of the deciding feature rise across its bins:
+    weights = model.weights[FEATURES.index("lev_norm")][:-1]
+    assert weights[-1] - weights[0] > 2.0
+    assert model.meta["pairs"] == 2000
+
+
+def test_fit_needs_both_labels():
+    features, _ = toy_set(n=100)
+    with pytest.raises(ValueError):
+        fit_classifier(features, np.ones(100, dtype=np.float32))
+
+
+def test_save_and_load(model: PairClassifier, tmp_path: Path):
+    path = tmp_path / "model.json"
+    model.meta["category"] = "PER"
+    model.save(path)
+    loaded = PairClassifier.load(path, features=PairFeatures(workers=1))
+    features, _ = toy_set(n=500, seed=2)
+    np.testing.assert_allclose(loaded.predict(features), model.predict(features))
+    assert loaded.meta == model.meta
+    assert loaded.bias == pytest.approx(model.bias)
+
+    data = json.loads(path.read_text())
+    data["features"] = data["features"][:-1]
+    path.write_text(json.dumps(data))
+    with pytest.raises(ValueError):
+        PairClassifier.load(path)
+
+
+def test_missing_values_use_their_own_bin(model: PairClassifier):
+    features, _ = toy_set(n=10)
+    col = FEATURES.index("lev_fp")
+    features[:, col] = np.nan
+    missing = model.weights[col][-1]
+    logits = model.logits(features)
+    features[:, col] = 0.0
+    shifted = model.logits(features) - model.weights[col][0] + missing
+    np.testing.assert_allclose(logits, shifted, rtol=1e-5)
+
+
+def test_score_names(model: PairClassifier):
+    model.features = PairFeatures(workers=1)
+    probs = model.score(["John Smith", "John Smith", ""], ["Jon Smith", "Olga", "X"])
+    assert probs.shape == (3,)
+    assert ((probs >= 0) & (probs <= 1)).all()
+    features = model.features.compute(["John Smith", ""], ["Jon Smith", "X"])
+    assert features.shape == (2, len(FEATURES))
+    assert not np.isnan(features[0]).any()
+    assert np.isnan(features[1]).all()
+
+
+def test_load_features(pairs_path: Path, pairs_frame: pd.DataFrame):
+    features, labels = load_features(pairs_path, max_pairs=500, workers=1)
+    assert features.shape == (500, len(FEATURES))
+    assert set(np.unique(labels)) <= {0.0, 1.0}
+    _, per = load_features(pairs_path, max_pairs=10_000, category="PER", workers=1)
+    assert len(per) == (pairs_frame["category"] == "PER").sum()
+
+
+def test_benchmark_command(model: PairClassifier, tmp_path: Path, pairs_path: Path):
+    model.save(tmp_path / "model.json")
+    args = ["benchmark", str(tmp_path / "model.json"), str(pairs_path)]
+    result = CliRunner().invoke(cli, args + ["-n", "200", "--repeat", "1"])
+    assert result.exit_code == 0, result.output
+    assert "Scored 200 pairs:" in result.output
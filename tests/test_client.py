@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import httpx
+import pytest
+
+from qarin.evaluate.client import (
+    MatchClient,
+    completed_ids,
+    match_to_file,
+    repair_responses,
+)
+
+QUERIES = [
+    (f"q{i}", {"schema": "Person", "properties": {"name": [f"Name {i}"]}})
+    for i in range(8)
+]
+
+
+class StubServer(ThreadingHTTPServer):
+    """Answers `/match/<dataset>` requests with one result per query, after
+    failing the first `failures` requests with `status`."""
+
+    def __init__(self, failures: int = 0, status: int = 503):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.failures = failures
+        self.status = status
+        self.requests: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append(
+                {"path": self.path, "time": time.monotonic(), "body": body}
+            )
+            fail = len(self.server.requests) <= self.server.failures
+        if fail:
+            payload = b"{}"
+            self.send_response(self.server.status)
+            self.send_header("Retry-After", "0")
+        else:
+            responses = {
+                qid: {"results": [{"id": qid.upper(), "score": 0.9}]}
+                for qid in body["queries"]
+            }
+            payload = json.dumps({"responses": responses}).encode("utf-8")
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+def serve(**kwargs: Any) -> Iterator[StubServer]:
+    server = StubServer(**kwargs)
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def server() -> Iterator[StubServer]:
+    yield from serve()
+
+
+@pytest.fixture
+def flaky_server() -> Iterator[StubServer]:
+    yield from serve(failures=2)
+
+
+async def collect(client: MatchClient, queries) -> Dict[str, Any]:
+    return {qid: response async for qid, response in client.match(queries)}
+
+
+def test_match_all_queries(server: StubServer):
+    client = MatchClient(
+        server.url, dataset="sanctions", params={"algorithm": "best"}, batch_size=3
+    )
+    responses = asyncio.run(collect(client, iter(QUERIES)))
+    assert set(responses) == {qid for qid, _ in QUERIES}
+    assert responses["q5"]["results"][0]["id"] == "Q5"
+    assert sorted(len(r["body"]["queries"]) for r in server.requests) == [2, 3, 3]
+    assert all(r["path"] == "/match/sanctions?algorithm=best" for r in server.requests)
+
+
+def test_rate_limit(server: StubServer):
+    client = MatchClient(server.url, batch_size=1, concurrency=4, rate_limit=20)
+    asyncio.run(collect(client, QUERIES))
+    times = sorted(r["time"] for r in server.requests)
+    # 8 requests at 20 per second start over at least 7 intervals of 50ms:
+    assert times[-1] - times[0] >= 0.3
+
+
+def test_retries(flaky_server: StubServer):
+    client = MatchClient(flaky_server.url, batch_size=4, retries=2, backoff=0.01)
+    responses = asyncio.run(collect(client, QUERIES))
+    assert len(responses) == len(QUERIES)
+    assert len(flaky_server.requests) == 4
+
+
+def test_gives_up_after_retries():
+    for server in serve(failures=100, status=500):
+        client = MatchClient(server.url, batch_size=8, retries=2, backoff=0.01)
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(collect(client, QUERIES))
+        assert len(server.requests) == 3
+
+
+def test_client_errors_are_not_retried():
+    for server in serve(failures=1, status=400):
+        client = MatchClient(server.url, retries=3, backoff=0.01)
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(collect(client, QUERIES))
+        assert len(server.requests) == 1
+
+
+def test_resume(server: StubServer, tmp_path: Path):
+    path = tmp_path / "responses.jsonl"
+    assert completed_ids(path) == []
+    assert match_to_file(QUERIES[:5], path, url=server.url, batch_size=2) == 5
+    # An interrupted write leaves a partial last line behind:
+    with open(path, "a") as fh:
+        fh.write('{"id": "q5", "resp')
+    with pytest.raises(ValueError):
+        completed_ids(path)
+    resumed = match_to_file(QUERIES, path, resume=True, url=server.url, batch_size=2)
+    assert resumed == 3
+    with open(path, "r") as fh:
+        rows = [json.loads(line) for line in fh]
+    assert sorted(row["id"] for row in rows) == [qid for qid, _ in QUERIES]
+    assert match_to_file(QUERIES, path, resume=True, url=server.url) == 0
+
+
+def test_repair_responses(tmp_path: Path, caplog: pytest.LogCaptureFixture):
+    path = tmp_path / "responses.jsonl"
+    assert repair_responses(path) == 0
+    complete = '{"id": "a", "response": {}}\n\n{"id": "b", "response": {}}'
+    path.write_text(complete)
+    assert repair_responses(path) == 0
+    assert path.read_text() == complete + "\n"
+    assert completed_ids(path) == ["a", "b"]
+    path.write_text(complete + '\n{"id": "c", "resp')
+    assert repair_responses(path) == 17
+    assert "Cut off 17 bytes" in caplog.text
+    assert path.read_text() == complete + "\n"
+    # Only the last line can be left incomplete by an interruption:
+    path.write_text('{"id": "a"\n{"id": "b", "response": {}}\n')
+    assert repair_responses(path) == 0
+    with pytest.raises(ValueError):
+        completed_ids(path)
@@ -0,0 +1,121 @@
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from qarin.train.data import (
+    PAIR_COLUMNS,
+    Batch,
+    HashedNgramEncoder,
+    PairStream,
+    batch_labels,
+)
+
+from .conftest import write_pairs
+
+COLUMNS = ["pair_id", "left_name", "right_name", "match"]
+
+
+def id_encoder(batch: pa.RecordBatch) -> Batch:
+    """Keep the pair IDs, so that tests can tell which pairs were read."""
+    ids = batch.column("pair_id").to_numpy(zero_copy_only=False)
+    return {"pair_id": ids, "label": batch_labels(batch)}
+
+
+def stream(path: Path, **kwargs) -> PairStream:
+    options = dict(
+        encoder=id_encoder,
+        columns=COLUMNS,
+        batch_size=256,
+        buffer_size=1000,
+        workers=1,
+        read_size=100,
+    )
+    options.update(kwargs)
+    return PairStream(path, **options)
+
+
+def epoch_ids(pairs: PairStream) -> List[np.ndarray]:
+    return [batch["pair_id"] for batch in pairs]
+
+
+@pytest.mark.parametrize("buffer_size", [0, 1000, 100_000])
+def test_batch_sizes(pairs_path: Path, pairs_frame: pd.DataFrame, buffer_size: int):
+    n = len(pairs_frame)
+    batches = epoch_ids(stream(pairs_path, buffer_size=buffer_size))
+    assert [len(b) for b in batches] == [256] * (n // 256)
+    batches = epoch_ids(stream(pairs_path, buffer_size=buffer_size, drop_last=False))
+    assert [len(b) for b in batches] == [256] * (n // 256) + [n % 256]
+
+
+def test_epochs_cover_all_pairs(pairs_path: Path, pairs_frame: pd.DataFrame):
+    pairs = stream(pairs_path, drop_last=False)
+    first = np.concatenate(epoch_ids(pairs))
+    second = np.concatenate(epoch_ids(pairs))
+    assert sorted(first) == sorted(second) == list(pairs_frame["pair_id"])
+    assert (first != second).any()
+    # The same seed gives the same shuffle:
+    again = np.concatenate(epoch_ids(stream(pairs_path, drop_last=False)))
+    np.testing.assert_array_equal(first, again)
+
+
+def test_shuffles_across_row_groups(tmp_path: Path, pairs_frame: pd.DataFrame):
+    path = write_pairs(pairs_frame, tmp_path / "pairs", row_group_size=200)
+    batches = list(stream(path, encoder=id_encoder))
+    # Row groups hold only positives or only negatives, a third are positives:
+    shares = [batch["label"].mean() for batch in batches]
+    assert all(0.15 < share < 0.55 for share in shares)
+
+
+@pytest.mark.parametrize("buffer_size", [0, 1000])
+def test_filters(pairs_path: Path, pairs_frame: pd.DataFrame, buffer_size: int):
+    pairs = stream(
+        pairs_path,
+        match=True,
+        category="PER",
+        buffer_size=buffer_size,
+        drop_last=False,
+    )
+    ids = np.concatenate(epoch_ids(pairs))
+    expected = pairs_frame[pairs_frame["match"] & (pairs_frame["category"] == "PER")]
+    assert sorted(ids) == sorted(expected["pair_id"])
+    negatives = stream(pairs_path, match=False, buffer_size=buffer_size)
+    assert not any(batch["label"].any() for batch in negatives)
+
+
+def test_csv_and_parquet(tmp_path: Path, pairs_path: Path, pairs_frame: pd.DataFrame):
+    csv_path = write_pairs(pairs_frame, tmp_path / "pairs.csv")
+    from_csv = list(stream(csv_path, drop_last=False))
+    from_parquet = list(stream(pairs_path, drop_last=False))
+    for batches in (from_csv, from_parquet):
+        ids = np.concatenate([b["pair_id"] for b in batches])
+        labels = np.concatenate([b["label"] for b in batches])
+        assert sorted(ids) == list(pairs_frame["pair_id"])
+        np.testing.assert_array_equal(
+            labels[np.argsort(ids)], pairs_frame["match"].astype(np.float32)
+        )
+    # Without a buffer, a CSV file is read in order:
+    ordered = np.concatenate(epoch_ids(stream(csv_path, buffer_size=0)))
+    np.testing.assert_array_equal(ordered, np.arange(len(ordered)))
+    with pytest.raises(ValueError):
+        list(stream(csv_path, match=True))
+
+
+def test_workers(pairs_path: Path):
+    local = epoch_ids(stream(pairs_path))
+    pooled = epoch_ids(stream(pairs_path, workers=2))
+    assert len(local) == len(pooled)
+    for left, right in zip(local, pooled):
+        np.testing.assert_array_equal(left, right)
+
+
+def test_hashed_ngram_encoder(pairs_path: Path):
+    encoder = HashedNgramEncoder(max_ngrams=8)
+    batch = next(iter(stream(pairs_path, encoder=encoder, columns=PAIR_COLUMNS)))
+    assert batch["left"].shape == (256, 8)
+    assert batch["left"].dtype == np.int32
+    assert (batch["left"] > 0).any(axis=1).all()
+    assert batch["label"].shape == (256,)
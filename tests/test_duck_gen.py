@@ -0,0 +1,91 @@
+import csv
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+import duck_gen
+from pipeline import run_pipeline
+
+from .conftest import FIRST_NAMES, LAST_NAMES
+
+COLUMNS = ["entity_id", "canonical_id", "schema", "prop", "prop_type", "value"]
+COLUMNS += ["lang", "dataset"]
+
+
+def make_entities(n: int, seed: int = 0) -> Dict[str, List[str]]:
+    rng = np.random.default_rng(seed)
+    entities = {}
+    for i in range(n):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        middle = FIRST_NAMES[i % len(FIRST_NAMES)]
+        entities[f"Q{i}"] = [f"{first} {last}", f"{first} {middle} {last}"]
+    return entities
+
+
+def write_statements(entities: Dict[str, List[str]], path: Path) -> Path:
+    with open(path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=COLUMNS)
+        writer.writeheader()
+        for entity_id, names in entities.items():
+            for name in names:
+                writer.writerow(
+                    {
+                        "entity_id": entity_id,
+                        "canonical_id": entity_id,
+                        "schema": "Person",
+                        "prop": "name",
+                        "prop_type": "name",
+                        "value": name,
+                        "lang": "eng",
+                        "dataset": "test",
+                    }
+                )
+    return path
+
+
+def build(tmp_path: Path, name: str, statements: Path, incremental: bool = False):
+    """Run the pipeline into the work database `name` and count the pairs."""
+    resolver = tmp_path / "resolver.ijson"
+    resolver.write_text(json.dumps(["Q0", "Q1", "negative", None, "test"]) + "\n")
+    duck_gen.init_stuff(tmp_path / f"{name}.duckdb", tmp_path / "cache.duckdb")
+    try:
+        stages = duck_gen.pipeline_stages(
+            statements,
+            resolver,
+            tmp_path / f"{name}.csv",
+            negatives=100,
+            workers=1,
+        )
+        run_pipeline(duck_gen.con, stages, incremental=incremental)
+        return duck_gen.con.execute("""
+            SELECT source LIKE 'block:%' AS sampled, COUNT(*) FROM pairs
+            WHERE NOT match GROUP BY ALL ORDER BY ALL;
+        """).fetchall()
+    finally:
+        duck_gen.con.close()
+
+
+@pytest.fixture
+def entities() -> Dict[str, List[str]]:
+    return make_entities(200)
+
+
+def test_full_build(tmp_path: Path, entities: Dict[str, List[str]]):
+    statements = write_statements(entities, tmp_path / "statements.csv")
+    assert build(tmp_path, "work", statements) == [(False, 4), (True, 100)]
+
+
+def test_incremental_build(tmp_path: Path, entities: Dict[str, List[str]]):
+    statements = write_statements(entities, tmp_path / "statements.csv")
+    build(tmp_path, "work", statements)
+    for i in range(0, 60, 3):
+        entities[f"Q{i}"] = entities[f"Q{i}"] + [f"{FIRST_NAMES[i % 8]} Berg {i}"]
+    del entities["Q5"]
+    changed = write_statements(entities, tmp_path / "changed.csv")
+    # The sample keeps its size when the negatives of changed entities are
+    # replaced:
+    full = build(tmp_path, "full", changed)
+    assert build(tmp_path, "work", changed, incremental=True) == full
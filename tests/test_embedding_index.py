@@ -0,0 +1,101 @@
+from itertools import product
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pytest
+
+from qarin.match.embeddings import EmbeddingIndex, _spherical_kmeans, quantize
+
+from .conftest import FIRST_NAMES, LAST_NAMES, stub_encoder
+
+NAMES = [f"{a} {b} {c}" for a, b, c in product(FIRST_NAMES, FIRST_NAMES, LAST_NAMES)]
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, limit: int) -> List[int]:
+    scores = vectors @ query
+    return np.argsort(-scores, kind="stable")[:limit].tolist()
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_build_and_open(tmp_path: Path, dtype: str):
+    path = tmp_path / "index"
+    built = EmbeddingIndex.build(path, NAMES, stub_encoder, dtype=dtype, nlist=16)
+    index = EmbeddingIndex(path, encoder=stub_encoder)
+    assert len(index) == len(built) == len(NAMES)
+    assert index.meta["dtype"] == dtype
+    assert index.meta["int8_model"] is False
+    assert sorted(index.ids) == list(range(len(NAMES)))
+    assert index.offsets[-1] == len(NAMES)
+    assert not (path / "encoded.npy").exists()
+    for name_id in (0, 17, len(NAMES) - 1):
+        results = index.search(NAMES[name_id], limit=5, nprobe=4)
+        assert results[0][0] == name_id
+        assert results[0][1] == pytest.approx(1.0, abs=0.02)
+        scores = [score for _, score in results]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_exhaustive_search_is_exact(tmp_path: Path):
+    index = EmbeddingIndex.build(tmp_path, NAMES, stub_encoder, dtype="float32")
+    vectors = stub_encoder(NAMES)
+    nlist = len(index.centroids)
+    assert 1 < nlist < len(NAMES)
+    for query in stub_encoder(["Anna Berg", "Chen Wei", "Olga Maria Ivanova"]):
+        results = index.search_vector(query, limit=10, nprobe=nlist)
+        assert [i for i, _ in results] == brute_force(vectors, query, 10)
+        expected = np.sort(vectors @ query)[::-1][:10]
+        np.testing.assert_allclose([s for _, s in results], expected, rtol=1e-5)
+        # Probing fewer clusters never finds better matches:
+        approx = index.search_vector(query, limit=10, nprobe=1)
+        assert approx[0][1] <= results[0][1] + 1e-6
+
+
+def test_int8_model_flag(tmp_path: Path):
+    EmbeddingIndex.build(tmp_path, NAMES[:50], stub_encoder, int8_model=True)
+    index = EmbeddingIndex(tmp_path, encoder=stub_encoder, int8_model=True)
+    assert index.meta["int8_model"] is True
+    assert len(EmbeddingIndex(tmp_path, encoder=stub_encoder)) == 50
+    with pytest.raises(ValueError):
+        EmbeddingIndex(tmp_path, encoder=stub_encoder, int8_model=False)
+
+
+def test_build_needs_names(tmp_path: Path):
+    with pytest.raises(ValueError):
+        EmbeddingIndex.build(tmp_path, [], stub_encoder)
+    with pytest.raises(ValueError):
+        EmbeddingIndex.build(tmp_path, NAMES, stub_encoder, dtype="int4")
+    index = EmbeddingIndex.build(tmp_path, NAMES[:3], stub_encoder, nlist=10)
+    assert len(index.centroids) == 3
+
+
+def test_quantize_round_trip():
+    vectors = stub_encoder(NAMES)
+    stored, scales = quantize(vectors, "int8")
+    assert stored.dtype == np.int8
+    assert np.abs(stored).max(axis=1).min() == 127
+    restored = stored.astype(np.float32) * scales[:, None]
+    np.testing.assert_allclose(restored, vectors, atol=scales.max() / 2 + 1e-7)
+    stored, scales = quantize(vectors, "float16")
+    assert stored.dtype == np.float16
+    assert (scales == 1.0).all()
+    np.testing.assert_allclose(stored.astype(np.float32), vectors, atol=1e-3)
+    zeros, scales = quantize(np.zeros((2, 4), dtype=np.float32), "int8")
+    assert not zeros.any()
+    assert (scales == 1.0).all()
+
+
+def test_spherical_kmeans():
+    rng = np.random.default_rng(0)
+    directions = np.eye(8, dtype=np.float32)[:3]
+    labels = rng.integers(0, 3, size=600)
+    sample = directions[labels] + rng.normal(scale=0.05, size=(600, 8))
+    sample /= np.linalg.norm(sample, axis=1, keepdims=True)
+    centroids = _spherical_kmeans(sample.astype(np.float32), 3)
+    assert centroids.shape == (3, 8)
+    np.testing.assert_allclose(np.linalg.norm(centroids, axis=1), 1.0, rtol=1e-5)
+    # Each cluster ends up with one centroid, close to its direction:
+    assign = np.argmax(sample @ centroids.T, axis=1)
+    for label in range(3):
+        assert len(set(assign[labels == label])) == 1
+    assert ((centroids @ directions.T).max(axis=0) > 0.99).all()
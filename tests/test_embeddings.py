@@ -0,0 +1,131 @@
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from qarin.train.embeddings import (
+    RECALL_LIMITS,
+    RetrievalTask,
+    cli,
+    sample_pairs,
+    split_pairs,
+)
+
+from .conftest import stub_encoder, write_pairs
+
+
+def batch(left: List[str], right: List[str], label: List[int]):
+    return {
+        "left": np.array(left, dtype=object),
+        "right": np.array(right, dtype=object),
+        "label": np.array(label, dtype=np.float32),
+    }
+
+
+def brute_force_recall(task: RetrievalTask, limit: int) -> float:
+    queries = stub_encoder(task.queries)
+    corpus = stub_encoder(task.corpus)
+    found = 0
+    for row, query in enumerate(queries):
+        scores = corpus @ query
+        if task.self_ids[row] >= 0:
+            scores[task.self_ids[row]] = -np.inf
+        top = np.argsort(-scores, kind="stable")[:limit]
+        found += bool(task.relevant[row].intersection(top.tolist()))
+    return found / len(queries)
+
+
+@pytest.fixture
+def pairs() -> dict:
+    rng = np.random.default_rng(0)
+    names = [f"{a} {b}" for a in ("Anna", "Boris", "Chen", "Dana") for b in "KLMNO"]
+    left = rng.choice(names, size=400)
+    right = rng.choice(names, size=400)
+    return batch(left.tolist(), right.tolist(), (rng.random(400) < 0.5).tolist())
+
+
+def test_split_pairs_by_name(pairs: dict):
+    train, test = split_pairs(pairs, holdout=0.2, seed=1)
+    train_names = set(train["left"]) | set(train["right"])
+    test_names = set(test["left"]) | set(test["right"])
+    assert train_names and test_names
+    assert not train_names & test_names
+    assert len(train["label"]) + len(test["label"]) < len(pairs["label"])
+    again, _ = split_pairs(pairs, holdout=0.2, seed=1)
+    np.testing.assert_array_equal(train["left"], again["left"])
+
+
+def test_retrieval_task():
+    task = RetrievalTask(
+        batch(
+            ["John Smith", "John Smith", "Olga Ivanova", "Olga Ivanova", "Wei Chen"],
+            ["Jon Smith", "J. Smith", "Olga Ivanova", "Olga Ivanov", "Chen Wei"],
+            [1, 1, 1, 0, 0],
+        )
+    )
+    # Olga Ivanova is only paired with itself, so it is not a query:
+    assert task.queries == ["John Smith"]
+    assert set(task.corpus) == {
+        "Olga Ivanova",
+        "Olga Ivanov",
+        "Wei Chen",
+        "Chen Wei",
+        "Jon Smith",
+        "J. Smith",
+    }
+    assert task.relevant == [{task.corpus.index(n) for n in ("Jon Smith", "J. Smith")}]
+    assert task.self_ids == [-1]
+
+
+def test_recall_matches_brute_force(pairs: dict):
+    task = RetrievalTask(pairs)
+    assert task.queries
+    queries, corpus = stub_encoder(task.queries), stub_encoder(task.corpus)
+    recall = task.recall(queries, corpus, limits=(1, 3, 10))
+    for limit, value in recall.items():
+        assert value == pytest.approx(brute_force_recall(task, limit))
+    assert recall[1] <= recall[3] <= recall[10]
+
+
+def test_evaluate(pairs: dict):
+    result = RetrievalTask(pairs).evaluate(stub_encoder)
+    assert result["names_per_s"] > 0
+    for key in ("recall", "recall_int8_vectors"):
+        assert list(result[key]) == list(RECALL_LIMITS)
+    float_recall = result["recall"][RECALL_LIMITS[-1]]
+    int8_recall = result["recall_int8_vectors"][RECALL_LIMITS[-1]]
+    assert int8_recall == pytest.approx(float_recall, abs=0.05)
+
+
+def test_recall_without_queries():
+    task = RetrievalTask(batch(["A B"], ["C D"], [0]))
+    assert task.queries == []
+    with pytest.raises(ValueError):
+        task.recall(stub_encoder([]), stub_encoder(task.corpus))
+
+
+def test_sample_pairs(tmp_path: Path, pairs_frame: pd.DataFrame):
+    frame = pairs_frame.assign(left_name=pairs_frame["left_name"].str.upper())
+    path = write_pairs(frame, tmp_path / "pairs")
+    sample = sample_pairs(path, positives=100, negatives=50, min_score=0.8)
+    assert len(sample["label"]) == 150
+    assert sample["label"].sum() == 100
+    # Names are kept as they are, not normalized:
+    assert all(name.isupper() for name in sample["left"])
+    hard = frame[~frame["match"] & (frame["score"] > 0.8)]
+    expected = set(zip(hard["left_name"], hard["right_name"]))
+    negatives = sample["label"] == 0
+    assert set(zip(sample["left"][negatives], sample["right"][negatives])) <= expected
+
+
+def test_finetune_without_queries(tmp_path: Path, pairs_frame: pd.DataFrame):
+    pytest.importorskip("torch")
+    pytest.importorskip("sentence_transformers")
+    path = write_pairs(pairs_frame, tmp_path / "pairs")
+    args = ["finetune", str(path), "--positives", "2", "--negatives", "2"]
+    result = CliRunner().invoke(cli, args + ["--holdout", "0.01"])
+    assert result.exit_code == 1
+    assert "no retrieval task" in result.output
@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from qarin.match.features import TEXT_FEATURES, FeatureStore, compute_features
+from qarin.match.scorer import PairScorer
+
+NAMES = [
+    ("Q1", "Vladimir Putin"),
+    ("Q1", "Владимир Путин"),
+    ("Q2", "Müller GmbH"),
+    (None, "José María Aznar"),
+    ("Q3", ""),
+]
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> FeatureStore:
+    return FeatureStore.build(tmp_path / "store", NAMES, workers=1)
+
+
+def test_round_trip(store: FeatureStore):
+    assert len(store) == len(NAMES)
+    for name_id, (key, name) in enumerate(NAMES):
+        text, hashes = compute_features(key, name)
+        for feature in TEXT_FEATURES:
+            assert store.text(feature, name_id) == text[feature]
+        assert store.ngrams(name_id).tolist() == hashes
+        features = store.features(name_id)
+        assert features.name == name
+        assert features.key == (key or "")
+        assert features.latin == text["latin"].split()
+
+
+def test_reopen_and_columns(store: FeatureStore):
+    reopened = FeatureStore(store.path)
+    assert reopened.column("name") == [name for _, name in NAMES]
+    assert reopened.column("key", [2, 0]) == ["Q2", "Q1"]
+    assert isinstance(reopened.ngrams(0), np.memmap)
+
+
+def test_rejects_other_versions(store: FeatureStore):
+    meta_path = store.path / "meta.json"
+    meta = json.loads(meta_path.read_text())
+    meta["version"] = -1
+    meta_path.write_text(json.dumps(meta))
+    with pytest.raises(ValueError):
+        FeatureStore(store.path)
+
+
+def test_score_ids(store: FeatureStore):
+    scorer = PairScorer(prepare=str.lower, workers=1)
+    scores = scorer.score_ids(store, [0, 2, 0], [1, 3, 4])
+    latin = store.column("latin")
+    expected = scorer.compare(
+        np.array([latin[0], latin[2], latin[0]], dtype=object),
+        np.array([latin[1], latin[3], latin[4]], dtype=object),
+    )
+    np.testing.assert_allclose(scores, expected)
+    assert np.isnan(scores[2])
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from qarin.match.benchmark import treated_queries
+from qarin.match.index import NameIndex, fuse_candidates
+
+NAMES = [
+    ("Q1", "Vladimir Putin"),
+    ("Q2", "Vladimir Zelensky"),
+    ("Q3", "Angela Merkel"),
+    ("Q4", "Joe Biden"),
+    ("Q1", "Vladimir Vladimirovich Putin"),
+    ("Q5", "Acme Trading Company"),
+]
+
+
+@pytest.fixture
+def index() -> NameIndex:
+    return NameIndex.from_names(NAMES)
+
+
+def test_search_ranks_exact_name_first(index: NameIndex):
+    results = index.search("Angela Merkel")
+    assert results[0][0] == 2
+    assert results[0][1] == pytest.approx(1.0)
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_tolerates_typos(index: NameIndex):
+    results = index.search("Angela Merkl")
+    assert results[0][0] == 2
+
+
+def test_search_limit_and_unknown_terms(index: NameIndex):
+    assert len(index.search("Vladimir", limit=2)) == 2
+    assert index.search("zzzz qqqq") == []
+
+
+def test_search_keys_merges_names_of_a_key(index: NameIndex):
+    keys = [key for key, _ in index.search_keys("Vladimir Putin", limit=5)]
+    assert keys[0] == "Q1"
+    assert len(keys) == len(set(keys))
+
+
+def test_tokens_only_index():
+    index = NameIndex.from_names(NAMES, ngram_size=0)
+    assert index.search("Merkl") == []
+    assert index.search("Merkel")[0][0] == 2
+
+
+def test_index_is_frozen_after_build(index: NameIndex):
+    with pytest.raises(RuntimeError):
+        index.add("John Smith")
+    with pytest.raises(RuntimeError):
+        NameIndex().search("John Smith")
+
+
+def test_fuse_candidates():
+    first = [(1, 0.9), (2, 0.8), (3, 0.7)]
+    second = [(3, 12.0), (1, 4.0)]
+    assert fuse_candidates([first, second]) == [1, 3, 2]
+    assert fuse_candidates([first, second], limit=1) == [1]
+    assert fuse_candidates([]) == []
+
+
+def test_treated_queries_leaves_global_random_state():
+    names = [name for _, name in NAMES]
+    keys = [key for key, _ in NAMES]
+    random.seed(42)
+    expected = random.random()
+    random.seed(42)
+    queries = treated_queries(names, keys, n=4, seed=1)
+    assert random.random() == expected
+    assert queries == treated_queries(names, keys, n=4, seed=1)
+    assert len(queries) == 4
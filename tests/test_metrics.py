@@ -0,0 +1,239 @@
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qarin.evaluate.metrics import (
+    BOOTSTRAP_METRICS,
+    _paired_cells,
+    bootstrap,
+    metrics_at,
+    summary,
+    threshold_curve,
+)
+
+
+@pytest.fixture
+def results() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 600
+    match = rng.random(n) < 0.4
+    # Rounded scores, so that there are ties within and across labels:
+    score = np.round(np.clip(rng.normal(0.5 + 0.2 * match, 0.2), 0, 1), 1)
+    return pd.DataFrame(
+        {
+            "treatment": rng.choice(["noop", "swap", "typo"], size=n),
+            "locale": rng.choice(["en_US", "ru_RU"], size=n),
+            "match": match,
+            "score": score,
+        }
+    )
+
+
+def counts(frame: pd.DataFrame, threshold: float):
+    predicted = frame["score"] >= threshold
+    tp = int((predicted & frame["match"]).sum())
+    fp = int((predicted & ~frame["match"]).sum())
+    fn = int((~predicted & frame["match"]).sum())
+    tn = int((~predicted & ~frame["match"]).sum())
+    return tp, fp, fn, tn
+
+
+def brute_force(frame: pd.DataFrame) -> dict:
+    pos = frame.loc[frame["match"], "score"].to_numpy()
+    neg = frame.loc[~frame["match"], "score"].to_numpy()
+    # The probability that a positive outscores a negative, ties counting half:
+    wins = (pos[:, None] > neg[None, :]).sum() + 0.5 * (
+        pos[:, None] == neg[None, :]
+    ).sum()
+    average_precision, best_f1, prev_recall = 0.0, 0.0, 0.0
+    for threshold in sorted(frame["score"].unique(), reverse=True):
+        tp, fp, fn, _ = counts(frame, threshold)
+        recall = tp / (tp + fn)
+        average_precision += (recall - prev_recall) * tp / (tp + fp)
+        prev_recall = recall
+        best_f1 = max(best_f1, 2 * tp / (2 * tp + fp + fn))
+    return {
+        "roc_auc": wins / (len(pos) * len(neg)),
+        "pr_auc": average_precision,
+        "best_f1": best_f1,
+    }
+
+
+def test_summary_matches_brute_force(results: pd.DataFrame):
+    table = summary(results, by=["treatment", "locale"])
+    assert list(table.columns[:2]) == ["treatment", "locale"]
+    assert len(table) == 6
+    for row in table.itertuples():
+        group = results[
+            (results["treatment"] == row.treatment) & (results["locale"] == row.locale)
+        ]
+        expected = brute_force(group)
+        assert row.pairs == len(group)
+        assert row.roc_auc == pytest.approx(expected["roc_auc"])
+        assert row.pr_auc == pytest.approx(expected["pr_auc"])
+        assert row.best_f1 == pytest.approx(expected["best_f1"])
+    overall = summary(results).iloc[0]
+    assert overall["roc_auc"] == pytest.approx(brute_force(results)["roc_auc"])
+
+
+def test_metrics_at_matches_brute_force(results: pd.DataFrame):
+    thresholds = [0.75, 0.0, 0.3, 0.5, 1.1]
+    table = metrics_at(results, thresholds, by=["treatment", "locale"])
+    assert list(table.columns[:3]) == ["treatment", "locale", "threshold"]
+    groups = sorted(product(results["treatment"].unique(), ["en_US", "ru_RU"]))
+    assert len(table) == len(groups) * len(thresholds)
+    for row, ((treatment, locale), threshold) in zip(
+        table.itertuples(), product(groups, thresholds)
+    ):
+        assert (row.treatment, row.locale, row.threshold) == (
+            treatment,
+            locale,
+            threshold,
+        )
+        group = results[
+            (results["treatment"] == treatment) & (results["locale"] == locale)
+        ]
+        tp, fp, fn, tn = counts(group, threshold)
+        assert (row.tp, row.fp, row.fn, row.tn) == (tp, fp, fn, tn)
+        if tp:
+            assert row.f1 == pytest.approx(2 * tp / (2 * tp + fp + fn))
+
+
+def test_metrics_at_without_groups(results: pd.DataFrame):
+    table = metrics_at(results, 0.5)
+    assert list(table.columns[:2]) == ["threshold", "tp"]
+    tp, fp, fn, tn = counts(results, 0.5)
+    assert table.iloc[0][["tp", "fp", "fn", "tn"]].tolist() == [tp, fp, fn, tn]
+    assert table.iloc[0]["precision"] == pytest.approx(tp / (tp + fp))
+
+
+def test_threshold_curve_matches_brute_force(results: pd.DataFrame):
+    curve = threshold_curve(results, by="locale")
+    for row in curve.itertuples():
+        group = results[results["locale"] == row.locale]
+        assert (row.tp, row.fp, row.fn, row.tn) == counts(group, row.threshold)
+    thresholds = curve.loc[curve["locale"] == "en_US", "threshold"].tolist()
+    assert thresholds == sorted(set(thresholds), reverse=True)
+
+
+@pytest.mark.parametrize("by", [None, "treatment", ["treatment", "locale"]])
+def test_empty_results(results: pd.DataFrame, by):
+    empty = results.iloc[:0]
+    for table, full in (
+        (summary(empty, by=by), summary(results, by=by)),
+        (summary(empty, by=by, threshold=0.5), summary(results, by=by, threshold=0.5)),
+        (threshold_curve(empty, by=by), threshold_curve(results, by=by)),
+        (metrics_at(empty, [0.5], by=by), metrics_at(results, [0.5], by=by)),
+    ):
+        assert table.empty
+        assert list(table.columns) == list(full.columns)
+
+
+@pytest.fixture
+def paired(results: pd.DataFrame) -> pd.DataFrame:
+    """The same pairs scored by two matchers, `b` agreeing with `a` mostly."""
+    rng = np.random.default_rng(1)
+    noise = rng.normal(0, 0.15, size=len(results))
+    other = results.assign(score=np.clip(results["score"] + noise, 0, 1))
+    return pd.concat(
+        [results.assign(matcher="a"), other.assign(matcher="b")], ignore_index=True
+    )
+
+
+def naive_bootstrap(frame: pd.DataFrame, threshold: float, resamples: int, seed: int):
+    """Resample the rows themselves, the reference for `bootstrap`."""
+    rng = np.random.default_rng(seed)
+    values = []
+    for _ in range(resamples):
+        sample = frame.iloc[rng.integers(0, len(frame), size=len(frame))]
+        tp, fp, fn, tn = counts(sample, threshold)
+        values.append([tp / (tp + fp), tp / (tp + fn), 2 * tp / (2 * tp + fp + fn)])
+    return np.quantile(np.array(values), [0.025, 0.975], axis=0)
+
+
+def test_bootstrap_matches_naive_resampling(results: pd.DataFrame):
+    table = bootstrap(results, 0.6, by=None, resamples=2000, seed=3)
+    expected = naive_bootstrap(results, 0.6, resamples=2000, seed=4)
+    table = table.set_index("metric")
+    for col, metric in enumerate(["precision", "recall", "f1"]):
+        lower, upper = table.loc[metric, ["lower", "upper"]]
+        assert lower == pytest.approx(expected[0, col], abs=0.015)
+        assert upper == pytest.approx(expected[1, col], abs=0.015)
+        assert lower < table.loc[metric, "estimate"] < upper
+
+
+def test_bootstrap_estimates_match_summary(paired: pd.DataFrame):
+    by = ["treatment", "locale"]
+    table = bootstrap(paired, 0.5, by=by, resamples=50)
+    columns = ["matcher", "metric", "estimate", "lower", "upper"]
+    assert list(table.columns) == by + columns
+    expected = summary(paired, by=by + ["matcher"], threshold=0.5)
+    wide = table.pivot_table(
+        index=by + ["matcher"], columns="metric", values="estimate"
+    ).reset_index()
+    merged = expected.merge(wide, on=by + ["matcher"], suffixes=("", "_boot"))
+    assert len(merged) == len(expected) == 12
+    for metric in BOOTSTRAP_METRICS:
+        np.testing.assert_allclose(merged[metric], merged[f"{metric}_boot"])
+    # Without groups, there is one row per matcher and metric:
+    table = bootstrap(paired, 0.5, by=None, resamples=50)
+    assert list(table.columns) == columns
+    assert len(table) == 2 * len(BOOTSTRAP_METRICS)
+
+
+def test_paired_cells():
+    frame = pd.DataFrame(
+        {
+            "matcher": ["a"] * 4 + ["b"] * 4,
+            "match": [True, True, False, False] * 2,
+            "score": [0.9, 0.1, 0.9, 0.1, 0.1, 0.9, 0.1, 0.9],
+            "treatment": ["x", "x", "y", "y"] * 2,
+        }
+    )
+    cells, matchers = _paired_cells(
+        frame, 0.5, "treatment", "score", "match", "matcher"
+    )
+    assert matchers == ["a", "b"]
+    # tp, fn, fp, tn for `a`, the opposite for `b` in the second digit:
+    assert cells["_joint"].tolist() == [0 + 4 * 1, 1 + 4 * 0, 2 + 4 * 3, 3 + 4 * 2]
+    assert cells["treatment"].tolist() == ["x", "x", "y", "y"]
+    with pytest.raises(ValueError):
+        bootstrap(frame.iloc[:-1], 0.5, by=None, resamples=10)
+    with pytest.raises(ValueError):
+        bootstrap(frame, 0.5, by=None, resamples=10, baseline="c")
+
+
+def test_bootstrap_differences(paired: pd.DataFrame):
+    table = bootstrap(paired, 0.5, by="treatment", resamples=500, baseline="a")
+    assert set(table["matcher"]) == {"a", "b", "b - a"}
+    table = table.set_index(["treatment", "metric", "matcher"])
+    estimates = table["estimate"]
+    for treatment, metric in product(["noop", "swap", "typo"], BOOTSTRAP_METRICS):
+        diff = estimates[treatment, metric, "b - a"]
+        expected = estimates[treatment, metric, "b"] - estimates[treatment, metric, "a"]
+        assert diff == pytest.approx(expected)
+        # The pairing makes the interval of the difference narrower than what
+        # the two separate intervals suggest:
+        lower, upper = table.loc[(treatment, metric, "b - a"), ["lower", "upper"]]
+        widths = [
+            table.loc[(treatment, metric, m), "upper"]
+            - table.loc[(treatment, metric, m), "lower"]
+            for m in ("a", "b")
+        ]
+        assert lower <= diff <= upper
+        assert upper - lower < sum(widths)
+    # A matcher compared to itself differs by exactly nothing:
+    same = pd.concat([paired[paired["matcher"] == "a"].assign(matcher=m) for m in "ac"])
+    diffs = bootstrap(same, 0.5, by=None, resamples=100, baseline="a")
+    diffs = diffs[diffs["matcher"] == "c - a"]
+    assert (diffs[["estimate", "lower", "upper"]].to_numpy() == 0).all()
+
+
+def test_bootstrap_in_workers(paired: pd.DataFrame):
+    serial = bootstrap(paired, 0.5, resamples=600, baseline="a", seed=7)
+    pooled = bootstrap(paired, 0.5, resamples=600, baseline="a", seed=7, workers=2)
+    pd.testing.assert_frame_equal(serial, pooled)
+    other = bootstrap(paired, 0.5, resamples=600, baseline="a", seed=8)
+    assert not serial["lower"].equals(other["lower"])
@@ -0,0 +1,61 @@
+import pytest
+from jellyfish import metaphone
+
+from qarin.match.index import NameIndex, fuse_candidates
+from qarin.match.phonetic import PHONETIC_ALGORITHMS, PhoneticIndex
+
+NAMES = [
+    ("Q1", "Pablo Picasso"),
+    ("Q2", "Joan Miro"),
+    ("Q3", "Salvador Dali"),
+    ("Q4", "Pablo Neruda"),
+    ("Q5", "ACME 123"),
+]
+
+
+@pytest.fixture
+def index() -> PhoneticIndex:
+    return PhoneticIndex.from_names(NAMES)
+
+
+def test_name_terms(index: PhoneticIndex):
+    assert index.name_terms("Pablo Picasso") == [
+        metaphone("pablo"),
+        metaphone("picasso"),
+    ]
+    assert index.name_terms("Picaso") == index.name_terms("Picasso")
+    # Short and non-alphabetic tokens are not encoded:
+    assert index.name_terms("J 123") == []
+
+
+def test_search_finds_spelling_variants(index: PhoneticIndex):
+    results = index.search("Pablo Picaso")
+    assert results[0][0] == 0
+    assert {name_id for name_id, _ in results} == {0, 3}
+    assert index.search("Xyz Qqq") == []
+
+
+def test_block(index: PhoneticIndex):
+    assert index.block("Pablo").tolist() == [0, 3]
+    assert index.block("Salvadore Dalí").tolist() == [2]
+    assert index.block("123").tolist() == []
+    with pytest.raises(RuntimeError):
+        PhoneticIndex().block("Pablo")
+
+
+@pytest.mark.parametrize("algorithm", sorted(PHONETIC_ALGORITHMS))
+def test_algorithms(algorithm: str):
+    index = PhoneticIndex.from_names(NAMES, algorithm=algorithm)
+    assert index.search("Joan Mirow")[0][0] == 1
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        PhoneticIndex(algorithm="caverphone")
+
+
+def test_fuse_with_name_index(index: PhoneticIndex):
+    names = NameIndex.from_names(NAMES)
+    query = "Pablo Picaso"
+    fused = fuse_candidates([names.search(query), index.search(query)], limit=2)
+    assert fused[0] == 0
@@ -0,0 +1,145 @@
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import duckdb
+import pytest
+
+from pipeline import Stage, run_pipeline
+
+Calls = List[Tuple[str, Dict[str, Any]]]
+
+
+@pytest.fixture
+def con() -> duckdb.DuckDBPyConnection:
+    return duckdb.connect()
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> Path:
+    path = tmp_path / "statements.csv"
+    path.write_text("name\nJohn Smith\n")
+    return path
+
+
+def make_stages(
+    con: duckdb.DuckDBPyConnection,
+    calls: Calls,
+    source: Path,
+    limit: int = 10,
+    fail: Tuple[str, ...] = (),
+) -> List[Stage]:
+    """load -> names -> pairs -> export, where `names` and `pairs` are
+    incremental; each stage records its call and creates its table."""
+
+    def stage(name: str):
+        def func(**kwargs):
+            calls.append((name, kwargs))
+            if name in fail:
+                raise RuntimeError(f"{name} failed")
+            con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT 1 AS x;")
+
+        return func
+
+    return [
+        Stage("load", stage("load"), params={"path": source}, table="load"),
+        Stage("names", stage("names"), ["load"], table="names", incremental=True),
+        Stage(
+            "pairs",
+            stage("pairs"),
+            ["names"],
+            params={"limit": limit},
+            table="pairs",
+            incremental=True,
+        ),
+        Stage("export", stage("export"), ["pairs"], table="export"),
+    ]
+
+
+def run(con: duckdb.DuckDBPyConnection, source: Path, **kwargs) -> Calls:
+    calls: Calls = []
+    options = {k: kwargs.pop(k) for k in ("limit", "fail") if k in kwargs}
+    run_pipeline(con, make_stages(con, calls, source, **options), **kwargs)
+    return calls
+
+
+def names(calls: Calls) -> List[str]:
+    return [name for name, _ in calls]
+
+
+def test_up_to_date_stages_are_skipped(con: duckdb.DuckDBPyConnection, source: Path):
+    assert names(run(con, source)) == ["load", "names", "pairs", "export"]
+    assert run(con, source) == []
+    rows = con.execute("SELECT name, row_count FROM stages ORDER BY name;").fetchall()
+    assert rows == [("export", 1), ("load", 1), ("names", 1), ("pairs", 1)]
+    # Changed parameters re-run the stage and everything downstream of it:
+    assert names(run(con, source, limit=20)) == ["pairs", "export"]
+    source.write_text("name\nJohn Smith\nJon Smith\n")
+    assert names(run(con, source, limit=20)) == ["load", "names", "pairs", "export"]
+    # A stage whose table is gone is re-run from the same inputs:
+    con.execute("DROP TABLE names;")
+    assert names(run(con, source, limit=20)) == ["names"]
+    forced = run(con, source, limit=20, force=True)
+    assert names(forced) == ["load", "names", "pairs", "export"]
+
+
+def test_targets(con: duckdb.DuckDBPyConnection, source: Path):
+    assert names(run(con, source, targets=["names"])) == ["load", "names"]
+    assert names(run(con, source)) == ["pairs", "export"]
+    with pytest.raises(ValueError):
+        run(con, source, targets=["unknown"])
+
+
+def test_resume_after_failure(con: duckdb.DuckDBPyConnection, source: Path):
+    with pytest.raises(RuntimeError):
+        run(con, source, fail=("pairs",))
+    done = con.execute("SELECT name FROM stages ORDER BY name;").fetchall()
+    assert done == [("load",), ("names",)]
+    calls = run(con, source)
+    assert names(calls) == ["pairs", "export"]
+    # The failed stage did not produce full results before:
+    assert calls[0][1] == {"limit": 10, "incremental": False}
+
+
+def test_incremental_flag(con: duckdb.DuckDBPyConnection, source: Path):
+    calls = run(con, source, incremental=True)
+    # Nothing was built before, so everything is built in full:
+    assert [kwargs.get("incremental") for _, kwargs in calls] == [
+        None,
+        False,
+        False,
+        None,
+    ]
+    source.write_text("name\nJohn Smith\nJon Smith\n")
+    calls = run(con, source, incremental=True)
+    assert [kwargs.get("incremental") for _, kwargs in calls] == [
+        None,
+        True,
+        True,
+        None,
+    ]
+    source.write_text("name\nJohn Smith\n")
+    calls = run(con, source)
+    assert [kwargs.get("incremental") for _, kwargs in calls] == [
+        None,
+        False,
+        False,
+        None,
+    ]
+
+
+def test_full_rebuild_is_passed_downstream(
+    con: duckdb.DuckDBPyConnection, source: Path
+):
+    run(con, source)
+    source.write_text("name\nJohn Smith\nJon Smith\n")
+    # The names table is gone, so `names` is rebuilt in full; `pairs` has to
+    # follow, although its own parameters and output are unchanged:
+    con.execute("DROP TABLE names;")
+    calls = run(con, source, incremental=True)
+    assert dict(calls)["names"] == {"incremental": False}
+    assert dict(calls)["pairs"] == {"limit": 10, "incremental": False}
+    # Changed parameters of `pairs` only rebuild `pairs` in full:
+    source.write_text("name\nJohn Smith\n")
+    calls = run(con, source, incremental=True, limit=20)
+    assert dict(calls)["names"] == {"incremental": True}
+    assert dict(calls)["pairs"] == {"limit": 20, "incremental": False}
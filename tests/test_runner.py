@@ -0,0 +1,133 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+import httpx
+import numpy as np
+import pandas as pd
+import pytest
+
+from qarin.evaluate.runner import (
+    HttpMatcher,
+    Matcher,
+    ScorerMatcher,
+    fixture_pairs,
+    run_evaluation,
+)
+
+NAMES = ["John Smith", "Maria Garcia", "Olga Ivanova", "Ahmed Hassan"]
+
+
+def person(name: str) -> Dict[str, Any]:
+    return {"id": name.lower(), "schema": "Person", "properties": {"name": [name]}}
+
+
+@pytest.fixture
+def fixtures_path(tmp_path: Path) -> Path:
+    fixtures = [
+        {
+            "locale": "en_US",
+            "original": person(name),
+            "changed": {"noop": person(name), "upper": person(name.upper())},
+        }
+        for name in NAMES
+    ]
+    path = tmp_path / "fixtures.json"
+    path.write_text(json.dumps(fixtures))
+    return path
+
+
+class ExactMatcher(Matcher):
+    """Scores 1.0 for identical names, ignoring case."""
+
+    name = "exact"
+    parallel = False
+
+    def score(self, left: Dict[str, Any], right: Dict[str, Any]) -> float:
+        left_names = left["properties"]["name"]
+        right_names = right["properties"]["name"]
+        return float(left_names[0].lower() == right_names[0].lower())
+
+
+def test_fixture_pairs(fixtures_path: Path):
+    pairs = fixture_pairs(fixtures_path)
+    assert len(pairs) == len(NAMES) * 2 * 2
+    assert pairs["match"].sum() == len(NAMES) * 2
+    negatives = pairs[~pairs["match"]]
+    assert (negatives["left_name"] != negatives["right_name"].str.title()).all()
+
+
+def test_run_evaluation(fixtures_path: Path, tmp_path: Path):
+    output = tmp_path / "results.parquet"
+    results = run_evaluation(fixtures_path, [ExactMatcher()], output_path=output)
+    assert list(results.columns[:1]) == ["matcher"]
+    assert (results["matcher"] == "exact").all()
+    np.testing.assert_array_equal(results["score"], results["match"].astype(float))
+    assert (results["latency_ms"] >= 0).all()
+    assert not results["cached"].any()
+    pd.testing.assert_frame_equal(pd.read_parquet(output), results)
+
+
+def test_run_evaluation_in_workers(fixtures_path: Path):
+    matchers = [ExactMatcher(), ScorerMatcher()]
+    results = run_evaluation(fixtures_path, matchers, negatives=False, workers=2)
+    assert results.groupby("matcher").size().to_dict() == {
+        "exact": len(NAMES) * 2,
+        "scorer:levenshtein=1": len(NAMES) * 2,
+    }
+    assert (results["score"] > 0.5).all()
+
+
+def test_run_evaluation_with_cache(fixtures_path: Path, tmp_path: Path):
+    cache = tmp_path / "scores.sqlite"
+    first = run_evaluation(fixtures_path, [ExactMatcher()], cache_path=cache)
+    second = run_evaluation(fixtures_path, [ExactMatcher()], cache_path=cache)
+    assert second["cached"].all()
+    assert second["latency_ms"].isna().all()
+    np.testing.assert_array_equal(first["score"], second["score"])
+
+
+def test_matcher_implements_score_by_score_pairs():
+    matcher = ScorerMatcher()
+    assert matcher.score(person("John Smith"), person("John Smith")) == 1.0
+    assert ExactMatcher().score_pairs([(person("A B"), person("a b"))])[0] == [1.0]
+    with pytest.raises(TypeError):
+
+        class IncompleteMatcher(Matcher):
+            name = "incomplete"
+
+
+def test_scorer_matcher_names():
+    assert ScorerMatcher().name == "scorer:levenshtein=1"
+    half = ScorerMatcher({"levenshtein": 0.5, "jaro_winkler": 0.5})
+    other = ScorerMatcher({"levenshtein": 0.8, "jaro_winkler": 0.2})
+    assert half.name == "scorer:jaro_winkler=0.5,levenshtein=0.5"
+    assert half.name != other.name
+    assert ScorerMatcher(name="custom").name == "custom"
+
+
+def match_api(request: httpx.Request) -> httpx.Response:
+    """Return the lower-cased name of each query as the ID of its one result."""
+    queries = json.loads(request.content)["queries"]
+    responses = {
+        qid: {"results": [{"id": query["properties"]["name"][0].lower(), "score": 0.8}]}
+        for qid, query in queries.items()
+    }
+    return httpx.Response(200, json={"responses": responses})
+
+
+def test_http_matcher():
+    matcher = HttpMatcher(transport=httpx.MockTransport(match_api), batch_size=2)
+    pairs = [(person(a), person(b)) for a in NAMES[:2] for b in NAMES[:3]]
+    expected = [0.8, 0.0, 0.0, 0.0, 0.8, 0.0]
+    scores, latencies = matcher.score_pairs(pairs)
+    assert scores == expected
+    assert len(latencies) == len(pairs)
+
+    # As in a notebook, where an event loop is already running:
+    async def in_loop():
+        return matcher.score_pairs(pairs)
+
+    scores, _ = asyncio.run(in_loop())
+    assert scores == expected
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from rapidfuzz import fuzz
+from rapidfuzz.distance import JaroWinkler, Levenshtein
+
+from qarin.match.scorer import PairScorer
+
+LEFTS = ["John Smith", "Maria Garcia", "ACME Trading Ltd", "Olga Ivanova", "Wei Chen"]
+RIGHTS = ["Jon Smith", "Garcia Maria", "Acme Trading Limited", "Olga Ivanova", "X"]
+
+
+def reference(left: str, right: str) -> dict:
+    left, right = left.lower(), right.lower()
+    return {
+        "levenshtein": Levenshtein.normalized_similarity(left, right),
+        "jaro_winkler": JaroWinkler.normalized_similarity(left, right),
+        "token_set": fuzz.token_set_ratio(left, right) / 100,
+        "token_sort": fuzz.token_sort_ratio(left, right) / 100,
+        "wratio": fuzz.WRatio(left, right) / 100,
+    }
+
+
+@pytest.mark.parametrize(
+    "metric", ["levenshtein", "jaro_winkler", "token_set", "token_sort", "wratio"]
+)
+def test_metrics_match_rapidfuzz(metric: str):
+    scorer = PairScorer(weights={metric: 1.0}, prepare=str.lower, workers=1)
+    expected = [reference(lt, rt)[metric] for lt, rt in zip(LEFTS, RIGHTS)]
+    np.testing.assert_allclose(scorer.score(LEFTS, RIGHTS), expected, rtol=1e-5)
+
+
+def test_weighted_metrics():
+    weights = {"levenshtein": 3.0, "token_set": 1.0}
+    scorer = PairScorer(weights=weights, prepare=str.lower, workers=1)
+    expected = [
+        (3 * ref["levenshtein"] + ref["token_set"]) / 4
+        for ref in (reference(lt, rt) for lt, rt in zip(LEFTS, RIGHTS))
+    ]
+    np.testing.assert_allclose(scorer.score(LEFTS, RIGHTS), expected, rtol=1e-5)
+
+
+def test_missing_names_and_cache():
+    scorer = PairScorer(prepare=str.lower, workers=1)
+    scores = scorer.score(["John Smith", None, "John Smith"], ["Jon Smith", "A", ""])
+    assert scores[0] == pytest.approx(0.9)
+    assert np.isnan(scores[1]) and np.isnan(scores[2])
+    assert scorer.misses == 4
+    scorer.score(["John Smith"], ["Jon Smith"])
+    assert scorer.misses == 4
+    assert scorer.hits == 2
+
+
+def test_rejects_unknown_metric_and_uneven_sides():
+    with pytest.raises(ValueError):
+        PairScorer(weights={"soundex": 1.0})
+    with pytest.raises(ValueError):
+        PairScorer(prepare=str.lower).score(["a", "b"], ["a"])
+
+
+def test_score_pairs_file(pairs_path: Path, pairs_frame: pd.DataFrame):
+    scorer = PairScorer(prepare=str.lower, workers=1)
+    result = scorer.score_pairs_file(
+        pairs_path, match=True, category="PER", columns=["pair_id", "match"]
+    )
+    expected = pairs_frame[pairs_frame["match"] & (pairs_frame["category"] == "PER")]
+    assert sorted(result["pair_id"]) == sorted(expected["pair_id"])
+    assert result["match"].all()
+    merged = result.merge(expected, on="pair_id")
+    reference_scores = [
+        Levenshtein.normalized_similarity(lt.lower(), rt.lower())
+        for lt, rt in zip(merged["left_name"], merged["right_name"])
+    ]
+    np.testing.assert_allclose(merged["score_x"], reference_scores, rtol=1e-5)